@@ -0,0 +1,4 @@
+from dotenv import load_dotenv
+
+# Carica le variabili d'ambiente una sola volta per tutto il package
+load_dotenv()
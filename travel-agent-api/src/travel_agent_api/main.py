@@ -1,11 +1,54 @@
-from fastapi import FastAPI
+import time
+
+# Riferimento per misurare il tempo dall'avvio alla prima risposta di /health
+_STARTED_AT = time.perf_counter()
+
+import sys
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
 from .routes.chat_route import router as chat_router
+from .routes.image_route import router as image_router
+from .routes.document_route import router as document_router
+from .routes.hotel_route import router as hotel_router
+from .routes.admin_route import router as admin_router
+from .routes.guide_route import router as guide_router
+from .routes.airport_route import router as airport_router
+from .services.tool_registry import WARMUP_ON_STARTUP, tool_registry
+from .services.serialization import FastJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
+_startup_stats = {"import_seconds": round(time.perf_counter() - _STARTED_AT, 4), "first_health_seconds": None}
+
+
+def _loaded(module: str):
+    """Restituisce un modulo del package solo se già importato (senza forzarne il caricamento)"""
+    return sys.modules.get(f"{__package__}.{module}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # I tool e gli SDK pesanti vengono caricati in background: /health risponde subito
+    if WARMUP_ON_STARTUP:
+        tool_registry.start_background_warm_up()
+    # Pre-caricamento giornaliero delle ricerche più richieste (fascia CACHE_WARMER_HOURS)
+    from .services.cache_warmer import CACHE_WARMER_ENABLED, cache_warmer
+    if CACHE_WARMER_ENABLED:
+        cache_warmer.start()
+    yield
+    cache_warmer.stop()
+    # Chiude le connessioni HTTP condivise dei client LLM
+    llm_registry_module = _loaded("services.llm_registry")
+    if llm_registry_module is not None:
+        await llm_registry_module.llm_registry.aclose()
+
+
 app = FastAPI(
     title="Travel Agent API",
     description="API per l'assistente di viaggio con AI",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan,
+    # Risposte JSON serializzate con orjson (payload di hotel, voli e blocchi)
+    default_response_class=FastJSONResponse,
 )
 
 @app.get("/")
@@ -14,6 +57,9 @@ def read_root():
 
 @app.get("/health")
 def health_check():
+    # Liveness: non dipende dal caricamento dei tool
+    if _startup_stats["first_health_seconds"] is None:
+        _startup_stats["first_health_seconds"] = round(time.perf_counter() - _STARTED_AT, 4)
     return {
         "status": "healthy",
         "services": {
@@ -22,6 +68,66 @@ def health_check():
         }
     }
 
+@app.get("/ready")
+def readiness_check(response: Response):
+    # Readiness: pronto solo quando tool, SDK e client LLM sono caricati senza errori
+    ready = tool_registry.ready
+    if not ready:
+        response.status_code = 503
+    return {
+        "status": "ready" if ready else "warm_up_failed" if tool_registry.failed else "warming_up",
+        "startup": _startup_stats,
+        "tools": tool_registry.stats(),
+    }
+
+@app.get("/metrics")
+def metrics():
+    llm_registry_module = _loaded("services.llm_registry")
+    model_router_module = _loaded("services.model_router")
+    documents_module = _loaded("services.document_ingestion")
+    vector_index_module = _loaded("services.vector_index")
+    knowledge_base_module = _loaded("services.knowledge_base")
+    admission_module = _loaded("services.admission_control")
+    resilience_module = _loaded("services.resilience")
+    scheduler_module = _loaded("services.llm_scheduler")
+    answer_cache_module = _loaded("services.answer_cache")
+    tool_cache_module = _loaded("services.tool_cache")
+    cache_warmer_module = _loaded("services.cache_warmer")
+    hotel_cursor_module = _loaded("services.hotel_cursor")
+    profiler_module = _loaded("services.request_profiler")
+    guide_store_module = _loaded("services.guide_store")
+    image_handles_module = _loaded("services.image_handles")
+    history_module = _loaded("services.history_compaction")
+    airports_module = _loaded("services.airports")
+    airport_index = airports_module.get_airport_index() if airports_module else None
+    route_module = _loaded("services.route_optimizer")
+    poi_module = _loaded("services.poi_index")
+    poi_index = poi_module.get_poi_index() if poi_module else None
+    knowledge_base = knowledge_base_module.get_knowledge_base() if knowledge_base_module else None
+    return {
+        "startup": _startup_stats,
+        "admission": admission_module.admission_controller.stats() if admission_module else None,
+        "answer_cache": answer_cache_module.answer_cache.stats() if answer_cache_module else None,
+        "tool_cache": tool_cache_module.tool_cache.stats() if tool_cache_module else None,
+        "cache_warmer": cache_warmer_module.cache_warmer.stats() if cache_warmer_module else None,
+        "hotel_cursors": hotel_cursor_module.hotel_cursors.stats() if hotel_cursor_module else None,
+        "guides": guide_store_module.guide_store.stats() if guide_store_module else None,
+        "image_handles": image_handles_module.image_handles.stats() if image_handles_module else None,
+        "history": history_module.history_compactor.stats() if history_module else None,
+        "airports": airport_index.stats() if airport_index else None,
+        "routes": route_module.route_optimizer.stats() if route_module else None,
+        "pois": poi_index.stats() if poi_index else None,
+        "tools": tool_registry.stats(),
+        "llm_rate_limits": scheduler_module.llm_scheduler.stats() if scheduler_module else None,
+        "upstreams": resilience_module.resilience_stats() if resilience_module else None,
+        "llm_clients": llm_registry_module.llm_registry.stats() if llm_registry_module else None,
+        "model_routing": model_router_module.model_router.stats() if model_router_module else None,
+        "documents": documents_module.get_document_ingestor().stats() if documents_module else None,
+        "vector_index": vector_index_module.get_vector_index().stats() if vector_index_module else None,
+        "knowledge_base": knowledge_base.stats() if knowledge_base else None,
+        "profiling": profiler_module.profile_store.stats() if profiler_module else None,
+    }
+
 @app.get("/services")
 def list_services():
     return {
@@ -49,18 +155,25 @@ def list_tools():
         "available_tools": [
             {
                 "name": "flights_finder",
-                "description": "Trova voli usando SerpAPI Google Flights",
+                "description": "Trova voli usando SerpAPI Google Flights (codici IATA o nomi di città)",
                 "endpoint": "/chat/travel-agent",
                 "status": "available",
                 "requirements": ["SERPAPI_API_KEY"]
             },
             {
                 "name": "hotels_finder", 
-                "description": "Trova hotel using SerpAPI Google Hotels",
+                "description": "Trova hotel using SerpAPI Google Hotels (prima pagina e cursore per le successive)",
                 "endpoint": "/chat/travel-agent",
                 "status": "available", 
                 "requirements": ["SERPAPI_API_KEY"]
             },
+            {
+                "name": "hotels_next_page",
+                "description": "Altri hotel di una ricerca già fatta, scaricati solo su richiesta",
+                "endpoint": "/hotels/cursors/{cursor}",
+                "status": "available",
+                "requirements": ["SERPAPI_API_KEY"]
+            },
             {
                 "name": "images_finder",
                 "description": "Cerca immagini di destinazioni usando SerpAPI Google Images",
@@ -74,6 +187,13 @@ def list_tools():
                     "Street view e mappe visive"
                 ]
             },
+            {
+                "name": "images_batch",
+                "description": "Immagini di più attrazioni in una sola chiamata, restituite al modello come segnaposto [img:...]",
+                "endpoint": "/chat/travel-agent",
+                "status": "available",
+                "requirements": ["SERPAPI_API_KEY"]
+            },
             {
                 "name": "chain_historical_expert",
                 "description": "Esperto storico per informazioni sui luoghi",
@@ -87,9 +207,16 @@ def list_tools():
                 "endpoint": "/chat/travel-agent", 
                 "status": "available",
                 "requirements": ["OPENAI_API_KEY"]
+            },
+            {
+                "name": "travel_documents_search",
+                "description": "Cerca nei documenti caricati e negli itinerari già generati (indice vettoriale locale)",
+                "endpoint": "/chat/travel-agent",
+                "status": "available",
+                "requirements": []
             }
         ],
-        "total_tools": 5
+        "total_tools": 8
     }
 
 origins = ["http://127.0.0.1:8000", "http://localhost:8000"]
@@ -107,3 +234,39 @@ app.include_router(
     tags=["Chat"],
     prefix="/chat",
 )
+
+app.include_router(
+    image_router,
+    tags=["Images"],
+    prefix="/images",
+)
+
+app.include_router(
+    document_router,
+    tags=["Documents"],
+    prefix="/documents",
+)
+
+app.include_router(
+    hotel_router,
+    tags=["Hotels"],
+    prefix="/hotels",
+)
+
+app.include_router(
+    guide_router,
+    tags=["Guides"],
+    prefix="/guides",
+)
+
+app.include_router(
+    airport_router,
+    tags=["Airports"],
+    prefix="/airports",
+)
+
+app.include_router(
+    admin_router,
+    tags=["Admin"],
+    prefix="/admin",
+)
@@ -0,0 +1,67 @@
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import FileResponse
+from typing import Optional
+
+router = APIRouter()
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Consente l'accesso solo con il token amministratore (PROFILING_ADMIN_TOKEN)"""
+    from ..services.request_profiler import is_admin, profiling_enabled
+
+    if not profiling_enabled():
+        raise HTTPException(status_code=404, detail="Profilazione non abilitata")
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Token amministratore non valido")
+
+
+@router.get("/profiles", dependencies=[Depends(require_admin)])
+def list_profiles():
+    """
+    Elenca i profili salvati, dal più recente.
+    Returns:
+        dict: Id, etichetta, durata e picco di memoria di ogni profilo
+    """
+    from ..services.request_profiler import profile_store
+
+    profiles = profile_store.list()
+    return {"profiles": profiles, "total": len(profiles)}
+
+
+@router.get("/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+def get_profile(profile_id: str):
+    """
+    Restituisce il riepilogo di un profilo.
+    Args:
+        profile_id (str): Id restituito in `profile_id` dalla chat
+    Returns:
+        dict: Funzioni più costose (tempo cumulativo e proprio) e allocazioni più grandi
+    Raises:
+        HTTPException: 404 se il profilo non esiste
+    """
+    from ..services.request_profiler import ProfileNotFound, profile_store
+
+    try:
+        return profile_store.get(profile_id)
+    except ProfileNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@router.get("/profiles/{profile_id}/download", dependencies=[Depends(require_admin)])
+def download_profile(profile_id: str):
+    """
+    Scarica il profilo cProfile completo (formato pstats, es. `snakeviz profilo.prof`).
+    Args:
+        profile_id (str): Id del profilo
+    Returns:
+        FileResponse: Il file .prof
+    Raises:
+        HTTPException: 404 se il profilo non esiste
+    """
+    from ..services.request_profiler import ProfileNotFound, profile_store
+
+    try:
+        path = profile_store.stats_path(profile_id)
+    except ProfileNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
@@ -0,0 +1,63 @@
+from fastapi import APIRouter, HTTPException, Query
+
+router = APIRouter()
+
+
+@router.get("/resolve")
+def resolve_airport(q: str = Query(..., min_length=2, description="Codice IATA o nome della città")):
+    """
+    Risolve un codice IATA o una città negli aeroporti usati da flights_finder.
+    Args:
+        q (str): Codice (es. "FCO") o città (es. "Roma", "Londra Gatwick")
+    Returns:
+        dict: Codici IATA e dettagli degli aeroporti
+    Raises:
+        HTTPException: 404 con i suggerimenti se nulla corrisponde, 503 se l'indice non è disponibile
+    """
+    # Import lazy: l'indice (NumPy) viene caricato alla prima ricerca
+    from ..services.airports import AirportNotFound, get_airport_index
+
+    index = get_airport_index()
+    if index is None:
+        raise HTTPException(status_code=503, detail="Indice aeroporti non disponibile")
+    try:
+        codes = index.resolve(q)
+    except AirportNotFound as e:
+        raise HTTPException(status_code=404, detail={"message": str(e), "suggestions": e.suggestions})
+    return {
+        "query": q,
+        "codes": codes,
+        "airports": [airport.model_dump() for airport in map(index.get, codes) if airport is not None],
+    }
+
+
+@router.get("/nearest")
+def nearest_airports(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    k: int = Query(3, ge=1, le=20, description="Aeroporti da restituire"),
+    max_km: float = Query(None, gt=0, description="Distanza massima in km"),
+):
+    """
+    Restituisce gli aeroporti più vicini a un punto.
+    Args:
+        lat (float): Latitudine in gradi
+        lon (float): Longitudine in gradi
+        k (int): Numero di aeroporti
+        max_km (float): Raggio massimo della ricerca
+    Returns:
+        dict: Aeroporti ordinati per distanza
+    Raises:
+        HTTPException: 503 se l'indice non è disponibile
+    """
+    from ..services.airports import get_airport_index
+
+    index = get_airport_index()
+    if index is None:
+        raise HTTPException(status_code=503, detail="Indice aeroporti non disponibile")
+    return {
+        "airports": [
+            {**airport.model_dump(), "distance_km": distance}
+            for airport, distance in index.nearest(lat, lon, k, max_km)
+        ]
+    }
@@ -1,12 +1,28 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from ..services.agent_service import Agent
+from fastapi import APIRouter, Header, HTTPException
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
+import time
+from typing import List, Literal, Optional
+from ..services.chat_messages import ChatMessage, dump_messages
 
 router = APIRouter()
 
 
 class ChatCompletionRequest(BaseModel):
-    messages: list
+    # Validati qui una volta: l'agente e la cache li usano già tipizzati
+    messages: List[ChatMessage] = Field(min_length=1)
+    # Identificativi opzionali per riprendere un'esecuzione interrotta
+    conversation_id: Optional[str] = None
+    request_id: Optional[str] = None
+    # Documenti caricati su /documents da usare come contesto
+    document_ids: Optional[List[str]] = None
+    # interactive (utente in attesa) oppure batch (job in background, servito dopo)
+    priority: Literal["interactive", "batch"] = "interactive"
+    # False per ignorare la cache delle risposte (es. dati sempre aggiornati)
+    use_cache: bool = True
+    # markdown (stringa unica) oppure blocks (lista ordinata di blocchi tipizzati: testo,
+    # immagini, hotel, voli, giorni dell'itinerario) da mostrare senza rianalizzare il testo
+    response_format: Literal["markdown", "blocks"] = "markdown"
 
     model_config = {
         "json_schema_extra": {
@@ -22,32 +38,136 @@ class ChatCompletionRequest(BaseModel):
     }
 
 
+def _run_agent(request: ChatCompletionRequest, degradation, profile_id: Optional[str] = None):
+    """Esegue l'agente (bloccante), eventualmente profilato o registrato in una cassetta"""
+    if profile_id:
+        from ..services.request_profiler import profile_request
+
+        label = request.request_id or request.conversation_id or "chat"
+        with profile_request(profile_id, label):
+            return _run_agent(request, degradation)
+
+    from ..services.cassettes import record_conversation, should_record
+
+    if not should_record():
+        return _invoke_agent(request, degradation)
+
+    # Cassetta per il replay offline: input, chiamate OpenAI/SerpAPI e tempi originali
+    inputs = {
+        "messages": dump_messages(request.messages),
+        "document_ids": request.document_ids,
+        "response_format": request.response_format,
+        "degradation_level": degradation.level,
+    }
+    with record_conversation(inputs) as cassette:
+        response = _invoke_agent(request, degradation)
+        cassette.data["result"] = {
+            "status": response.get("status"),
+            "output_chars": len(response.get("output") or ""),
+        }
+    return response
+
+
+def _invoke_agent(request: ChatCompletionRequest, degradation):
+    """Esegue l'agente con il livello di degradazione assegnato all'ammissione"""
+    # Import lazy: il servizio agente (e LangChain) si carica alla prima richiesta
+    from ..services.admission_control import degradation_scope
+    from ..services.agent_service import Agent
+
+    with degradation_scope(degradation):
+        agent = Agent()
+        return agent.run(
+            messages=request.messages,
+            conversation_id=request.conversation_id,
+            request_id=request.request_id,
+            document_ids=request.document_ids,
+            degradation=degradation,
+            response_format=request.response_format,
+        )
+
+
+def _format_response(request: ChatCompletionRequest, output: str, blocks: Optional[list], **extra) -> dict:
+    """Corpo della risposta nel formato richiesto dal client"""
+    if request.response_format != "blocks":
+        return {"response": output, **extra}
+    if blocks is None:
+        # Risposta senza tool (chat semplice o errore): un solo blocco di testo
+        blocks = [{"type": "text", "text": output}] if output else []
+    return {"blocks": blocks, **extra}
+
+
 @router.post("/travel-agent")
-def chat_completion(request: ChatCompletionRequest):
+async def chat_completion(
+    request: ChatCompletionRequest,
+    x_freya_profile: Optional[str] = Header(None, include_in_schema=False),
+):
     """
     Endpoint per la gestione delle richieste di chat.
     Processa i messaggi ricevuti e restituisce una risposta dall'agente di viaggio.
+    Le esecuzioni contemporanee sono limitate: oltre gli slot la richiesta attende
+    in coda (per priorità) e sotto carico l'agente lavora in modalità ridotta.
     Args:
         request (ChatCompletionRequest): La richiesta contenente i messaggi della conversazione
+        x_freya_profile (str): Token amministratore per profilare l'esecuzione (cProfile e tracemalloc)
     Returns:
         dict: La risposta elaborata dall'agente di viaggio
     Raises:
-        HTTPException: In caso di errori durante l'elaborazione della richiesta
+        HTTPException: 429/503 con Retry-After se il servizio è sovraccarico,
+            500 in caso di errori durante l'elaborazione della richiesta
     """
+    from ..services.admission_control import AdmissionRejected, admission_controller
+    from ..services.answer_cache import ANSWER_CACHE_ENABLED, answer_cache, cacheable_question
+    from ..services.request_profiler import new_profile_id, should_profile
+
     try:
-        agent = Agent()
-        response = agent.run(messages=request.messages)
+        # Domande senza contesto: una risposta a una domanda equivalente evita l'agente
+        question = None
+        if ANSWER_CACHE_ENABLED and request.use_cache:
+            question = cacheable_question(request.messages, request.document_ids)
+        if question:
+            cached = answer_cache.lookup(question, request.response_format)
+            if cached:
+                return _format_response(
+                    request, cached["output"], cached["blocks"], status="success", degradation_level=0, cached=True
+                )
+
+        # Profilazione solo su richiesta dell'amministratore o per campionamento
+        profile_id = new_profile_id() if should_profile(x_freya_profile) else None
+
+        async with admission_controller.admit(request.priority) as degradation:
+            started = time.monotonic()
+            response = await run_in_threadpool(_run_agent, request, degradation, profile_id)
+            run_seconds = time.monotonic() - started
         
         if not response or "output" not in response:
             raise HTTPException(
                 status_code=500,
                 detail="Nessuna risposta generata dall'agente"
             )
+
+        # Solo le risposte complete: niente errori né modalità ridotta
+        if question and degradation.level == 0 and response.get("status") == "success":
+            answer_cache.store(
+                question, response["output"], run_seconds, request.response_format, response.get("blocks")
+            )
             
-        return {
-            "response": response.get("output"),
-            "status": "success"
-        }
+        return _format_response(
+            request,
+            response.get("output"),
+            response.get("blocks"),
+            status="success",
+            degradation_level=degradation.level,
+            cached=False,
+            **({"profile_id": profile_id} if profile_id else {}),
+        )
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Errore in chat_completion: {str(e)}")  # Debug
         raise HTTPException(
@@ -0,0 +1,175 @@
+import os
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from starlette.concurrency import run_in_threadpool
+
+router = APIRouter()
+
+# Intestazioni e separatori di un form multipart oltre al file
+_MULTIPART_OVERHEAD = 64 * 1024
+
+
+async def _raw_chunks(request: Request, filename: Optional[str]) -> AsyncIterator[Tuple[str, bytes]]:
+    """File inviato come corpo della richiesta, con il nome in ?filename="""
+    if not filename:
+        raise HTTPException(status_code=400, detail="Indica il nome del file (?filename=) o usa un form multipart")
+    yield filename, b""
+    async for chunk in request.stream():
+        yield filename, chunk
+
+
+async def _multipart_chunks(request: Request) -> AsyncIterator[Tuple[str, bytes]]:
+    """
+    Primo file di un form multipart/form-data (es. il form del client web),
+    letto in streaming: (nome del file, blocco), senza copie temporanee su disco.
+    """
+    try:
+        from python_multipart.multipart import MultipartParser, parse_options_header
+    except ImportError:  # python-multipart < 0.0.13
+        from multipart.multipart import MultipartParser, parse_options_header
+
+    _, options = parse_options_header(request.headers.get("content-type", ""))
+    boundary = options.get(b"boundary")
+    if not boundary:
+        raise HTTPException(status_code=400, detail="Form multipart senza boundary")
+
+    state: Dict[str, object] = {"field": b"", "value": b"", "headers": {}, "filename": None, "active": False, "done": False}
+    pending: List[bytes] = []
+
+    def on_part_begin():
+        state["headers"] = {}
+
+    def on_header_field(data: bytes, start: int, end: int):
+        state["field"] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int):
+        state["value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["field"].lower()] = state["value"]
+        state["field"], state["value"] = b"", b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        filename = disposition.get(b"filename")
+        # Solo il primo file del form; gli altri campi vengono ignorati
+        if filename and not state["done"] and state["filename"] is None:
+            state["filename"] = os.path.basename(filename.decode("utf-8", "replace").replace("\\", "/"))
+            state["active"] = True
+
+    def on_part_data(data: bytes, start: int, end: int):
+        if state["active"]:
+            pending.append(data[start:end])
+
+    def on_part_end():
+        if state["active"]:
+            state["active"], state["done"] = False, True
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    announced = False
+    async for chunk in request.stream():
+        parser.write(chunk)
+        if state["filename"] is not None and (pending or not announced):
+            announced = True
+            data = b"".join(pending)
+            pending.clear()
+            yield state["filename"], data
+    parser.finalize()
+    if state["filename"] is None:
+        raise HTTPException(status_code=400, detail="Nessun file nel form multipart")
+    if not state["done"]:
+        raise HTTPException(status_code=400, detail="Form multipart incompleto")
+
+
+@router.post("")
+async def upload_document(
+    request: Request,
+    filename: Optional[str] = Query(None, description="Nome del file, es. prenotazione.pdf (solo con il corpo grezzo)"),
+):
+    """
+    Carica un documento di viaggio (PDF, DOCX o immagine) inviato come corpo della richiesta
+    (con ?filename=) oppure come file di un form multipart/form-data.
+    Il file viene scritto su disco a blocchi e il testo estratto pagina per pagina.
+    Args:
+        request (Request): La richiesta con il contenuto del file nel body
+        filename (str): Nome originale del file con il corpo grezzo, usato per riconoscerne il formato
+    Returns:
+        dict: Metadati del documento (document_id, pagine, pagine al secondo)
+    Raises:
+        HTTPException: Se il formato non è supportato o il file supera i limiti
+    """
+    # Import lazy: PyPDF2, python-docx e Pillow si caricano solo quando servono
+    from ..services.document_ingestion import (
+        DOCUMENT_MAX_BYTES,
+        DocumentIngestionError,
+        get_document_ingestor,
+    )
+
+    multipart = request.headers.get("content-type", "").lower().startswith("multipart/form-data")
+    declared_size = int(request.headers.get("content-length") or 0)
+    if declared_size > DOCUMENT_MAX_BYTES + (_MULTIPART_OVERHEAD if multipart else 0):
+        raise HTTPException(status_code=413, detail="Documento troppo grande")
+
+    ingestor = get_document_ingestor()
+    chunks = _multipart_chunks(request) if multipart else _raw_chunks(request, filename)
+    path: Optional[str] = None
+    size = 0
+    try:
+        out = None
+        try:
+            async for name, chunk in chunks:
+                if out is None:
+                    # Il nome (e quindi il formato) è noto solo con il primo blocco
+                    doc_id, kind, path = ingestor.new_document(name)
+                    filename = name
+                    out = open(path, "wb")
+                size += len(chunk)
+                if size > DOCUMENT_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail="Documento troppo grande")
+                if chunk:
+                    await run_in_threadpool(out.write, chunk)
+        finally:
+            if out is not None:
+                out.close()
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Documento vuoto")
+
+        # Estrazione (e OCR nel pool di processi) fuori dall'event loop
+        meta = await run_in_threadpool(ingestor.ingest, doc_id, kind, path, filename)
+    except BaseException as e:
+        # Qualsiasi errore (limiti, PDF corrotto, client disconnesso): il file non resta su disco
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+        if isinstance(e, DocumentIngestionError):
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        raise
+
+    return {"document": meta, "status": "success"}
+
+
+@router.get("/{document_id}")
+def get_document(document_id: str):
+    """
+    Restituisce i metadati di un documento già elaborato.
+    Args:
+        document_id (str): Identificativo restituito dall'upload
+    Returns:
+        dict: Metadati del documento
+    Raises:
+        HTTPException: Se il documento non esiste
+    """
+    from ..services.document_ingestion import get_document_ingestor
+
+    meta = get_document_ingestor().metadata(document_id)
+    if meta is None:
+        raise HTTPException(status_code=404, detail="Documento non trovato")
+    return {"document": meta, "status": "success"}
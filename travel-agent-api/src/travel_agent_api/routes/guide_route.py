@@ -0,0 +1,55 @@
+from fastapi import APIRouter, HTTPException, Request, Response
+
+router = APIRouter()
+
+
+@router.get("")
+def list_guides():
+    """
+    Elenca le guide delle destinazioni pre-generate.
+    Returns:
+        dict: Destinazioni con revisione, data di generazione e freschezza
+    """
+    from ..services.guide_store import guide_store
+
+    guides = guide_store.list()
+    return {"guides": guides, "total": len(guides)}
+
+
+@router.get("/{destination}")
+def get_guide(destination: str, request: Request, response: Response):
+    """
+    Restituisce la guida salvata di una destinazione.
+    Args:
+        destination (str): Nome della destinazione (es. "Roma", "new-york")
+    Returns:
+        dict: Guida in markdown e schede, con ETag e Cache-Control
+    Raises:
+        HTTPException: 404 se la guida non è ancora stata generata
+    """
+    # Import lazy: il guide store legge solo dal disco, nessuna generazione qui
+    from ..services.guide_store import GuideNotFound, guide_store
+    from ..services.image_handles import image_handles
+    from ..services.response_blocks import ImageBlock
+
+    try:
+        guide = guide_store.get(destination)
+    except GuideNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    headers = guide_store.cache_headers(guide)
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return {
+        "destination": guide["destination"],
+        "revision": guide["revision"],
+        "generated_at": guide["generated_at"],
+        "fresh": guide_store.is_fresh(guide),
+        # Segnaposto [img:...] espansi con le immagini salvate insieme alla guida
+        "markdown": image_handles.expand(
+            guide["markdown"],
+            images={handle: ImageBlock.model_validate(image) for handle, image in guide["images"].items()},
+        ),
+        "blocks": guide["blocks"],
+    }
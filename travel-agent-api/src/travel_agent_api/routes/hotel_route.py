@@ -0,0 +1,32 @@
+from fastapi import APIRouter, HTTPException, Query
+from typing import Optional
+
+router = APIRouter()
+
+
+@router.get("/cursors/{cursor}")
+def next_hotels_page(
+    cursor: str,
+    page_size: int = Query(5, ge=1, le=20, description="Hotel da restituire"),
+    max_price: Optional[float] = Query(None, gt=0, description="Prezzo massimo per notte (EUR)"),
+    min_rating: Optional[float] = Query(None, ge=1, le=5, description="Valutazione minima degli ospiti"),
+):
+    """
+    Restituisce la pagina successiva di una ricerca hotel avviata da hotels_finder.
+    Args:
+        cursor (str): Handle del cursore restituito nella risposta dell'agente
+        page_size (int): Numero di hotel della pagina
+        max_price (float): Filtro sul prezzo per notte
+        min_rating (float): Filtro sulla valutazione
+    Returns:
+        dict: Hotel della pagina, `has_more` e statistiche del cursore
+    Raises:
+        HTTPException: 404 se il cursore è sconosciuto o scaduto, 502 se SerpAPI non risponde
+    """
+    # Import lazy: il client SerpAPI viene caricato solo quando serve
+    from ..services.hotel_cursor import HotelCursorError, hotel_cursors
+
+    try:
+        return hotel_cursors.get(cursor).next_page(page_size, max_price, min_rating)
+    except HotelCursorError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+
+router = APIRouter()
+
+
+@router.get("/{key}")
+def image_variant(
+    key: str,
+    request: Request,
+    w: int = Query(160, ge=16, le=2048, description="Larghezza desiderata in pixel"),
+):
+    """
+    Restituisce una variante ridimensionata di un'immagine registrata dai tool.
+    Args:
+        key (str): Chiave dell'immagine generata da images_finder
+        w (int): Larghezza richiesta, arrotondata alla variante disponibile
+    Returns:
+        Response: L'immagine con ETag e Cache-Control
+    Raises:
+        HTTPException: Se l'immagine non è registrata o non è recuperabile
+    """
+    # Import lazy: Pillow viene caricato solo quando serve una miniatura
+    from ..services.image_proxy import ImageProxyError, get_image_proxy
+
+    proxy = get_image_proxy()
+    try:
+        etag, content, media_type = proxy.variant(key, w)
+    except ImageProxyError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    headers = proxy.cache_headers(etag)
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type=media_type, headers=headers)
@@ -0,0 +1,284 @@
+"""
+Admission Control - Slot di esecuzione, coda con priorità e degradazione sotto carico
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from pydantic import BaseModel, Field
+
+# Esecuzioni dell'agente contemporanee e richieste in attesa
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "8"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+# Attesa massima in coda (secondi) per classe di priorità
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "20"))
+ADMISSION_BATCH_MAX_WAIT = float(os.getenv("ADMISSION_BATCH_MAX_WAIT", "120"))
+# Carico ((in esecuzione + in coda) / slot) da cui scatta ciascun livello di degradazione
+ADMISSION_DEGRADE_AT = [
+    float(value) for value in os.getenv("ADMISSION_DEGRADE_AT", "0.75,1.25,2.0").split(",") if value.strip()
+]
+
+# Classi di priorità: numero più basso = servito prima
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+
+class DegradationLevel(BaseModel):
+    level: int = Field(description="0 = servizio completo.")
+    max_iterations: int = Field(description="Iterazioni massime dell'agente.")
+    max_images: int = Field(description="Immagini massime per risposta di images_finder.")
+    simple_chat: bool = Field(False, description="Se True risponde senza tool (_simple_chat_response).")
+
+
+DEGRADATION_LEVELS = [
+    DegradationLevel(level=0, max_iterations=8, max_images=6),
+    DegradationLevel(level=1, max_iterations=5, max_images=4),
+    DegradationLevel(level=2, max_iterations=3, max_images=2),
+    DegradationLevel(level=3, max_iterations=1, max_images=0, simple_chat=True),
+]
+
+_current_degradation: contextvars.ContextVar[DegradationLevel] = contextvars.ContextVar(
+    "freya_degradation", default=DEGRADATION_LEVELS[0]
+)
+
+
+def current_degradation() -> DegradationLevel:
+    """Livello di degradazione della richiesta in corso (letto anche dai tool)"""
+    return _current_degradation.get()
+
+
+@contextmanager
+def degradation_scope(degradation: DegradationLevel) -> Iterator[DegradationLevel]:
+    """Imposta il livello di degradazione per il codice eseguito nel blocco"""
+    token = _current_degradation.set(degradation)
+    try:
+        yield degradation
+    finally:
+        _current_degradation.reset(token)
+
+
+class AdmissionRejected(Exception):
+    """Richiesta respinta: coda piena o attesa troppo lunga"""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    """Richiesta in coda, svegliata da un Future (async) o da un Event (thread)"""
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.granted = False
+        self.cancelled = False
+        self._loop = loop
+        self.future = loop.create_future() if loop else None
+        self.event = None if loop else threading.Event()
+
+    def notify(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._resolve)
+        else:
+            self.event.set()
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class AdmissionController:
+    """
+    Controllo di ammissione delle esecuzioni dell'agente.
+
+    Al massimo `max_concurrent` esecuzioni sono attive; le altre attendono in
+    una coda ordinata per priorità (interactive prima di batch) fino a
+    `max_wait` secondi. Oltre la coda o il tempo massimo la richiesta viene
+    respinta con Retry-After stimato dalla durata media delle esecuzioni.
+    Il carico al momento dell'ammissione determina il livello di degradazione.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = ADMISSION_MAX_CONCURRENT,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        max_wait: float = ADMISSION_MAX_WAIT,
+        batch_max_wait: float = ADMISSION_BATCH_MAX_WAIT,
+        degrade_at: Optional[List[float]] = None,
+    ):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.max_wait = {"interactive": max_wait, "batch": batch_max_wait}
+        self.degrade_at = degrade_at if degrade_at is not None else ADMISSION_DEGRADE_AT
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queued = 0
+        self._queue: List[Any] = []
+        self._sequence = itertools.count()
+        self._waits: Deque[float] = deque(maxlen=500)
+        self._avg_run_seconds = 30.0
+        self._admitted: Dict[str, int] = {name: 0 for name in PRIORITIES}
+        self._rejected: Dict[str, int] = {"queue_full": 0, "wait_timeout": 0}
+        self._levels: Dict[int, int] = {level.level: 0 for level in DEGRADATION_LEVELS}
+        self._last_level = 0
+
+    # ---------------------------------------------------------------- stato (con lock)
+
+    def _retry_after(self) -> int:
+        """Secondi stimati prima che si liberi posto per una nuova richiesta"""
+        backlog = (self._queued + 1) / self.max_concurrent
+        return max(1, min(300, math.ceil(backlog * self._avg_run_seconds)))
+
+    def _degradation(self) -> DegradationLevel:
+        load = (self._active + self._queued) / self.max_concurrent
+        level = sum(1 for threshold in self.degrade_at if load >= threshold)
+        return DEGRADATION_LEVELS[min(level, len(DEGRADATION_LEVELS) - 1)]
+
+    def _enter(self, priority: str, waiter: _Waiter) -> bool:
+        """Ammette subito (True) o mette in coda (False); solleva se la coda è piena"""
+        if self._active < self.max_concurrent and self._queued == 0:
+            self._active += 1
+            return True
+        # Il traffico batch può occupare solo metà della coda: viene scartato per primo
+        limit = self.max_queue if priority == "interactive" else self.max_queue // 2
+        if self._queued >= limit:
+            self._rejected["queue_full"] += 1
+            raise AdmissionRejected(
+                "Servizio sovraccarico: troppe richieste in coda",
+                status_code=429,
+                retry_after=self._retry_after(),
+            )
+        heapq.heappush(self._queue, (PRIORITIES[priority], next(self._sequence), waiter))
+        self._queued += 1
+        return False
+
+    def _grant_next(self):
+        while self._queue and self._active < self.max_concurrent:
+            _, _, waiter = heapq.heappop(self._queue)
+            if waiter.cancelled:
+                continue
+            self._queued -= 1
+            self._active += 1
+            waiter.granted = True
+            waiter.notify()
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Rinuncia all'attesa; restituisce True se lo slot era già stato assegnato"""
+        if waiter.granted:
+            return True
+        waiter.cancelled = True
+        self._queued -= 1
+        return False
+
+    def _admitted_with(self, priority: str, waited: float) -> DegradationLevel:
+        self._waits.append(waited)
+        self._admitted[priority] += 1
+        degradation = self._degradation()
+        self._levels[degradation.level] += 1
+        if degradation.level != self._last_level:
+            print(f"🚦 Livello di degradazione {self._last_level} → {degradation.level}")
+            self._last_level = degradation.level
+        return degradation
+
+    def _release(self, run_seconds: float):
+        with self._lock:
+            self._active -= 1
+            self._avg_run_seconds = 0.8 * self._avg_run_seconds + 0.2 * run_seconds
+            self._grant_next()
+
+    def _timeout_error(self) -> AdmissionRejected:
+        self._rejected["wait_timeout"] += 1
+        return AdmissionRejected(
+            "Servizio occupato: attesa in coda troppo lunga",
+            status_code=503,
+            retry_after=self._retry_after(),
+        )
+
+    # ---------------------------------------------------------------- ammissione
+
+    @staticmethod
+    def _check_priority(priority: str) -> str:
+        if priority not in PRIORITIES:
+            raise ValueError(f"Priorità sconosciuta: {priority} (disponibili: {', '.join(PRIORITIES)})")
+        return priority
+
+    @asynccontextmanager
+    async def admit(self, priority: str = "interactive"):
+        """Attende uno slot dall'event loop; restituisce il livello di degradazione"""
+        self._check_priority(priority)
+        waiter = _Waiter(asyncio.get_running_loop())
+        enqueued = time.monotonic()
+        with self._lock:
+            admitted = self._enter(priority, waiter)
+        if not admitted:
+            try:
+                await asyncio.wait_for(waiter.future, timeout=self.max_wait[priority])
+            except asyncio.TimeoutError:
+                with self._lock:
+                    if not self._abandon(waiter):
+                        raise self._timeout_error()
+            except asyncio.CancelledError:
+                # Client disconnesso durante l'attesa
+                with self._lock:
+                    granted = self._abandon(waiter)
+                if granted:
+                    self._release(0.0)
+                raise
+
+        with self._lock:
+            degradation = self._admitted_with(priority, time.monotonic() - enqueued)
+        started = time.monotonic()
+        try:
+            yield degradation
+        finally:
+            self._release(time.monotonic() - started)
+
+    @contextmanager
+    def admit_sync(self, priority: str = "batch"):
+        """Come admit(), per i job in background eseguiti in un thread"""
+        self._check_priority(priority)
+        waiter = _Waiter()
+        enqueued = time.monotonic()
+        with self._lock:
+            admitted = self._enter(priority, waiter)
+        if not admitted and not waiter.event.wait(self.max_wait[priority]):
+            with self._lock:
+                if not self._abandon(waiter):
+                    raise self._timeout_error()
+
+        with self._lock:
+            degradation = self._admitted_with(priority, time.monotonic() - enqueued)
+        started = time.monotonic()
+        try:
+            yield degradation
+        finally:
+            self._release(time.monotonic() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        """Profondità della coda, tempi di attesa e livello di degradazione"""
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "max_concurrent": self.max_concurrent,
+                "active": self._active,
+                "queue_depth": self._queued,
+                "max_queue": self.max_queue,
+                "wait_p50": round(waits[len(waits) // 2], 3) if waits else None,
+                "wait_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else None,
+                "avg_run_seconds": round(self._avg_run_seconds, 2),
+                "degradation_level": self._degradation().level,
+                "admitted": dict(self._admitted),
+                "rejected": dict(self._rejected),
+                "admitted_per_level": dict(self._levels),
+            }
+
+
+admission_controller = AdmissionController()
@@ -1,66 +1,35 @@
 from datetime import datetime
 from typing import Dict
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, SystemMessage
-from langchain.agents import AgentExecutor, create_openai_functions_agent
+from langchain.agents import create_tool_calling_agent
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-import os
-from dotenv import load_dotenv
-
-# Importa i tool con path assoluto
-try:
-    from travel_agent_api.tools.flights_finder import flights_finder_tool
-    from travel_agent_api.tools.hotels_finder import hotels_finder_tool
-    from travel_agent_api.tools.chain_historical_expert import (
-        chain_historical_expert_tool,
-    )
-    from travel_agent_api.tools.chain_travel_plan import chain_travel_plan_tool
-    from travel_agent_api.tools.images_finder import images_finder_tool
-    from travel_agent_api.tools.destination_guide import create_destination_guide_tool
-    from travel_agent_api.tools.itinerary_with_images import create_itinerary_with_images_tool
-
-    print("✅ Tool importati con successo")
-except ImportError as e:
-    print(f"⚠️ Errore nell'importazione dei tool: {e}")
-    flights_finder_tool = None
-    hotels_finder_tool = None
-    chain_historical_expert_tool = None
-    chain_travel_plan_tool = None
-    images_finder_tool = None
-    create_destination_guide_tool = None
-    create_itinerary_with_images_tool = None
-
-load_dotenv()
+from .chat_messages import dump_messages, parse_messages
+from .history_compaction import history_compactor
+from .image_handles import image_handles
+from .parallel_executor import ParallelAgentExecutor, TOOL_CALL_CONCURRENCY
+from .run_checkpoint import RunCheckpoint, run_thread_id
+from .model_router import ModelRequirements, route_chat_model
+from .tool_registry import tool_registry
+from .vector_index import search_scope
+
+
+# L'agente orchestra i tool: ogni iterazione deve essere reattiva
+AGENT_REQUIREMENTS = ModelRequirements(
+    latency_target=20.0,
+    max_output_tokens=None,
+    deterministic=False,
+)
 
 
 class Agent:
     def __init__(self):
         self.current_datetime = datetime.now()
-        self.model = ChatOpenAI(
-            model_name="gpt-4o-mini",
-            temperature=0.7,
-            openai_api_key=os.getenv("OPENAI_API_KEY"),
-            request_timeout=60,
-            max_retries=2
-        )
-
-        # Crea la lista dei tool disponibili
-        self.tools = []
-        base_tools = [
-            ("flights_finder", flights_finder_tool),
-            ("hotels_finder", hotels_finder_tool),
-            ("historical_expert", chain_historical_expert_tool),
-            ("travel_plan", chain_travel_plan_tool),
-            ("images_finder", images_finder_tool),
-        ]
+        # Modello scelto dal router (client condiviso dal registro)
+        self.model = route_chat_model("agent", AGENT_REQUIREMENTS)
 
-        # Tool combinati per workflow coordinati
-        combined_tools = [
-            ("destination_guide", create_destination_guide_tool),
-            ("itinerary_with_images", create_itinerary_with_images_tool),
-        ]
-
-        all_tools = base_tools + combined_tools
+        # Crea la lista dei tool disponibili (importati al primo utilizzo dal registro)
+        self.tools = []
+        all_tools = tool_registry.load_tools()
 
         for name, tool in all_tools:
             if tool is not None:
@@ -102,19 +71,22 @@ PRESENTAZIONE:
 Data di oggi: {self.current_datetime.strftime('%d/%m/%Y')}
 
 Hai accesso a questi strumenti e DEVI COORDINARLI tra loro:
-- flights_finder: per cercare voli reali usando SerpAPI
-- hotels_finder: per trovare hotel disponibili usando SerpAPI
+- flights_finder: per cercare voli reali usando SerpAPI (accetta codici IATA o nomi di città: non chiedere all'utente i codici degli aeroporti)
+- hotels_finder: per trovare hotel disponibili usando SerpAPI (restituisce la prima pagina e un `cursor`)
+- hotels_next_page: per altri hotel della stessa ricerca, passando il `cursor` di hotels_finder
 - chain_historical_expert: per informazioni storiche sui luoghi
 - chain_travel_plan: per creare piani di viaggio dettagliati
 - images_finder: per cercare e mostrare immagini COERENTI con il contesto
+- images_batch: per cercare in UNA sola chiamata le immagini di più attrazioni della stessa città
 - destination_guide: per guide dettagliate sulle destinazioni
 - itinerary_with_images: per creare itinerari con immagini integrate
+- travel_documents_search: per cercare nei documenti caricati dall'utente e negli itinerari già creati
 
 🎯 REGOLE DI COORDINAMENTO TOOL:
 
 1. **FLUSSO PIANIFICAZIONE VIAGGIO:**
    - Prima: usa chain_travel_plan per l'itinerario completo
-   - Poi: usa images_finder per OGNI destinazione/attrazione menzionata nell'itinerario
+   - Poi: usa images_batch con TUTTE le attrazioni menzionate nell'itinerario
    - Quindi: usa hotels_finder per alloggi nelle città dell'itinerario
    - Infine: usa flights_finder se servono voli
 
@@ -127,13 +99,16 @@ Hai accesso a questi strumenti e DEVI COORDINARLI tra loro:
    - Le immagini DEVONO essere specifiche per quello che hai appena descritto
    - Se parli del "Colosseo", cerca immagini del "Colosseo", non di "Roma generica"
    - Se menzioni "Sagrada Familia", cerca "Sagrada Familia Barcelona"
-   - Se descrivi un itinerario con tappe, cerca immagini per OGNI tappa specifica
+   - Se descrivi un itinerario con tappe, cerca immagini per OGNI tappa specifica (con images_batch)
+   - I tool restituiscono le immagini come segnaposto `[img:nome#1]`: copiali TALI E QUALI
+     nella risposta dove vuoi mostrare l'immagine, verranno sostituiti con la foto vera
+   - NON inventare segnaposto e NON scrivere URL di immagini: usa solo quelli ricevuti dai tool
 
 4. **ESEMPI DI COORDINAMENTO:**
 
    Richiesta: "Itinerario 3 giorni a Roma"
    1. chain_travel_plan("3 giorni Roma itinerario dettagliato")
-   2. Per ogni attrazione nell'itinerario: images_finder("nome_attrazione_specifica")
+   2. images_batch(["Colosseo", "Fontana di Trevi", "Pantheon"], city="Roma") con le attrazioni dell'itinerario
    3. hotels_finder("Roma centro storico")
 
    Richiesta: "Dimmi del Colosseo"
@@ -142,18 +117,24 @@ Hai accesso a questi strumenti e DEVI COORDINARLI tra loro:
 
    Richiesta: "Viaggio Barcellona"
    1. chain_travel_plan("Barcellona itinerario completo")
-   2. images_finder("Sagrada Familia Barcellona") per ogni attrazione specifica
-   3. images_finder("Park Güell Barcellona")
+   2. images_batch(["Sagrada Familia", "Park Güell", "Casa Batlló"], city="Barcellona")
    4. hotels_finder("Barcellona centro")
 
 5. **PAROLE CHIAVE PER ATTIVAZIONE:**
    - "volo/aereo" → flights_finder + destinazione images_finder
    - "hotel/alloggio" → hotels_finder + zona images_finder  
+   - "altri hotel/più economici/nessun hotel adatto" → hotels_next_page con il cursor (e max_price/min_rating), NON una nuova hotels_finder
    - "storia/monumenti" → chain_historical_expert + monumenti specifici images_finder
-   - "itinerario/programma" → chain_travel_plan + ogni tappa images_finder
+   - "itinerario/programma" → chain_travel_plan + images_batch con tutte le tappe
    - "viaggio a [città]" → chain_travel_plan + chain_historical_expert + images_finder specifiche
+   - "la mia prenotazione/il mio biglietto/l'itinerario di prima" → travel_documents_search
+
+6. **CHIAMATE PARALLELE:**
+   - Quando più ricerche sono indipendenti tra loro, chiedile TUTTE nello stesso turno
+   - Esempio: dopo l'itinerario, chiama images_batch con tutte le attrazioni insieme a hotels_finder
+   - Non fare una chiamata per turno se i risultati non dipendono l'uno dall'altro
 
-6. **FORMATO RISPOSTA COORDINATA:**
+7. **FORMATO RISPOSTA COORDINATA:**
    - Descrivi il contenuto
    - Mostra immagini SPECIFICHE di quello che hai descritto
    - Aggiungi informazioni pratiche (hotel/voli se rilevanti)
@@ -199,17 +180,18 @@ Rispondi sempre in italiano con emoji e usa i tool in modo coordinato!
                 MessagesPlaceholder(variable_name="agent_scratchpad"),
             ])
 
-            # Crea l'agente
-            agent = create_openai_functions_agent(
+            # Crea l'agente con l'API tools-calling (più tool call per turno)
+            agent = create_tool_calling_agent(
                 llm=self.model, 
                 tools=self.tools, 
                 prompt=prompt
             )
 
-            # Crea l'executor con timeout esteso
-            self.agent_executor = AgentExecutor(
+            # Crea l'executor con timeout esteso ed esecuzione parallela dei tool
+            self.agent_executor = ParallelAgentExecutor(
                 agent=agent,
                 tools=self.tools,
+                max_parallel_tools=TOOL_CALL_CONCURRENCY,
                 verbose=True,
                 return_intermediate_steps=True,
                 handle_parsing_errors=True,
@@ -218,13 +200,24 @@ Rispondi sempre in italiano con emoji e usa i tool in modo coordinato!
                 early_stopping_method="generate"
             )
 
-            print(f"🚀 Freya configurata con {len(self.tools)} tool e timeout di 1200 secondi")
+            print(
+                f"🚀 Freya configurata con {len(self.tools)} tool, timeout di 1200 secondi "
+                f"e fino a {TOOL_CALL_CONCURRENCY} tool in parallelo"
+            )
 
         except Exception as e:
             print(f"❌ Errore nella configurazione di Freya: {e}")
             self.agent_executor = None
 
-    def run(self, messages: list):
+    def run(
+        self,
+        messages,
+        conversation_id: str = None,
+        request_id: str = None,
+        document_ids: list = None,
+        degradation=None,
+        response_format: str = "markdown",
+    ):
         try:
             # Reset timeout per richieste lunghe
             import threading
@@ -239,55 +232,95 @@ Rispondi sempre in italiano con emoji e usa i tool in modo coordinato!
             timeout_thread.start()
             
             try:
-                # Estrai l'ultimo messaggio dell'utente e costruisci la chat history
-                user_message = ""
-                chat_history = []
-
-                if isinstance(messages, list) and messages:
-                    # Processa tutti i messaggi per costruire la chat history
-                    for i, msg in enumerate(messages):
-                        if isinstance(msg, dict) and "content" in msg:
-                            if msg.get("role") == "user":
-                                if i == len(messages) - 1:  # Ultimo messaggio
-                                    user_message = msg["content"]
-                                else:
-                                    chat_history.append(
-                                        HumanMessage(content=msg["content"])
-                                    )
-                            elif msg.get("role") == "assistant":
-                                chat_history.append(SystemMessage(content=msg["content"]))
-
-                    # Se non abbiamo trovato un messaggio utente, usa l'ultimo
-                    if not user_message and messages:
-                        last_msg = messages[-1]
-                        if isinstance(last_msg, dict) and "content" in last_msg:
-                            user_message = last_msg["content"]
-                        elif isinstance(last_msg, str):
-                            user_message = last_msg
-                elif isinstance(messages, str):
-                    user_message = messages
+                # Messaggi già validati dall'API (ChatMessage); dict e stringhe solo dal replay
+                messages = parse_messages(messages)
+
+                # L'ultimo messaggio è la domanda, i precedenti la chat history:
+                # scambi recenti senza immagini e link, i più vecchi riassunti
+                user_message = messages[-1].content if messages else ""
+                chat_history = history_compactor.compact(messages[:-1])
+
+                # Aggiungi il testo dei documenti di viaggio caricati dall'utente
+                if document_ids:
+                    from .document_ingestion import get_document_ingestor
+
+                    # Solo i passaggi pertinenti alla domanda, non i documenti interi
+                    documents_context = get_document_ingestor().context_for(
+                        document_ids, query=user_message
+                    )
+                    if documents_context:
+                        user_message = (
+                            f"{user_message}\n\n📎 Documenti di viaggio dell'utente "
+                            f"(prenotazioni, itinerari):\n{documents_context}"
+                        )
 
                 print(f"💬 Messaggio ricevuto da Freya: {user_message}")
                 print(f"📝 Chat history: {len(chat_history)} messaggi precedenti")
 
+                # Sotto carico: meno iterazioni o nessun tool (vedi admission_control)
+                if degradation is not None and degradation.level > 0:
+                    print(f"🚦 Modalità ridotta (livello {degradation.level})")
+                    if self.agent_executor and not degradation.simple_chat:
+                        self.agent_executor.max_iterations = degradation.max_iterations
+
                 # Se abbiamo l'agente con tool, usalo
-                if self.agent_executor:
+                if self.agent_executor and not (degradation is not None and degradation.simple_chat):
                     print("🔧 Freya sta usando i suoi strumenti...")
 
-                    result = self.agent_executor.invoke(
-                        {"input": user_message, "chat_history": chat_history}
-                    )
-
-                    response_content = result.get("output", "Nessuna risposta generata")
+                    # Checkpoint per riprendere la richiesta in caso di retry: solo se il
+                    # client identifica la richiesta, altrimenti ogni chiamata è nuova
+                    checkpoint_key = dump_messages(messages)
+                    if document_ids:
+                        checkpoint_key = {"messages": checkpoint_key, "documents": document_ids}
+                    if response_format == "blocks":
+                        checkpoint_key = {"messages": checkpoint_key, "response_format": response_format}
+                    thread_id = run_thread_id(checkpoint_key, request_id, conversation_id)
+                    checkpoint = RunCheckpoint(thread_id) if thread_id else None
+                    if checkpoint is not None:
+                        completed = checkpoint.load_final()
+                        if completed:
+                            print(f"♻️ Risposta già completata per {checkpoint.thread_id}")
+                            return completed
+                    self.agent_executor.run_checkpoint = checkpoint
+
+                    # Documenti e itinerari leggibili dai tool: solo quelli di questa richiesta
+                    with search_scope(conversation_id, document_ids):
+                        if response_format != "blocks":
+                            result = self.agent_executor.invoke(
+                                {"input": user_message, "chat_history": chat_history}
+                            )
+                            blocks = None
+                        else:
+                            # I tool registrano immagini, hotel, voli e giorni come schede
+                            from .response_blocks import BLOCKS_INSTRUCTION, collect_blocks, compose_blocks
+
+                            with collect_blocks() as collector:
+                                result = self.agent_executor.invoke(
+                                    {"input": f"{user_message}\n\n{BLOCKS_INSTRUCTION}", "chat_history": chat_history}
+                                )
+                            # Le immagini arrivano già come schede: i segnaposto nel testo si tolgono
+                            blocks = compose_blocks(image_handles.expand(result.get("output", ""), markdown=False), collector)
+
+                    # Solo ora i segnaposto [img:...] diventano immagini vere
+                    response_content = image_handles.expand(result.get("output", "Nessuna risposta generata"))
                     print(f"🤖 Risposta di Freya: {response_content}")
 
-                    return {
+                    response = {
                         "output": response_content,
                         "status": "success",
                         "tools_used": len(self.tools),
                         "context_messages": len(chat_history),
                         "agent": "Freya"
                     }
+                    if blocks is not None:
+                        response["blocks"] = blocks
+                    # Le risposte ridotte non si riconsegnano: il retry rifà il lavoro completo
+                    if checkpoint is not None:
+                        if degradation is None or degradation.level == 0:
+                            checkpoint.save_final(response)
+                        else:
+                            checkpoint.discard()
+                    return response
 
                 else:
                     # Fallback a chat semplice
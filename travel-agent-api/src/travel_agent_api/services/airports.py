@@ -0,0 +1,306 @@
+"""
+Airports - Indice degli aeroporti incluso nel package (codici IATA, città, aeroporto più vicino)
+
+Il dataset (data/airports.csv) viene caricato una volta in array NumPy
+ordinati per latitudine: codici e città si risolvono con un accesso a
+dizionario, l'aeroporto più vicino con l'haversine vettoriale calcolato
+solo sulla fascia di latitudine che può contenerlo.
+"""
+
+import csv
+import difflib
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pydantic import BaseModel, Field
+
+# Dataset CSV (iata, name, city, country, lat, lon, aliases): di default quello incluso nel package
+AIRPORTS_FILE = os.getenv("AIRPORTS_FILE") or os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "data", "airports.csv"
+)
+# Con true anche i codici IATA ben formati ma assenti dal dataset vengono rifiutati
+AIRPORTS_STRICT = os.getenv("AIRPORTS_STRICT", "false").lower() in ("1", "true", "yes")
+# Aeroporti cercati insieme per una città (es. Londra: LHR,LGW,STN)
+AIRPORTS_PER_CITY = int(os.getenv("AIRPORTS_PER_CITY", "3"))
+
+EARTH_RADIUS_KM = 6371.0088
+# Raggio iniziale della ricerca dell'aeroporto più vicino, allargato finché serve
+_NEAREST_START_KM = 250.0
+
+_IATA = re.compile(r"[A-Z]{3}")
+# Parti di un nome più corte di così valgono solo se sono il nome intero di una città ("Kos", "Goa"):
+# "La Spezia" non deve diventare LAX (alias "LA")
+_MIN_PHRASE_CHARS = 4
+# Correzione automatica dei refusi: solo nomi lunghi, molto simili a un solo luogo e con
+# al massimo una lettera sbagliata ogni 12 ("Barcellonna"); "Como" non è "Coo" (KGS),
+# "Salerno" non è "Salento" (BDS): in quei casi si rifiuta con i suggerimenti
+_FUZZY_MIN_CHARS = 6
+_FUZZY_MIN_RATIO = 0.85
+_FUZZY_MIN_GAP = 0.05
+_FUZZY_CHARS_PER_EDIT = 12
+_NOISE_WORDS = frozenset({"aeroporto", "airport", "aeropuerto", "aeroport", "international", "internazionale", "intl"})
+
+
+class Airport(BaseModel):
+    iata: str = Field(description="Codice IATA di tre lettere.")
+    name: str = Field(description="Nome dell'aeroporto.")
+    city: str = Field(description="Città servita (nome italiano).")
+    country: str = Field(description="Codice ISO del paese.")
+    lat: float
+    lon: float
+
+
+class AirportNotFound(Exception):
+    """Né codice IATA né città presenti nel dataset"""
+
+    def __init__(self, query: str, suggestions: Sequence[str] = ()):
+        self.query = query
+        self.suggestions = list(suggestions)
+        message = f"Aeroporto o città non riconosciuti: '{query}'"
+        if self.suggestions:
+            message += f" (forse: {', '.join(self.suggestions)})"
+        super().__init__(message)
+
+
+def _key(text: str) -> str:
+    """Nome normalizzato: "Aeroporto di Düsseldorf" -> "di dusseldorf" """
+    ascii_name = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    words = re.sub(r"[^a-z0-9]+", " ", ascii_name.lower()).split()
+    return " ".join(word for word in words if word not in _NOISE_WORDS)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Distanza in km tra punti in gradi; accetta scalari o array NumPy (broadcasting)"""
+    lat1, lon1, lat2, lon2 = (np.radians(value) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class AirportIndex:
+    """
+    Aeroporti in array paralleli ordinati per latitudine.
+
+    Un aeroporto a distanza d ha per forza una latitudine entro d/R radianti
+    da quella cercata: con `searchsorted` si isola la fascia e l'haversine
+    si calcola solo lì, raddoppiando il raggio finché non bastano i risultati.
+    """
+
+    def __init__(self, path: str = AIRPORTS_FILE):
+        started = time.perf_counter()
+        with open(path, encoding="utf-8", newline="") as handle:
+            rows = [row for row in csv.DictReader(handle) if row.get("iata")]
+        latitudes = np.array([float(row["lat"]) for row in rows])
+        order = np.argsort(latitudes, kind="stable")
+
+        self.codes = np.array([rows[i]["iata"].strip().upper() for i in order], dtype="U3")
+        self.lat = latitudes[order]
+        self.lon = np.array([float(rows[i]["lon"]) for i in order])
+        # Radianti e coseni precalcolati: a ogni ricerca restano solo seni e arcoseno
+        self._lat_rad = np.radians(self.lat)
+        self._lon_rad = np.radians(self.lon)
+        self._cos_lat = np.cos(self._lat_rad)
+        self._names = [rows[i]["name"] for i in order]
+        self._cities = [rows[i]["city"] for i in order]
+        self._countries = [rows[i]["country"] for i in order]
+        self._by_code: Dict[str, int] = {code: position for position, code in enumerate(self.codes.tolist())}
+
+        # Città, alias e nomi degli aeroporti -> posizioni, nell'ordine del CSV (aeroporto principale prima);
+        # i codici IATA stanno solo in _by_code
+        position_of = {row_index: position for position, row_index in enumerate(order.tolist())}
+        self._by_name: Dict[str, List[int]] = {}
+        # Chiavi cercate anche dentro un testo più lungo ("Londra Gatwick", "Roma, Italia")
+        self._phrase_keys = set()
+        for row_index, row in enumerate(rows):
+            position = position_of[row_index]
+            names = [row["city"], *(row.get("aliases") or "").split("|"), row["name"]]
+            for number, name in enumerate(names):
+                key = _key(name)
+                if not key:
+                    continue
+                if position not in self._by_name.setdefault(key, []):
+                    self._by_name[key].append(position)
+                if len(key) >= _MIN_PHRASE_CHARS or number == 0:
+                    self._phrase_keys.add(key)
+        self._name_keys = list(self._by_name)
+
+        self._lock = threading.Lock()
+        self.counts = {"code": 0, "city": 0, "fuzzy": 0, "passthrough": 0, "not_found": 0, "nearest": 0}
+        self.load_seconds = round(time.perf_counter() - started, 4)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def _count(self, outcome: str):
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def _airport(self, position: int) -> Airport:
+        return Airport(
+            iata=str(self.codes[position]),
+            name=self._names[position],
+            city=self._cities[position],
+            country=self._countries[position],
+            lat=float(self.lat[position]),
+            lon=float(self.lon[position]),
+        )
+
+    def get(self, code: str) -> Optional[Airport]:
+        position = self._by_code.get(code.strip().upper())
+        return self._airport(position) if position is not None else None
+
+    def is_known(self, code: str) -> bool:
+        return code.strip().upper() in self._by_code
+
+    def city_airports(self, name: str) -> List[Airport]:
+        return [self._airport(position) for position in self._by_name.get(_key(name), [])]
+
+    def resolve(self, text: str, per_city: int = AIRPORTS_PER_CITY) -> List[str]:
+        """
+        Codici IATA per un codice, un elenco di codici ("FCO,CIA") o una città
+        ("Roma", "Londra Gatwick", "new york"); AirportNotFound con i suggerimenti
+        se nulla corrisponde.
+        """
+        text = (text or "").strip()
+        parts = [part.strip().upper() for part in re.split(r"[,/]", text) if part.strip()]
+        if len(parts) > 1 and all(_IATA.fullmatch(part) for part in parts):
+            return list(dict.fromkeys(code for part in parts for code in self.resolve(part, per_city)))
+
+        if text.upper() in self._by_code:
+            self._count("code")
+            return [text.upper()]
+
+        # Codici scritti in maiuscolo accanto alla città: "New York JFK", "Milano MXP"
+        # (non in un testo tutto maiuscolo: "SAN MARINO" non è SAN)
+        codes = [word for word in re.findall(r"\b[A-Z]{3}\b", text) if word in self._by_code]
+        if codes and text != text.upper():
+            self._count("code")
+            return list(dict.fromkeys(codes))
+
+        key = _key(text)
+        positions = self._by_name.get(key) or self._most_specific(key.split())
+        if positions is not None:
+            self._count("city")
+            return [str(self.codes[position]) for position in positions[:per_city]]
+
+        # Codice ben formato ma fuori dal dataset (che non contiene tutti gli aeroporti del mondo)
+        if _IATA.fullmatch(text) and not AIRPORTS_STRICT:
+            self._count("passthrough")
+            return [text]
+
+        # Errori di battitura: "Barcellonna", "Amsterdm"
+        close = difflib.get_close_matches(key, self._name_keys, n=3, cutoff=0.6) if key else []
+        if close and self._is_typo(key, close):
+            self._count("fuzzy")
+            return [str(self.codes[position]) for position in self._by_name[close[0]][:per_city]]
+        self._count("not_found")
+        raise AirportNotFound(text, list(dict.fromkeys(self._cities[self._by_name[name][0]] for name in close)))
+
+    def _is_typo(self, key: str, close: List[str]) -> bool:
+        """
+        True se `key` è con buona certezza un refuso di `close[0]`: nome lungo,
+        poche lettere diverse, nessun altro luogo quasi altrettanto simile e
+        nessuna parola che sia già il nome esatto di un altro luogo.
+        """
+        if len(key) < _FUZZY_MIN_CHARS:
+            return False
+        best = close[0]
+        matcher = difflib.SequenceMatcher(None, key, best)
+        if matcher.ratio() < _FUZZY_MIN_RATIO:
+            return False
+        edits = sum(
+            max(i2 - i1, j2 - j1) for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != "equal"
+        )
+        if edits > 1 + len(key) // _FUZZY_CHARS_PER_EDIT:
+            return False
+        targets = set(self._by_name[best])
+        for other in close[1:]:
+            if set(self._by_name[other]) != targets:
+                if matcher.ratio() - difflib.SequenceMatcher(None, key, other).ratio() < _FUZZY_MIN_GAP:
+                    return False
+                break
+        return not any(targets.isdisjoint(self._by_name.get(word, targets)) for word in key.split())
+
+    def _most_specific(self, words: List[str]) -> Optional[List[int]]:
+        """
+        Parole consecutive che indicano meno aeroporti: "Londra Gatwick" -> LGW,
+        "Roma, Italia" -> FCO e CIA. Contano solo città, alias e nomi di
+        aeroporti di almeno quattro lettere o città intere: "San Marino" non è SAN.
+        """
+        best: Optional[List[int]] = None
+        for length in range(len(words) - 1, 0, -1):
+            for start in range(len(words) - length + 1):
+                phrase = " ".join(words[start:start + length])
+                if phrase not in self._phrase_keys:
+                    continue
+                positions = self._by_name[phrase]
+                if best is None or len(positions) < len(best):
+                    best = positions
+        return best
+
+    def nearest(self, lat: float, lon: float, k: int = 1, max_km: Optional[float] = None) -> List[Tuple[Airport, float]]:
+        """I `k` aeroporti più vicini al punto (entro `max_km` se indicato), con la distanza in km"""
+        self._count("nearest")
+        k = max(1, min(k, len(self)))
+        radius = max_km if max_km is not None else _NEAREST_START_KM
+        while True:
+            band = np.degrees(radius / EARTH_RADIUS_KM)
+            start = int(np.searchsorted(self.lat, lat - band, side="left"))
+            stop = int(np.searchsorted(self.lat, lat + band, side="right"))
+            distances = self._distances(lat, lon, start, stop)
+            within = np.flatnonzero(distances <= radius)
+            if len(within) >= k or max_km is not None or band >= 180:
+                break
+            radius *= 2
+        closest = within[np.argsort(distances[within], kind="stable")[:k]]
+        return [(self._airport(start + int(i)), round(float(distances[i]), 1)) for i in closest]
+
+    def _distances(self, lat: float, lon: float, start: int, stop: int) -> np.ndarray:
+        """Haversine dal punto agli aeroporti della fascia [start, stop)"""
+        lat_rad, lon_rad = np.radians(lat), np.radians(lon)
+        a = (
+            np.sin((self._lat_rad[start:stop] - lat_rad) / 2) ** 2
+            + np.cos(lat_rad) * self._cos_lat[start:stop] * np.sin((self._lon_rad[start:stop] - lon_rad) / 2) ** 2
+        )
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self.counts)
+        return {
+            "airports": len(self),
+            "names": len(self._by_name),
+            "load_seconds": self.load_seconds,
+            "strict": AIRPORTS_STRICT,
+            **counts,
+        }
+
+
+_airport_index: Optional[AirportIndex] = None
+_airport_index_lock = threading.Lock()
+
+
+def get_airport_index() -> Optional[AirportIndex]:
+    """Restituisce l'indice condiviso, caricato al primo utilizzo (None se il dataset manca)"""
+    global _airport_index
+    with _airport_index_lock:
+        if _airport_index is None:
+            try:
+                _airport_index = AirportIndex(AIRPORTS_FILE)
+                print(f"🛫 Indice aeroporti caricato: {len(_airport_index)} aeroporti in {_airport_index.load_seconds}s")
+            except Exception as e:
+                print(f"⚠️ Indice aeroporti non disponibile: {e}")
+                return None
+        return _airport_index
+
+
+def resolve_airports(text: str) -> str:
+    """Valore per departure_id/arrival_id di SerpAPI: codici separati da virgola"""
+    index = get_airport_index()
+    if index is None:
+        return (text or "").strip().upper()
+    return ",".join(index.resolve(text))
@@ -0,0 +1,230 @@
+"""
+Answer Cache - Cache delle risposte complete dell'agente per domande equivalenti
+"""
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from .chat_messages import parse_messages
+from .vector_index import tokenize, words
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "21600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+
+# Numeri scritti in lettere, così "tre giorni" e "3 giorni" coincidono
+_NUMBER_WORDS = {
+    "un": "1", "uno": "1", "una": "1", "due": "2", "tre": "3", "quattro": "4", "cinque": "5",
+    "sei": "6", "sette": "7", "otto": "8", "nove": "9", "dieci": "10", "undici": "11",
+    "dodici": "12", "quattordici": "14", "quindici": "15", "venti": "20",
+}
+# Sinonimi brevi ricondotti alla stessa radice
+_ALIASES = {"gg": "giorn", "weekend": "2 giorn", "settimana": "7 giorn"}
+
+# Formule di richiesta che non cambiano il contenuto della risposta
+_FILLER = frozenset(
+    """
+    ciao salve freya grazie favore puoi potresti vorrei voglio mi dammi darmi fammi fare farmi
+    consiglia consigli consigliami suggerisci suggerimenti aiutami aiuto idea idee organizza
+    organizzare organizzami pianifica pianificare prepara preparami crea creami proponi
+    itinerario itinerari programma piano giro viaggio vacanza cosa vedere visitare posti luoghi
+    cose migliori principali imperdibili quali qualche tipo ecco dove andare
+    """.split()
+)
+
+
+# Parole che legano il termine successivo: "da Roma a Milano" non è "da Milano a Roma",
+# "non costosi" non è "costosi", "Roma prima di Firenze" non è "Firenze prima di Roma"
+_ORIGIN = frozenset("da dal dallo dalla dai dagli dalle".split())
+_DESTINATION = frozenset("a al allo alla ai agli alle in nel nello nella nei negli nelle per verso".split())
+_SEQUENCE = frozenset("prima dopo poi".split())
+_NEGATIONS = frozenset("non senza niente nessun nessuno nessuna mai tranne escluso esclusi".split())
+
+# Domande con risposte che cambiano nel tempo (prezzi, disponibilità, date): mai in cache
+_VOLATILE = frozenset(
+    """
+    volo voli aereo aerei biglietto biglietti treno treni traghetto traghetti hotel albergo alberghi
+    ostello ostelli camera camere disponibile disponibili disponibilita prenotare prenotazione
+    prezzo prezzi costo costi tariffa tariffe euro offerta offerte sconto sconti economico economici
+    oggi domani dopodomani stasera stanotte adesso ora orari orario aperto aperta aperti chiuso
+    prossimo prossima prossimi prossime meteo tempo previsioni sciopero scioperi
+    """.split()
+)
+_DATE = re.compile(
+    r"\d{1,2}[/.-]\d{1,2}|\b(19|20)\d{2}\b|€|\b\d{1,2}\s+(gennaio|febbraio|marzo|aprile|maggio|giugno"
+    r"|luglio|agosto|settembre|ottobre|novembre|dicembre)\b",
+    re.IGNORECASE,
+)
+
+
+def _stem(token: str) -> str:
+    """Radice grossolana: toglie la vocale finale (giorno/giorni, bambino/bambini)"""
+    return token[:-1] if len(token) > 4 and token[-1] in "aeio" else token
+
+
+def normalize_question(text: str) -> Tuple[str, FrozenSet[str]]:
+    """
+    Forma canonica della domanda e insieme dei suoi termini.
+
+    Restano le parole non stopword e non formule di richiesta (luoghi,
+    numeri, vincoli come "bambini"). Provenienza ("da"), destinazione ("a",
+    "per", solo se c'è anche una provenienza), sequenza ("prima", "dopo") e
+    negazioni ("non", "senza") non vengono scartate ma legate al termine
+    successivo ("da:roma", "non:costos"). Formule, ordine dei termini liberi,
+    numeri in lettere, singolare/plurale e i sinonimi di _ALIASES possono
+    invece differire. La cache confronta solo la forma canonica esatta:
+    nessuna ricerca per similarità.
+    """
+    content = set(tokenize(text))
+    bound: List[Tuple[Optional[str], Optional[str], str]] = []  # (negazione, relazione, termine)
+    relation: Optional[str] = None
+    negation: Optional[str] = None
+    for token in words(text):
+        if token in _NEGATIONS:
+            negation = "non" if token in ("non", "mai") else "senza"
+        elif token in _ORIGIN:
+            relation = "da"
+        elif token in _DESTINATION:
+            relation = "a"
+        elif token in _SEQUENCE:
+            relation = token
+        elif token in _FILLER:
+            relation = None  # "cose da fare a Roma": "da" non lega un luogo
+        elif token in content:
+            token = _NUMBER_WORDS.get(token, token)
+            first, *rest = _ALIASES.get(token, _stem(token)).split()
+            bound.append((negation, relation, first))
+            bound.extend((None, None, part) for part in rest)
+            relation = negation = None
+    # "a"/"per" distinguono la destinazione solo se c'è anche una provenienza
+    has_origin = any(relation == "da" for _, relation, _ in bound)
+    terms: List[str] = []
+    for negation, relation, term in bound:
+        if relation == "a" and not has_origin:
+            relation = None
+        terms.append("".join(f"{marker}:" for marker in (negation, relation) if marker) + term)
+    # Ordine alfabetico: "Roma 3 giorni" e "3 giorni a Roma" hanno la stessa forma canonica,
+    # mentre le relazioni restano nei prefissi
+    return " ".join(sorted(set(terms))), frozenset(terms)
+
+
+def cacheable_question(messages: Any, document_ids: Optional[list] = None) -> Optional[str]:
+    """
+    Testo della domanda se la risposta non dipende dal contesto né dal
+    momento: un solo messaggio dell'utente, nessuna risposta precedente,
+    nessun documento e nessun riferimento a voli, hotel, prezzi o date.
+    """
+    if document_ids:
+        return None
+    turns = [msg for msg in parse_messages(messages) if msg.role in ("user", "assistant")]
+    if len(turns) != 1 or turns[0].role != "user":
+        return None
+    question = turns[0].content.strip()
+    if not question or _DATE.search(question) or _VOLATILE.intersection(words(question)):
+        return None
+    return question
+
+
+class AnswerCache:
+    """
+    Cache in memoria delle risposte dell'agente per domande equivalenti.
+
+    Cache esatta: la chiave è la forma canonica della domanda
+    (normalize_question) con il formato della risposta. Le varianti di
+    formulazione coincidono, mentre luoghi, numeri, vincoli, negazioni e
+    direzioni diversi ("3 giorni a Roma" / "5 giorni a Roma", "da Roma a
+    Milano" / "da Milano a Roma") danno chiavi diverse. Le voci scadono dopo
+    `ttl` secondi; oltre `max_entries` si elimina quella usata meno di recente.
+    """
+
+    def __init__(self, ttl: float = ANSWER_CACHE_TTL, max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        # (forma canonica, formato) -> voce, dalla usata meno di recente
+        self._entries: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+        self._counts = {"lookups": 0, "hits": 0, "misses": 0, "stores": 0, "expired": 0, "evicted": 0}
+        self._saved_seconds = 0.0
+
+    def lookup(self, question: str, response_format: str = "markdown") -> Optional[Dict[str, Any]]:
+        """Risposta in cache per una domanda equivalente nello stesso formato, o None"""
+        canonical, terms = normalize_question(question)
+        if not terms:
+            return None
+        key = (canonical, response_format)
+        with self._lock:
+            self._counts["lookups"] += 1
+            now = time.time()
+            entry = self._entries.get(key)
+            if entry is not None and now - entry["created"] > self.ttl:
+                del self._entries[key]
+                self._counts["expired"] += 1
+                entry = None
+            if entry is None:
+                self._counts["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            entry["hits"] += 1
+            self._counts["hits"] += 1
+            self._saved_seconds += entry["run_seconds"]
+            print(f"⚡ Risposta dalla cache: {entry['question']}")
+            return {
+                "output": entry["output"],
+                "blocks": entry["blocks"],
+                "question": entry["question"],
+                "age_seconds": round(now - entry["created"]),
+            }
+
+    def store(
+        self,
+        question: str,
+        output: str,
+        run_seconds: float,
+        response_format: str = "markdown",
+        blocks: Optional[List[Dict[str, Any]]] = None,
+    ):
+        """Memorizza la risposta prodotta dall'agente per la domanda (e i blocchi, se richiesti)"""
+        canonical, terms = normalize_question(question)
+        if not terms or not output:
+            return
+        key = (canonical, response_format)
+        with self._lock:
+            # Una domanda già presente viene sostituita, non duplicata
+            self._entries.pop(key, None)
+            self._entries[key] = {
+                "question": question,
+                "output": output,
+                "blocks": blocks,
+                "run_seconds": run_seconds,
+                "created": time.time(),
+                "hits": 0,
+            }
+            self._counts["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counts["evicted"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit rate e secondi di esecuzione dell'agente risparmiati"""
+        with self._lock:
+            lookups = self._counts["lookups"]
+            return {
+                "enabled": ANSWER_CACHE_ENABLED,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                **self._counts,
+                "hit_rate": round(self._counts["hits"] / lookups, 3) if lookups else None,
+                "seconds_saved": round(self._saved_seconds, 1),
+            }
+
+
+answer_cache = AnswerCache()
@@ -0,0 +1,258 @@
+"""
+Cache Warmer - Pre-carica fuori orario le ricerche più richieste (immagini, hotel, storia)
+"""
+
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .tool_cache import tool_cache, warming_scope
+
+CACHE_WARMER_ENABLED = os.getenv("CACHE_WARMER_ENABLED", "true").lower() in ("1", "true", "yes")
+# Fascia oraria locale (inizio-fine, ore intere) in cui il warmer può girare
+CACHE_WARMER_HOURS = os.getenv("CACHE_WARMER_HOURS", "3-6")
+# Ricerche più frequenti considerate per ciascun tipo (destinazioni, hotel, attrazioni, rotte)
+CACHE_WARMER_TOP_N = int(os.getenv("CACHE_WARMER_TOP_N", "20"))
+CACHE_WARMER_MIN_REQUESTS = int(os.getenv("CACHE_WARMER_MIN_REQUESTS", "2"))
+# Chiamate upstream effettive massime per esecuzione (SerpAPI e OpenAI, pagine e tentativi
+# hedged compresi) e job in parallelo
+CACHE_WARMER_BUDGET = int(os.getenv("CACHE_WARMER_BUDGET", "60"))
+CACHE_WARMER_CONCURRENCY = int(os.getenv("CACHE_WARMER_CONCURRENCY", "2"))
+CACHE_WARMER_LOOKBACK_DAYS = float(os.getenv("CACHE_WARMER_LOOKBACK_DAYS", "7"))
+CACHE_WARMER_CHECK_SECONDS = float(os.getenv("CACHE_WARMER_CHECK_SECONDS", "600"))
+# Tipi pre-caricati: i voli sono esclusi di default perché i prezzi cambiano in fretta
+CACHE_WARMER_NAMESPACES = [
+    name.strip()
+    for name in os.getenv("CACHE_WARMER_NAMESPACES", "google_images,google_hotels,historical_expert").split(",")
+    if name.strip()
+]
+
+# Una voce con più di metà della durata residua non viene ricaricata
+_FRESH_FRACTION = 0.5
+
+
+def _warm_serpapi(args: Dict[str, Any]):
+    from serpapi import GoogleSearch
+
+    from .resilience import serpapi_search
+
+    api_key = os.getenv("SERPAPI_API_KEY")
+    if not api_key:
+        raise RuntimeError("SERPAPI_API_KEY non configurata")
+    result = serpapi_search(GoogleSearch, {**args, "api_key": api_key})
+    if "error" in result:
+        raise RuntimeError(result["error"])
+
+
+def _warm_historical_expert(args: Dict[str, Any]):
+    from ..tools.chain_historical_expert import chain_historical_expert
+
+    output = chain_historical_expert.invoke({"input_text": args["input_text"]})
+    if output.startswith(("❌", "🚨")):
+        raise RuntimeError(output)
+
+
+# Come ripetere una richiesta dello storico per ciascun namespace della cache
+WARMERS: Dict[str, Callable[[Dict[str, Any]], None]] = {
+    "google_images": _warm_serpapi,
+    "google_hotels": _warm_serpapi,
+    "google_flights": _warm_serpapi,
+    "historical_expert": _warm_historical_expert,
+}
+
+
+def _in_the_past(args: Dict[str, Any]) -> bool:
+    """Ricerche di hotel o voli per date già passate non vanno ripetute"""
+    today = date.today().isoformat()
+    return any(
+        isinstance(args.get(field), str) and args[field] < today
+        for field in ("check_in_date", "outbound_date")
+    )
+
+
+def _parse_hours(value: str) -> Tuple[int, int]:
+    start, _, end = value.partition("-")
+    return int(start), int(end or start)
+
+
+class CacheWarmer:
+    """
+    Warmer in background della tool cache.
+
+    Dallo storico delle richieste ricava le `top_n` ricerche più frequenti
+    per tipo (immagini delle destinazioni, hotel, schede storiche delle
+    attrazioni, rotte dei voli) e, una volta al giorno nella fascia oraria
+    di basso traffico, ripete quelle non più fresche entro il budget di
+    chiamate upstream effettive e con un numero limitato di esecuzioni in
+    parallelo. Ogni job passa dal controllo di ammissione come richiesta
+    batch e viene saltato se il servizio è in modalità ridotta.
+    """
+
+    def __init__(
+        self,
+        top_n: int = CACHE_WARMER_TOP_N,
+        budget: int = CACHE_WARMER_BUDGET,
+        concurrency: int = CACHE_WARMER_CONCURRENCY,
+        hours: str = CACHE_WARMER_HOURS,
+        namespaces: Optional[List[str]] = None,
+    ):
+        self.top_n = top_n
+        self.budget = budget
+        self.concurrency = max(1, concurrency)
+        self.hours = _parse_hours(hours)
+        self.namespaces = namespaces if namespaces is not None else CACHE_WARMER_NAMESPACES
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._last_run_day: Optional[str] = None
+        self._last_report: Optional[Dict[str, Any]] = None
+        self._runs = 0
+
+    def popular(self) -> Dict[str, List[Tuple[Dict[str, Any], int]]]:
+        """Ricerche più frequenti per namespace nello storico recente"""
+        since = time.time() - CACHE_WARMER_LOOKBACK_DAYS * 86400
+        counters: Dict[str, Counter] = {}
+        samples: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for record in tool_cache.history(since):
+            namespace, args = record.get("ns"), record.get("args")
+            if not namespace or not isinstance(args, dict):
+                continue
+            key = repr(sorted(args.items()))
+            counters.setdefault(namespace, Counter())[key] += 1
+            samples[(namespace, key)] = args
+        return {
+            namespace: [
+                (samples[(namespace, key)], count)
+                for key, count in counter.most_common(self.top_n)
+                if count >= CACHE_WARMER_MIN_REQUESTS
+            ]
+            for namespace, counter in counters.items()
+        }
+
+    def plan(self) -> List[Tuple[str, Dict[str, Any], int]]:
+        """Ricerche da ricaricare, dalla più richiesta (ogni job costa almeno una chiamata del budget)"""
+        candidates = []
+        for namespace, entries in self.popular().items():
+            if namespace not in self.namespaces or namespace not in WARMERS:
+                continue
+            for args, count in entries:
+                if _in_the_past(args):
+                    continue
+                if tool_cache.remaining_ttl(namespace, args) > tool_cache.ttl(namespace) * _FRESH_FRACTION:
+                    continue
+                candidates.append((namespace, args, count))
+        candidates.sort(key=lambda candidate: -candidate[2])
+        return candidates[: self.budget]
+
+    def _warm(self, namespace: str, args: Dict[str, Any], calls) -> Optional[bool]:
+        """Esegue un job; None se va saltato (servizio sotto carico o budget esaurito)"""
+        from .admission_control import AdmissionRejected, admission_controller, degradation_scope
+        from .resilience import UpstreamBudgetExceeded, counting_upstream_calls
+
+        if calls.exhausted:
+            return None
+        try:
+            # Stessi slot delle chat, a priorità batch: il traffico interattivo passa prima
+            with admission_controller.admit_sync("batch") as degradation:
+                if degradation.level > 0:
+                    return None
+                with degradation_scope(degradation), warming_scope(), counting_upstream_calls(calls):
+                    WARMERS[namespace](args)
+            return True
+        except AdmissionRejected as e:
+            print(f"🚦 Warm-up rimandato per {namespace} {args}: {e}")
+            return None
+        except UpstreamBudgetExceeded:
+            return None
+        except Exception as e:
+            print(f"⚠️ Warm-up cache non riuscito per {namespace} {args}: {e}")
+            return False
+
+    def run_once(self) -> Dict[str, Any]:
+        """Esegue subito un ciclo di warm-up e ne restituisce il resoconto"""
+        from .resilience import UpstreamCallCounter
+
+        started = time.monotonic()
+        planned = self.plan()
+        # Conta le chiamate vere a SerpAPI e OpenAI, non i job
+        calls = UpstreamCallCounter(limit=self.budget)
+        print(f"🌅 Cache warmer: {len(planned)} ricerche da pre-caricare (budget {self.budget} chiamate)")
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="freya-cache-warmer") as pool:
+            outcomes = list(pool.map(lambda job: self._warm(job[0], job[1], calls), planned))
+
+        per_namespace: Dict[str, Dict[str, int]] = {}
+        for (namespace, _, _), ok in zip(planned, outcomes):
+            counts = per_namespace.setdefault(namespace, {"warmed": 0, "failed": 0, "skipped": 0})
+            counts["skipped" if ok is None else "warmed" if ok else "failed"] += 1
+        report = {
+            "finished_at": datetime.now().isoformat(timespec="seconds"),
+            "seconds": round(time.monotonic() - started, 1),
+            "planned": len(planned),
+            "warmed": outcomes.count(True),
+            "failed": outcomes.count(False),
+            # Servizio sotto carico, coda piena o budget esaurito: riprovati al prossimo ciclo
+            "skipped": outcomes.count(None),
+            "budget": self.budget,
+            "upstream_calls": calls.stats(),
+            "per_namespace": per_namespace,
+        }
+        with self._lock:
+            self._last_report = report
+            self._runs += 1
+        print(f"✅ Cache warmer completato: {report['warmed']}/{report['planned']} in {report['seconds']}s")
+        return report
+
+    def _due(self, now: datetime) -> bool:
+        start, end = self.hours
+        in_window = start <= now.hour <= end if start <= end else now.hour >= start or now.hour <= end
+        return in_window and self._last_run_day != now.date().isoformat()
+
+    def _loop(self):
+        while not self._stop.wait(CACHE_WARMER_CHECK_SECONDS):
+            now = datetime.now()
+            if not self._due(now):
+                continue
+            self._last_run_day = now.date().isoformat()
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"⚠️ Cache warmer interrotto: {e}")
+
+    def start(self):
+        """Avvia il thread pianificato (idempotente)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="freya-cache-warmer", daemon=True)
+            self._thread.start()
+        print(f"🌅 Cache warmer attivo tra le {self.hours[0]} e le {self.hours[1]}")
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """Ultimo resoconto e voci pre-caricate effettivamente servite"""
+        cache_stats = tool_cache.stats()["namespaces"]
+        warmed = sum(cache_stats.get(namespace, {}).get("warmed", 0) for namespace in self.namespaces)
+        warmed_hits = sum(cache_stats.get(namespace, {}).get("warmed_hits", 0) for namespace in self.namespaces)
+        with self._lock:
+            return {
+                "enabled": CACHE_WARMER_ENABLED,
+                "running": self._thread is not None,
+                "hours": f"{self.hours[0]}-{self.hours[1]}",
+                "top_n": self.top_n,
+                "budget": self.budget,
+                "concurrency": self.concurrency,
+                "runs": self._runs,
+                "last_run": self._last_report,
+                "warmed_entries": warmed,
+                "warmed_entries_hit": warmed_hits,
+                "warmed_hit_ratio": round(warmed_hits / warmed, 3) if warmed else None,
+            }
+
+
+cache_warmer = CacheWarmer()
@@ -0,0 +1,527 @@
+"""
+Cassettes - Registrazione e replay delle conversazioni per regressioni di performance offline
+
+Registrazione: con CASSETTE_RECORD=true ogni esecuzione dell'agente scrive una
+cassetta compressa con gli input della conversazione, le chiamate a OpenAI, le
+ricerche SerpAPI e i risultati serviti dalla tool cache, con i tempi originali.
+
+Replay (nessuna chiamata upstream, le attese originali sono simulate):
+    python -m travel_agent_api.services.cassettes replay cache/cassettes --out build_a.json
+    python -m travel_agent_api.services.cassettes compare build_a.json build_b.json
+"""
+
+import argparse
+import contextvars
+import gzip
+import hashlib
+import json
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+import httpx
+
+CASSETTE_RECORD = os.getenv("CASSETTE_RECORD", "false").lower() in ("1", "true", "yes")
+CASSETTE_DIR = os.getenv("CASSETTE_DIR", "cache/cassettes")
+# Quota di conversazioni registrate quando la registrazione è attiva
+CASSETTE_SAMPLE_RATE = float(os.getenv("CASSETTE_SAMPLE_RATE", "1.0"))
+# Cassette conservate prima di eliminare le più vecchie
+CASSETTE_MAX_FILES = int(os.getenv("CASSETTE_MAX_FILES", "1000"))
+
+CASSETTE_VERSION = 1
+# Header delle risposte OpenAI conservati (lo scheduler li legge anche nel replay)
+_KEPT_HEADERS = ("content-type", "retry-after")
+
+
+class CassetteMiss(httpx.TransportError):
+    """Il replay ha chiesto una chiamata upstream che la cassetta non contiene"""
+
+
+def _key(payload: Any) -> str:
+    if not isinstance(payload, bytes):
+        payload = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return hashlib.sha1(payload).hexdigest()[:16]
+
+
+class Cassette:
+    """
+    Interazioni upstream di una conversazione.
+
+    In registrazione le interazioni vengono accodate nell'ordine in cui
+    terminano. Nel replay ogni richiesta riceve l'interazione registrata con
+    la stessa chiave (hash del corpo o dei parametri) o, se il contenuto è
+    cambiato (es. la data nel prompt), la prima non ancora usata dello stesso
+    upstream; l'attesa originale viene simulata moltiplicata per `speed`.
+    """
+
+    def __init__(self, data: Dict[str, Any], replay: bool = False, speed: float = 1.0):
+        self.data = data
+        self.replay = replay
+        self.speed = speed
+        self._lock = threading.Lock()
+        self.misses = 0
+        self.simulated_seconds: Dict[str, float] = defaultdict(float)
+        self._by_key: Dict[tuple, Deque[int]] = defaultdict(deque)
+        self._unused: Dict[str, List[int]] = defaultdict(list)
+        if replay:
+            for index, interaction in enumerate(data["interactions"]):
+                # I risultati della tool cache non si consumano: vedi cached_lookup
+                if interaction["upstream"] == "tool_cache":
+                    continue
+                self._by_key[(interaction["upstream"], interaction["key"])].append(index)
+                self._unused[interaction["upstream"]].append(index)
+
+    @property
+    def interactions(self) -> List[Dict[str, Any]]:
+        return self.data["interactions"]
+
+    def record(self, upstream: str, key: str, **fields):
+        with self._lock:
+            self.interactions.append({"upstream": upstream, "key": key, **fields})
+
+    def take(self, upstream: str, key: str) -> Dict[str, Any]:
+        """Interazione registrata per la richiesta (consumata: ogni interazione si usa una volta)"""
+        with self._lock:
+            queue = self._by_key.get((upstream, key))
+            while queue and queue[0] not in self._unused[upstream]:
+                queue.popleft()
+            if queue:
+                index = queue.popleft()
+            elif self._unused[upstream]:
+                index = self._unused[upstream][0]
+            else:
+                self.misses += 1
+                raise CassetteMiss(f"Nessuna interazione {upstream} registrata per la chiave {key}")
+            self._unused[upstream].remove(index)
+            interaction = self.interactions[index]
+            stage = f"{upstream}:{interaction.get('stage') or 'other'}"
+            self.simulated_seconds[stage] += interaction.get("elapsed", 0.0) * self.speed
+        return interaction
+
+    def wait(self, interaction: Dict[str, Any]):
+        delay = interaction.get("elapsed", 0.0) * self.speed
+        if delay > 0:
+            time.sleep(delay)
+
+    def unused(self) -> int:
+        with self._lock:
+            return sum(len(indexes) for indexes in self._unused.values())
+
+
+# Cassetta della conversazione in corso, copiata nei thread dei tool e dell'hedging
+_active_cassette: contextvars.ContextVar[Optional[Cassette]] = contextvars.ContextVar(
+    "freya_cassette", default=None
+)
+
+
+def current_cassette() -> Optional[Cassette]:
+    return _active_cassette.get()
+
+
+@contextmanager
+def use_cassette(cassette: Cassette) -> Iterator[Cassette]:
+    token = _active_cassette.set(cassette)
+    try:
+        yield cassette
+    finally:
+        _active_cassette.reset(token)
+
+
+# ---------------------------------------------------------------- registrazione
+
+
+def should_record() -> bool:
+    return CASSETTE_RECORD and (CASSETTE_SAMPLE_RATE >= 1 or random.random() < CASSETTE_SAMPLE_RATE)
+
+
+def _prune(directory: str):
+    names = sorted(name for name in os.listdir(directory) if name.endswith(".json.gz"))
+    for name in names[: max(0, len(names) - CASSETTE_MAX_FILES)]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+@contextmanager
+def record_conversation(inputs: Dict[str, Any], directory: str = CASSETTE_DIR) -> Iterator[Cassette]:
+    """Registra le interazioni upstream del blocco; `result` della cassetta va impostato dal chiamante"""
+    cassette = Cassette({
+        "version": CASSETTE_VERSION,
+        "id": f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(3)}",
+        "recorded_at": datetime.now().isoformat(timespec="seconds"),
+        "input": inputs,
+        "result": None,
+        "interactions": [],
+    })
+    started = time.perf_counter()
+    with use_cassette(cassette):
+        yield cassette
+    cassette.data["seconds"] = round(time.perf_counter() - started, 3)
+    # Risposte già complete (checkpoint) non hanno interazioni: non servono al replay
+    if not cassette.interactions:
+        return
+    try:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{cassette.data['id']}.json.gz")
+        with gzip.open(path, "wt", encoding="utf-8", compresslevel=6) as handle:
+            json.dump(cassette.data, handle, ensure_ascii=False, separators=(",", ":"))
+        _prune(directory)
+        print(f"📼 Cassetta {cassette.data['id']} registrata ({len(cassette.interactions)} interazioni)")
+    except OSError as e:
+        print(f"⚠️ Cassetta non salvata: {e}")
+
+
+def load_cassette(path: str) -> Dict[str, Any]:
+    with gzip.open(path, "rt", encoding="utf-8") as handle:
+        data = json.load(handle)
+    if data.get("version") != CASSETTE_VERSION:
+        raise ValueError(f"Versione di cassetta non supportata in {path}: {data.get('version')}")
+    return data
+
+
+# ---------------------------------------------------------------- OpenAI (trasporto httpx)
+
+
+def _recorded_response(request: httpx.Request, interaction: Dict[str, Any]) -> httpx.Response:
+    return httpx.Response(
+        interaction["status"],
+        headers=interaction.get("headers") or {},
+        content=interaction["body"].encode("utf-8"),
+        request=request,
+    )
+
+
+def _interaction_fields(request: httpx.Request, response: httpx.Response, elapsed: float) -> Dict[str, Any]:
+    return {
+        "stage": request.extensions.get("freya_call_site"),
+        "status": response.status_code,
+        "headers": {
+            name: value
+            for name, value in response.headers.items()
+            if name in _KEPT_HEADERS or name.startswith("x-ratelimit-")
+        },
+        "body": response.content.decode("utf-8", errors="replace"),
+        "elapsed": round(elapsed, 4),
+    }
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """Registra le risposte OpenAI nella cassetta attiva o, nel replay, le serve senza rete"""
+
+    def __init__(self, inner: httpx.BaseTransport):
+        self.inner = inner
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        cassette = _active_cassette.get()
+        if cassette is None:
+            return self.inner.handle_request(request)
+        key = _key(request.read())
+        if cassette.replay:
+            interaction = cassette.take("openai", key)
+            cassette.wait(interaction)
+            return _recorded_response(request, interaction)
+        started = time.perf_counter()
+        response = self.inner.handle_request(request)
+        response.read()
+        cassette.record("openai", key, **_interaction_fields(request, response, time.perf_counter() - started))
+        return response
+
+    def close(self):
+        self.inner.close()
+
+
+class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+    """Come CassetteTransport, per il client httpx asincrono"""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport):
+        self.inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        cassette = _active_cassette.get()
+        if cassette is None:
+            return await self.inner.handle_async_request(request)
+        key = _key(await request.aread())
+        if cassette.replay:
+            import asyncio
+
+            interaction = cassette.take("openai", key)
+            delay = interaction.get("elapsed", 0.0) * cassette.speed
+            if delay > 0:
+                await asyncio.sleep(delay)
+            return _recorded_response(request, interaction)
+        started = time.perf_counter()
+        response = await self.inner.handle_async_request(request)
+        await response.aread()
+        cassette.record("openai", key, **_interaction_fields(request, response, time.perf_counter() - started))
+        return response
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+
+# ---------------------------------------------------------------- SerpAPI e tool cache
+
+
+class _RecordedSerpResponse:
+    """Quanto serve a serpapi_search di una requests.Response"""
+
+    def __init__(self, status_code: int, text: str):
+        self.status_code = status_code
+        self.text = text
+
+
+def serpapi_call(params: Dict[str, Any], fetch):
+    """Esegue `fetch()` (get_response di SerpAPI) registrandolo o servendolo dalla cassetta attiva"""
+    cassette = _active_cassette.get()
+    if cassette is None:
+        return fetch()
+    key = _key({name: value for name, value in params.items() if name != "api_key"})
+    if cassette.replay:
+        interaction = cassette.take("serpapi", key)
+        cassette.wait(interaction)
+        return _RecordedSerpResponse(interaction["status"], interaction["body"])
+    started = time.perf_counter()
+    response = fetch()
+    cassette.record(
+        "serpapi",
+        key,
+        stage=params.get("engine"),
+        status=response.status_code,
+        body=response.text,
+        elapsed=round(time.perf_counter() - started, 4),
+    )
+    return response
+
+
+_NOT_RECORDED = object()
+
+
+def cached_lookup(namespace: str, args: Dict[str, Any], lookup):
+    """
+    Lookup nella tool cache attraverso la cassetta attiva.
+
+    In registrazione i risultati trovati in cache vengono salvati; nel replay
+    la cache locale viene ignorata e si restituisce solo ciò che era in cache
+    durante la conversazione originale, così le chiamate upstream coincidono.
+    """
+    cassette = _active_cassette.get()
+    if cassette is None:
+        return lookup()
+    key = _key({"ns": namespace, "args": args})
+    if cassette.replay:
+        with cassette._lock:
+            for interaction in cassette.interactions:
+                if interaction["upstream"] == "tool_cache" and interaction["key"] == key:
+                    return interaction["value"]
+        return None
+    value = lookup()
+    if value is not None:
+        cassette.record("tool_cache", key, stage=namespace, value=value, elapsed=0.0)
+    return value
+
+
+# ---------------------------------------------------------------- replay e confronto
+
+
+def _stage_of(filename: str, function: str) -> Optional[str]:
+    """Fase a cui attribuire una funzione del profilo (moduli del package, JSON, regex)"""
+    normalized = filename.replace("\\", "/")
+    if "/travel_agent_api/" in normalized:
+        module = normalized.split("/travel_agent_api/", 1)[1].rsplit(".", 1)[0]
+        return module.replace("/", ".")
+    if "/json/" in normalized or "_json" in function:
+        return "json"
+    if "/re/" in normalized or "re.Pattern" in function:
+        return "regex"
+    return None
+
+
+def _allocation_stage(filename: str) -> str:
+    normalized = filename.replace("\\", "/")
+    stage = _stage_of(normalized, "")
+    if stage:
+        return stage
+    if "/site-packages/" in normalized:
+        return normalized.split("/site-packages/", 1)[1].split("/", 1)[0]
+    return "other"
+
+
+def stage_breakdown(session) -> Dict[str, Dict[str, float]]:
+    """
+    Secondi e KB allocati per fase da una sessione di request_profiler.
+
+    Per i moduli del package il tempo è il cumulativo massimo tra le loro
+    funzioni (il punto d'ingresso, sommato su tutti i thread); per JSON e
+    regex è il tempo proprio delle funzioni della libreria standard.
+    """
+    stages: Dict[str, Dict[str, float]] = defaultdict(lambda: {"seconds": 0.0, "alloc_kb": 0.0})
+    stats = session.stats()
+    if stats is not None:
+        for (filename, _, function), (_, _, self_time, cumulative, _) in stats.stats.items():
+            stage = _stage_of(filename, function)
+            if stage is None:
+                continue
+            if stage in ("json", "regex"):
+                stages[stage]["seconds"] += self_time
+            else:
+                stages[stage]["seconds"] = max(stages[stage]["seconds"], cumulative)
+    if session.snapshot is not None:
+        for stat in session.snapshot.statistics("filename"):
+            stages[_allocation_stage(stat.traceback[0].filename)]["alloc_kb"] += stat.size / 1024
+    return {
+        stage: {"seconds": round(values["seconds"], 4), "alloc_kb": round(values["alloc_kb"], 1)}
+        for stage, values in sorted(stages.items())
+    }
+
+
+def replay_cassette(path: str, speed: float = 1.0) -> Dict[str, Any]:
+    """Ripete una conversazione registrata attraverso Agent.run e ne misura tempi e allocazioni"""
+    from .admission_control import DEGRADATION_LEVELS, degradation_scope
+    from .agent_service import Agent
+    from .request_profiler import profile_request
+
+    data = load_cassette(path)
+    inputs = data["input"]
+    cassette = Cassette(data, replay=True, speed=speed)
+    # Stesso livello di degradazione della conversazione originale
+    degradation = DEGRADATION_LEVELS[inputs.get("degradation_level", 0)]
+    agent = Agent()
+    cpu_started = time.process_time()
+    with use_cassette(cassette), degradation_scope(degradation):
+        with profile_request(data["id"], "replay", store=None) as session:
+            result = agent.run(
+                messages=inputs["messages"],
+                document_ids=inputs.get("document_ids"),
+                # Id nuovo: il replay non deve riprendere checkpoint di altre esecuzioni
+                request_id=f"replay-{uuid.uuid4().hex}",
+                degradation=degradation,
+                response_format=inputs.get("response_format", "markdown"),
+            )
+    return {
+        "cassette": data["id"],
+        "status": result.get("status"),
+        "recorded_seconds": data.get("seconds"),
+        "replay_seconds": round(session.seconds, 3),
+        "cpu_seconds": round(time.process_time() - cpu_started, 3),
+        "simulated_upstream": {stage: round(seconds, 3) for stage, seconds in cassette.simulated_seconds.items()},
+        "misses": cassette.misses,
+        "unused_interactions": cassette.unused(),
+        "peak_kb": round(session.peak_bytes / 1024, 1),
+        "stages": stage_breakdown(session),
+    }
+
+
+def replay_directory(directory: str, speed: float = 1.0, label: Optional[str] = None) -> Dict[str, Any]:
+    """Replay di tutte le cassette di una cartella (in sequenza, per misure non sovrapposte)"""
+    # Il replay non deve toccare lo storico del cache warmer e ogni chiamata
+    # deve corrispondere a una sola interazione registrata (niente hedging)
+    from .resilience import UPSTREAMS
+    from .tool_cache import tool_cache
+
+    tool_cache.history_file = os.devnull
+    for upstream in UPSTREAMS.values():
+        upstream.hedge = False
+    paths = sorted(
+        os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".json.gz")
+    )
+    runs = []
+    for path in paths:
+        try:
+            runs.append(replay_cassette(path, speed))
+            print(f"▶️ {os.path.basename(path)}: {runs[-1]['replay_seconds']}s, {runs[-1]['misses']} miss")
+        except Exception as e:
+            print(f"⚠️ Replay di {path} non riuscito: {e}")
+            runs.append({"cassette": os.path.basename(path), "error": str(e)})
+    totals: Dict[str, Dict[str, float]] = defaultdict(lambda: {"seconds": 0.0, "alloc_kb": 0.0})
+    for run in runs:
+        for stage, values in run.get("stages", {}).items():
+            totals[stage]["seconds"] += values["seconds"]
+            totals[stage]["alloc_kb"] += values["alloc_kb"]
+        totals["total"]["seconds"] += run.get("replay_seconds", 0.0)
+        totals["total"]["alloc_kb"] += run.get("peak_kb", 0.0)
+        totals["cpu"]["seconds"] += run.get("cpu_seconds", 0.0)
+    return {
+        "label": label,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "speed": speed,
+        "cassettes": len(paths),
+        "failed": sum(1 for run in runs if "error" in run or run.get("misses")),
+        "totals": {stage: {key: round(value, 4) for key, value in values.items()} for stage, values in totals.items()},
+        "runs": runs,
+    }
+
+
+def compare_reports(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Any]:
+    """Differenze per fase tra due report di replay_directory (es. due build)"""
+    stages = {}
+    for stage in sorted(set(before["totals"]) | set(after["totals"])):
+        old = before["totals"].get(stage, {"seconds": 0.0, "alloc_kb": 0.0})
+        new = after["totals"].get(stage, {"seconds": 0.0, "alloc_kb": 0.0})
+        stages[stage] = {
+            metric: {
+                "before": old[metric],
+                "after": new[metric],
+                "delta": round(new[metric] - old[metric], 4),
+                "delta_pct": round((new[metric] - old[metric]) / old[metric] * 100, 1) if old[metric] else None,
+            }
+            for metric in ("seconds", "alloc_kb")
+        }
+    return {"before": before.get("label"), "after": after.get("label"), "stages": stages}
+
+
+def _print_comparison(comparison: Dict[str, Any]):
+    print(f"{'fase':<40} {'s prima':>10} {'s dopo':>10} {'Δ%':>7} {'KB prima':>11} {'KB dopo':>11} {'Δ%':>7}")
+    for stage, metrics in comparison["stages"].items():
+        seconds, alloc = metrics["seconds"], metrics["alloc_kb"]
+
+        def pct(value):
+            return f"{value:+.1f}" if value is not None else "-"
+
+        print(
+            f"{stage:<40} {seconds['before']:>10.3f} {seconds['after']:>10.3f} {pct(seconds['delta_pct']):>7} "
+            f"{alloc['before']:>11.1f} {alloc['after']:>11.1f} {pct(alloc['delta_pct']):>7}"
+        )
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Replay delle cassette e confronto tra build")
+    commands = parser.add_subparsers(dest="command", required=True)
+    replay = commands.add_parser("replay", help="ripete le cassette e scrive un report JSON")
+    replay.add_argument("directory", nargs="?", default=CASSETTE_DIR)
+    replay.add_argument("--out", required=True, help="file del report")
+    replay.add_argument("--speed", type=float, default=1.0, help="moltiplicatore delle attese upstream (0 = nessuna)")
+    replay.add_argument("--label", default=None, help="nome della build (es. hash del commit)")
+    compare = commands.add_parser("compare", help="confronta due report di replay")
+    compare.add_argument("before")
+    compare.add_argument("after")
+    args = parser.parse_args(argv)
+
+    if args.command == "replay":
+        report = replay_directory(args.directory, args.speed, args.label)
+        with open(args.out, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, ensure_ascii=False, indent=1)
+        print(f"✅ Report di {report['cassettes']} cassette in {args.out} ({report['failed']} con errori o miss)")
+    else:
+        with open(args.before, encoding="utf-8") as handle:
+            before = json.load(handle)
+        with open(args.after, encoding="utf-8") as handle:
+            after = json.load(handle)
+        _print_comparison(compare_reports(before, after))
+
+
+if __name__ == "__main__":
+    # Nessuna chiamata upstream reale: bastano chiavi fittizie per superare i controlli dei tool
+    os.environ.setdefault("OPENAI_API_KEY", "replay")
+    os.environ.setdefault("SERPAPI_API_KEY", "replay")
+    # Il replay non salva checkpoint su disco (le chiavi sono comunque nuove a ogni esecuzione)
+    os.environ.setdefault("AGENT_CHECKPOINT_DB", "")
+    main(sys.argv[1:])
@@ -0,0 +1,38 @@
+"""
+Chat Messages - Messaggi tipizzati della conversazione, validati una volta all'ingresso dell'API
+"""
+
+from typing import Any, List, Literal
+
+from pydantic import BaseModel, TypeAdapter, model_validator
+
+
+class ChatMessage(BaseModel):
+    role: Literal["user", "assistant", "system"] = "user"
+    content: str
+
+    @model_validator(mode="before")
+    @classmethod
+    def _from_text(cls, data: Any) -> Any:
+        # Compatibilità con i client che inviano solo il testo del messaggio
+        return {"role": "user", "content": data} if isinstance(data, str) else data
+
+
+_messages_adapter = TypeAdapter(List[ChatMessage])
+
+
+def parse_messages(messages: Any) -> List[ChatMessage]:
+    """
+    Messaggi tipizzati da una lista di dict o stringhe (es. le cassette del
+    replay); una lista già validata dall'API viene restituita così com'è.
+    """
+    if isinstance(messages, str):
+        messages = [messages]
+    if isinstance(messages, list) and all(isinstance(message, ChatMessage) for message in messages):
+        return messages
+    return _messages_adapter.validate_python(messages)
+
+
+def dump_messages(messages: List[ChatMessage]) -> List[dict]:
+    """Forma JSON dei messaggi (chiavi dei checkpoint, cassette)"""
+    return [message.model_dump() for message in messages]
@@ -0,0 +1,408 @@
+"""
+Document Ingestion - Estrazione in streaming del testo da PDF, DOCX e immagini scansionate
+"""
+
+import io
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows: nessun limite di memoria per i worker OCR
+    resource = None
+
+# Cartelle dei file caricati e del testo estratto (entrambe in .gitignore)
+UPLOAD_DIR = os.getenv("DOCUMENT_UPLOAD_DIR", "document_uploads")
+PROCESSED_DIR = os.getenv("DOCUMENT_PROCESSED_DIR", "processed_documents")
+DOCUMENT_MAX_BYTES = int(os.getenv("DOCUMENT_MAX_BYTES", str(25 * 1024 * 1024)))
+DOCUMENT_MAX_PAGES = int(os.getenv("DOCUMENT_MAX_PAGES", "300"))
+DOCUMENT_MAX_TEXT_CHARS = int(os.getenv("DOCUMENT_MAX_TEXT_CHARS", "500000"))
+DOCUMENT_CONTEXT_CHARS = int(os.getenv("DOCUMENT_CONTEXT_CHARS", "6000"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "2"))
+OCR_MEMORY_LIMIT_MB = int(os.getenv("OCR_MEMORY_LIMIT_MB", "1024"))
+OCR_LANGUAGES = os.getenv("OCR_LANGUAGES", "ita+eng")
+# Pixel massimi di un'immagine decodificata nei worker (oltre: decompression bomb, documento rifiutato)
+OCR_MAX_IMAGE_PIXELS = int(os.getenv("OCR_MAX_IMAGE_PIXELS", "50000000"))
+
+# Caratteri per "pagina" nei formati senza impaginazione (DOCX)
+_DOCX_PAGE_CHARS = 3000
+
+SUPPORTED_EXTENSIONS = {
+    ".pdf": "pdf",
+    ".docx": "docx",
+    ".png": "image",
+    ".jpg": "image",
+    ".jpeg": "image",
+    ".tif": "image",
+    ".tiff": "image",
+    ".webp": "image",
+}
+
+_DOC_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class DocumentIngestionError(Exception):
+    """Documento non valido o oltre i limiti consentiti"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _limit_worker_memory():
+    """Initializer dei worker OCR: limita la memoria e i pixel decodificabili di ogni processo"""
+    import warnings
+
+    from PIL import Image
+
+    Image.MAX_IMAGE_PIXELS = OCR_MAX_IMAGE_PIXELS
+    # Oltre il limite Pillow di solito avvisa soltanto: qui l'immagine va rifiutata
+    warnings.simplefilter("error", Image.DecompressionBombWarning)
+    if resource is not None and OCR_MEMORY_LIMIT_MB > 0:
+        limit = OCR_MEMORY_LIMIT_MB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _ocr_image_bytes(data: bytes) -> str:
+    """OCR di un'immagine (eseguito in un processo del pool)"""
+    import pytesseract
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.load()
+            return pytesseract.image_to_string(img, lang=OCR_LANGUAGES)
+    except Exception as e:
+        # Alcune eccezioni di pytesseract non sono serializzabili verso il processo padre
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+
+def _ocr_image_frame(path: str, index: int) -> Tuple[str, bool]:
+    """
+    Decodifica e OCR di un fotogramma di un'immagine caricata (eseguito in un
+    processo del pool): restituisce il testo e se seguono altri fotogrammi.
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(path) as img:
+            img.seek(index)
+            frame = img.convert("RGB")
+            more = index + 1 < getattr(img, "n_frames", 1)
+    except Exception as e:
+        # Immagine non valida o troppo grande: il documento viene rifiutato
+        raise ValueError(f"Immagine non valida: {type(e).__name__}: {e}") from None
+    try:
+        import pytesseract
+
+        return pytesseract.image_to_string(frame, lang=OCR_LANGUAGES), more
+    except Exception as e:
+        print(f"⚠️ OCR non riuscito sul fotogramma {index + 1}: {e}")
+        return "", more
+
+
+class DocumentIngestor:
+    """
+    Pipeline di ingestione dei documenti di viaggio.
+
+    Il file caricato viene scritto su disco a blocchi, il testo estratto
+    pagina per pagina da un generatore e salvato riga per riga (JSONL),
+    così in memoria resta al massimo una pagina alla volta. L'OCR gira in
+    un pool di processi con un limite di memoria per worker.
+    """
+
+    def __init__(self):
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        os.makedirs(PROCESSED_DIR, exist_ok=True)
+        self._ocr_pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._stats = {"documents": 0, "pages": 0, "ocr_pages": 0, "seconds": 0.0, "failed": 0}
+
+    def _run_in_pool(self, function, *args):
+        """Esegue una funzione di decodifica/OCR nel pool di processi con limite di memoria"""
+        with self._lock:
+            if self._ocr_pool is None:
+                # spawn: worker leggeri, senza ereditare la memoria del server
+                self._ocr_pool = ProcessPoolExecutor(
+                    max_workers=OCR_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_limit_worker_memory,
+                )
+            pool = self._ocr_pool
+        try:
+            result = pool.submit(function, *args).result()
+        except BrokenProcessPool as e:
+            # Un worker ha superato il limite di memoria: il pool va ricreato
+            with self._lock:
+                if self._ocr_pool is pool:
+                    self._ocr_pool = None
+            pool.shutdown(wait=False)
+            raise RuntimeError(f"OCR interrotto (limite di memoria?): {e}") from None
+        with self._lock:
+            self._stats["ocr_pages"] += 1
+        return result
+
+    def _ocr(self, data: bytes) -> str:
+        try:
+            return self._run_in_pool(_ocr_image_bytes, data)
+        except Exception as e:
+            print(f"⚠️ OCR non riuscito: {e}")
+            return ""
+
+    # ---------------------------------------------------------------- upload
+
+    def new_document(self, filename: str) -> Tuple[str, str, str]:
+        """Valida il nome del file e restituisce (doc_id, tipo, percorso di upload)"""
+        extension = os.path.splitext(filename or "")[1].lower()
+        kind = SUPPORTED_EXTENSIONS.get(extension)
+        if kind is None:
+            raise DocumentIngestionError(
+                f"Formato non supportato: {extension or 'sconosciuto'}", status_code=415
+            )
+        doc_id = uuid.uuid4().hex
+        return doc_id, kind, os.path.join(UPLOAD_DIR, f"{doc_id}{extension}")
+
+    # ---------------------------------------------------------------- estrazione
+
+    def iter_pages(self, path: str, kind: str) -> Iterator[Tuple[int, str]]:
+        """Genera (numero pagina, testo) senza caricare l'intero documento"""
+        if kind == "pdf":
+            yield from self._iter_pdf(path)
+        elif kind == "docx":
+            yield from self._iter_docx(path)
+        else:
+            yield from self._iter_image(path)
+
+    def _iter_pdf(self, path: str) -> Iterator[Tuple[int, str]]:
+        from PyPDF2 import PdfReader
+
+        reader = PdfReader(path)
+        for number, page in enumerate(reader.pages, 1):
+            text = (page.extract_text() or "").strip()
+            if not text:
+                # Pagina scansionata: OCR delle immagini incorporate
+                try:
+                    text = "\n".join(self._ocr(image.data) for image in page.images).strip()
+                except Exception as e:
+                    print(f"⚠️ Immagini non leggibili a pagina {number}: {e}")
+            yield number, text
+
+    def _iter_docx(self, path: str) -> Iterator[Tuple[int, str]]:
+        import docx
+
+        document = docx.Document(path)
+        buffer: List[str] = []
+        size, number = 0, 0
+        for paragraph in document.paragraphs:
+            if not paragraph.text.strip():
+                continue
+            buffer.append(paragraph.text)
+            size += len(paragraph.text)
+            if size >= _DOCX_PAGE_CHARS:
+                number += 1
+                yield number, "\n".join(buffer)
+                buffer, size = [], 0
+        for table in document.tables:
+            for row in table.rows:
+                buffer.append(" | ".join(cell.text.strip() for cell in row.cells))
+        if buffer:
+            yield number + 1, "\n".join(buffer)
+
+    def _iter_image(self, path: str) -> Iterator[Tuple[int, str]]:
+        # Le immagini caricate si decodificano solo nei worker: una decompression bomb
+        # si ferma a OCR_MAX_IMAGE_PIXELS o al limite di memoria, non nel server
+        index, more = 0, True
+        while more:
+            text, more = self._run_in_pool(_ocr_image_frame, path, index)
+            index += 1
+            yield index, text.strip()
+
+    def ingest(self, doc_id: str, kind: str, path: str, filename: str) -> Dict[str, Any]:
+        """Estrae il testo pagina per pagina e salva il risultato (bloccante: va in un thread)"""
+        started = time.perf_counter()
+        pages, chars, truncated = 0, 0, False
+        pages_path = os.path.join(PROCESSED_DIR, f"{doc_id}.jsonl")
+        try:
+            with open(pages_path, "w", encoding="utf-8") as out:
+                for number, text in self.iter_pages(path, kind):
+                    if pages >= DOCUMENT_MAX_PAGES or chars + len(text) > DOCUMENT_MAX_TEXT_CHARS:
+                        truncated = True
+                        break
+                    out.write(json.dumps({"page": number, "text": text}, ensure_ascii=False) + "\n")
+                    pages += 1
+                    chars += len(text)
+        except Exception as e:
+            with self._lock:
+                self._stats["failed"] += 1
+            if os.path.exists(pages_path):
+                os.remove(pages_path)
+            raise DocumentIngestionError(f"Documento non leggibile: {e}", status_code=422)
+
+        vector_rows = self._index_pages(doc_id, filename)
+
+        seconds = time.perf_counter() - started
+        meta = {
+            "document_id": doc_id,
+            "filename": filename,
+            "kind": kind,
+            "pages": pages,
+            "characters": chars,
+            "truncated": truncated,
+            "seconds": round(seconds, 3),
+            "pages_per_second": round(pages / seconds, 2) if seconds > 0 else None,
+            "vector_rows": vector_rows,
+        }
+        with open(os.path.join(PROCESSED_DIR, f"{doc_id}.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        with self._lock:
+            self._stats["documents"] += 1
+            self._stats["pages"] += pages
+            self._stats["seconds"] += seconds
+        print(f"📄 Documento {filename} elaborato: {pages} pagine in {seconds:.2f}s")
+        return meta
+
+    def _index_pages(self, doc_id: str, filename: str) -> List[List[int]]:
+        """Aggiunge le pagine estratte all'indice vettoriale e restituisce gli intervalli di righe"""
+        from .vector_index import VECTOR_INDEX_ENABLED, chunk_text, get_vector_index
+
+        if not VECTOR_INDEX_ENABLED:
+            return []
+        index = get_vector_index()
+        ranges: List[List[int]] = []
+        texts: List[str] = []
+        metadatas: List[Dict[str, Any]] = []
+
+        def flush():
+            start, end = index.add(texts, metadatas)
+            if end > start:
+                # Ingestioni concorrenti possono interrompere la contiguità delle righe
+                if ranges and ranges[-1][1] == start:
+                    ranges[-1][1] = end
+                else:
+                    ranges.append([start, end])
+            texts.clear()
+            metadatas.clear()
+
+        try:
+            for number, text in self.iter_document_pages(doc_id):
+                for chunk in chunk_text(text):
+                    texts.append(chunk)
+                    metadatas.append(
+                        {"source": "document", "document_id": doc_id, "filename": filename, "page": number}
+                    )
+                if len(texts) >= 256:
+                    flush()
+            if texts:
+                flush()
+        except Exception as e:
+            print(f"⚠️ Indicizzazione del documento {filename} non riuscita: {e}")
+        return ranges
+
+    # ---------------------------------------------------------------- lettura
+
+    def metadata(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        if not _DOC_ID_PATTERN.match(doc_id or ""):
+            return None
+        try:
+            with open(os.path.join(PROCESSED_DIR, f"{doc_id}.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def iter_document_pages(self, doc_id: str) -> Iterator[Tuple[int, str]]:
+        """Rilegge le pagine estratte di un documento, una alla volta"""
+        if not _DOC_ID_PATTERN.match(doc_id or ""):
+            return
+        try:
+            with open(os.path.join(PROCESSED_DIR, f"{doc_id}.jsonl"), encoding="utf-8") as f:
+                for line in f:
+                    page = json.loads(line)
+                    yield page["page"], page["text"]
+        except FileNotFoundError:
+            return
+
+    def context_for(
+        self,
+        doc_ids: List[str],
+        max_chars: int = DOCUMENT_CONTEXT_CHARS,
+        query: Optional[str] = None,
+    ) -> str:
+        """Testo dei documenti da passare all'agente, entro max_chars caratteri"""
+        if query:
+            retrieved = self._retrieved_context(doc_ids, query, max_chars)
+            if retrieved:
+                return retrieved
+
+        # Nessun indice disponibile: le prime pagine, in ordine
+        parts, remaining = [], max_chars
+        for doc_id in doc_ids or []:
+            meta = self.metadata(doc_id)
+            if meta is None or remaining <= 0:
+                continue
+            parts.append(f"### Documento: {meta['filename']}")
+            for number, text in self.iter_document_pages(doc_id):
+                if remaining <= 0:
+                    break
+                snippet = text[:remaining]
+                parts.append(f"[pagina {number}]\n{snippet}")
+                remaining -= len(snippet)
+        return "\n\n".join(parts)
+
+    def vector_rows(self, doc_ids: List[str]) -> List[Tuple[int, int]]:
+        """Intervalli di righe dell'indice vettoriale occupati dai documenti"""
+        rows = []
+        for doc_id in doc_ids or []:
+            meta = self.metadata(doc_id)
+            if meta:
+                rows.extend(tuple(pair) for pair in meta.get("vector_rows") or [])
+        return rows
+
+    def _retrieved_context(self, doc_ids: List[str], query: str, max_chars: int) -> str:
+        """Solo i passaggi dei documenti più pertinenti alla domanda (indice vettoriale)"""
+        from .vector_index import VECTOR_CHUNK_CHARS, VECTOR_INDEX_ENABLED, get_vector_index
+
+        if not VECTOR_INDEX_ENABLED:
+            return ""
+        rows = self.vector_rows(doc_ids)
+        if not rows:
+            return ""
+
+        hits = get_vector_index().search(query, k=max(1, max_chars // VECTOR_CHUNK_CHARS), rows=rows)
+        parts, remaining = [], max_chars
+        for hit in hits:
+            if remaining <= 0:
+                break
+            snippet = hit["text"][:remaining]
+            parts.append(f"[{hit['filename']}, pagina {hit['page']}]\n{snippet}")
+            remaining -= len(snippet)
+        return "\n\n".join(parts)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["pages_per_second"] = (
+            round(stats["pages"] / stats["seconds"], 2) if stats["seconds"] > 0 else None
+        )
+        stats["seconds"] = round(stats["seconds"], 3)
+        return stats
+
+
+_ingestor: Optional[DocumentIngestor] = None
+_ingestor_lock = threading.Lock()
+
+
+def get_document_ingestor() -> DocumentIngestor:
+    """Restituisce la pipeline di ingestione condivisa dal processo"""
+    global _ingestor
+    with _ingestor_lock:
+        if _ingestor is None:
+            _ingestor = DocumentIngestor()
+        return _ingestor
@@ -0,0 +1,287 @@
+"""
+Guide Store - Guide delle destinazioni pre-generate e salvate su disco
+
+Le guide (storia, attrazioni con immagini, alloggi) richiedono una chiamata
+LLM e diverse ricerche SerpAPI: la pipeline in blocco le genera in anticipo
+per le destinazioni più comuni, il tool e `GET /guides/{destination}` le
+servono dal disco finché sono fresche.
+
+    python -m travel_agent_api.services.guide_store build Roma Parigi --concurrency 2
+    python -m travel_agent_api.services.guide_store build            # GUIDE_DESTINATIONS
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from email.utils import formatdate
+from typing import Any, Dict, List, Optional
+
+from .image_handles import image_handles
+
+GUIDE_STORE_DIR = os.getenv("GUIDE_STORE_DIR", "cache/guides")
+# Oltre questa età il tool rigenera la guida (la pipeline in blocco la aggiorna)
+GUIDE_MAX_AGE_DAYS = float(os.getenv("GUIDE_MAX_AGE_DAYS", "30"))
+# Destinazioni pre-generate dalla pipeline in blocco se non indicate da riga di comando
+GUIDE_DESTINATIONS = [
+    name.strip()
+    for name in os.getenv(
+        "GUIDE_DESTINATIONS",
+        "Roma,Firenze,Venezia,Milano,Napoli,Parigi,Londra,Barcellona,Madrid,Amsterdam,Berlino,Praga,Vienna,Lisbona,Atene,New York,Tokyo",
+    ).split(",")
+    if name.strip()
+]
+# Guide generate in parallelo (ognuna fa una chiamata LLM e più ricerche SerpAPI)
+GUIDE_BUILD_CONCURRENCY = int(os.getenv("GUIDE_BUILD_CONCURRENCY", "2"))
+
+# Versione del formato: le guide salvate con un formato diverso sono ignorate e rigenerate
+GUIDE_FORMAT_VERSION = 2
+
+
+class GuideNotFound(Exception):
+    """Guida mai generata o destinazione non valida"""
+
+
+def guide_slug(destination: str) -> str:
+    """Nome di file della destinazione: "Città del Messico" -> "citta-del-messico" """
+    ascii_name = unicodedata.normalize("NFKD", destination).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-z0-9]+", "-", ascii_name.lower()).strip("-")
+
+
+class GuideStore:
+    """
+    Guide salvate come `<dir>/v<formato>/<slug>.json`.
+
+    Ogni salvataggio sostituisce il file in modo atomico e incrementa la
+    revisione della guida. L'ETag della risposta copre sia il contenuto sia
+    i metadati restituiti (revisione, data di generazione, freschezza).
+    """
+
+    def __init__(self, directory: str = GUIDE_STORE_DIR, max_age_days: float = GUIDE_MAX_AGE_DAYS):
+        self.directory = os.path.join(directory, f"v{GUIDE_FORMAT_VERSION}")
+        self.max_age = max_age_days * 86400
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.saved = 0
+
+    def _path(self, destination: str) -> str:
+        slug = guide_slug(destination)
+        if not slug:
+            raise GuideNotFound(f"Destinazione non valida: {destination!r}")
+        return os.path.join(self.directory, f"{slug}.json")
+
+    def get(self, destination: str) -> Dict[str, Any]:
+        """Guida salvata, anche se non più fresca"""
+        try:
+            with open(self._path(destination), encoding="utf-8") as handle:
+                return json.load(handle)
+        except (FileNotFoundError, ValueError):
+            raise GuideNotFound(f"Nessuna guida salvata per '{destination}'")
+
+    def is_fresh(self, guide: Dict[str, Any]) -> bool:
+        return time.time() - guide.get("generated_ts", 0) < self.max_age
+
+    def fresh(self, destination: str) -> Optional[Dict[str, Any]]:
+        """Guida da servire senza rigenerarla, None se assente o scaduta"""
+        try:
+            guide = self.get(destination)
+        except GuideNotFound:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            if self.is_fresh(guide):
+                self.hits += 1
+                return guide
+            self.stale += 1
+        return None
+
+    def save(
+        self,
+        destination: str,
+        markdown: str,
+        blocks: Optional[List[Dict[str, Any]]] = None,
+        seconds: float = 0.0,
+        images: Optional[Dict[str, Dict[str, Any]]] = None,
+    ) -> Dict[str, Any]:
+        """`images`: immagini dei segnaposto [img:...] del markdown, per espanderli dopo un riavvio"""
+        path = self._path(destination)
+        blocks = blocks or []
+        images = images or {}
+        digest = hashlib.sha1(
+            json.dumps([markdown, blocks, images], ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        with self._lock:
+            try:
+                previous = self.get(destination)
+            except GuideNotFound:
+                previous = {}
+            guide = {
+                "destination": destination,
+                "slug": guide_slug(destination),
+                "format_version": GUIDE_FORMAT_VERSION,
+                "revision": previous.get("revision", 0) + 1,
+                "etag": digest[:32],
+                "generated_at": datetime.now().isoformat(timespec="seconds"),
+                "generated_ts": time.time(),
+                "build_seconds": round(seconds, 1),
+                "markdown": markdown,
+                "blocks": blocks,
+                "images": images,
+            }
+            os.makedirs(self.directory, exist_ok=True)
+            # Scrittura atomica: una pipeline interrotta non lascia guide troncate
+            temporary = f"{path}.{threading.get_ident()}.tmp"
+            with open(temporary, "w", encoding="utf-8") as handle:
+                json.dump(guide, handle, ensure_ascii=False)
+            os.replace(temporary, path)
+            self.saved += 1
+        print(f"📘 Guida di {destination} salvata (revisione {guide['revision']}, {guide['build_seconds']}s)")
+        return guide
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Guide disponibili in ordine alfabetico, senza il contenuto"""
+        if not os.path.isdir(self.directory):
+            return []
+        guides = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                guide = self.get(name[:-5])
+            except GuideNotFound:
+                continue
+            guides.append({
+                "destination": guide["destination"],
+                "slug": guide["slug"],
+                "revision": guide["revision"],
+                "generated_at": guide["generated_at"],
+                "fresh": self.is_fresh(guide),
+            })
+        return guides
+
+    def cache_headers(self, guide: Dict[str, Any]) -> Dict[str, str]:
+        # Una guida che diventa scaduta cambia `fresh` nella risposta: cambia anche l'ETag
+        version = f'{guide["etag"]}:{guide["revision"]}:{guide["generated_at"]}:{self.is_fresh(guide)}'
+        return {
+            "ETag": f'"{hashlib.sha1(version.encode("utf-8")).hexdigest()[:32]}"',
+            "Cache-Control": "public, max-age=3600",
+            "Last-Modified": formatdate(guide["generated_ts"], usegmt=True),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        stored = len(self.list())
+        with self._lock:
+            served = self.hits + self.misses + self.stale
+            return {
+                "stored": stored,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "hit_rate": round(self.hits / served, 3) if served else None,
+                "saved_since_start": self.saved,
+                "max_age_days": self.max_age / 86400,
+            }
+
+
+guide_store = GuideStore()
+
+
+def build_guides(
+    destinations: List[str],
+    concurrency: int = GUIDE_BUILD_CONCURRENCY,
+    force: bool = False,
+    store: GuideStore = guide_store,
+) -> Dict[str, Any]:
+    """
+    Genera in parallelo (al massimo `concurrency` alla volta) le guide mancanti o scadute.
+
+    Ogni guida viene salvata appena pronta: dopo un'interruzione basta
+    rilanciare la pipeline, che salta le guide ancora fresche.
+    """
+    from ..tools.destination_guide import build_destination_guide
+
+    started = time.monotonic()
+    pending, skipped = [], []
+    # Stessa guida per "Roma" e "roma": una sola generazione per slug
+    unique: Dict[str, str] = {}
+    for destination in destinations:
+        if guide_slug(destination):
+            unique.setdefault(guide_slug(destination), destination)
+    for destination in unique.values():
+        try:
+            fresh = not force and store.is_fresh(store.get(destination))
+        except GuideNotFound:
+            fresh = False
+        (skipped if fresh else pending).append(destination)
+    print(f"📚 Guide da generare: {len(pending)} (già fresche: {len(skipped)}, {concurrency} in parallelo)")
+
+    def build(destination: str):
+        guide_started = time.monotonic()
+        markdown, blocks, problems = build_destination_guide(destination)
+        if problems:
+            # Guida incompleta: non salvata, il prossimo lancio della pipeline la riprova
+            raise RuntimeError(f"guida incompleta ({'; '.join(problems)})")
+        return store.save(
+            destination,
+            markdown,
+            blocks,
+            time.monotonic() - guide_started,
+            images=image_handles.images_for(markdown),
+        )
+
+    built, failed = [], {}
+    pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="freya-guides")
+    try:
+        futures = {pool.submit(build, destination): destination for destination in pending}
+        for future in as_completed(futures):
+            destination = futures[future]
+            try:
+                future.result()
+                built.append(destination)
+            except Exception as e:
+                print(f"⚠️ Guida di {destination} non generata: {e}")
+                failed[destination] = str(e)
+    finally:
+        # Su Ctrl+C le guide non ancora avviate vengono annullate, quelle salvate restano
+        pool.shutdown(wait=True, cancel_futures=True)
+    report = {
+        "finished_at": datetime.now().isoformat(timespec="seconds"),
+        "seconds": round(time.monotonic() - started, 1),
+        "built": built,
+        "skipped": skipped,
+        "failed": failed,
+    }
+    print(f"✅ Guide generate: {len(built)}, saltate: {len(skipped)}, fallite: {len(failed)} in {report['seconds']}s")
+    return report
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Pre-generazione delle guide delle destinazioni")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="genera le guide mancanti o scadute")
+    build.add_argument("destinations", nargs="*", help="destinazioni (default: GUIDE_DESTINATIONS)")
+    build.add_argument("--concurrency", type=int, default=GUIDE_BUILD_CONCURRENCY)
+    build.add_argument("--force", action="store_true", help="rigenera anche le guide ancora fresche")
+    commands.add_parser("list", help="elenca le guide salvate")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        report = build_guides(args.destinations or GUIDE_DESTINATIONS, args.concurrency, args.force)
+        sys.exit(1 if report["failed"] else 0)
+    for guide in guide_store.list():
+        state = "fresca" if guide["fresh"] else "scaduta"
+        print(f"{guide['destination']:<25} rev {guide['revision']:<3} {guide['generated_at']} ({state})")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
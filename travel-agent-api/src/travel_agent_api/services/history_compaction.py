@@ -0,0 +1,304 @@
+"""
+History Compaction - Chat history compatta, entro un budget di token fisso per richiesta
+
+Le risposte precedenti di Freya tornano al modello senza immagini, link e
+segnaposto (anche quando il client le rimanda già convertite in HTML, come
+Chatbot::processLinksForNewTab di web_TravelAgent); gli ultimi HISTORY_KEEP_TURNS scambi restano testuali, quelli
+più vecchi diventano un riassunto aggiornato un turno alla volta e
+ricordato in memoria per le richieste successive della stessa chat.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from .admission_control import current_degradation
+from .chat_messages import ChatMessage
+
+# Token massimi della chat history passata all'agente (riassunto compreso)
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+# Scambi recenti (domanda + risposta) passati testualmente
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "3"))
+# Token massimi del riassunto degli scambi più vecchi
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "400"))
+# Riassunto scritto dal modello; con false (o sotto carico) solo estratti delle frasi iniziali
+HISTORY_SUMMARY_LLM = os.getenv("HISTORY_SUMMARY_LLM", "true").lower() in ("1", "true", "yes")
+HISTORY_SUMMARY_CACHE_MAX = int(os.getenv("HISTORY_SUMMARY_CACHE_MAX", "5000"))
+
+# Stessa stima di llm_scheduler: circa 4 caratteri per token
+_CHARS_PER_TOKEN = 4
+# Testo massimo di una risposta passato al riassunto incrementale
+_SUMMARY_INPUT_CHARS = 1500
+
+_LINKED_IMAGE = re.compile(r"\[!\[[^\]]*\]\([^)]*\)\]\([^)]*\)")
+_IMAGE = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+_IMAGE_HANDLE = re.compile(r"\[img:[^\]]*\]")
+_LINK = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+_URL = re.compile(r"https?://\S+")
+# Righe di servizio delle vecchie risposte con immagini (link, dimensioni, fonte, separatori),
+# in markdown o già convertite in HTML dal client
+_BOILERPLATE_LINE = re.compile(
+    r"^\s*(?:🔗|📐|[-*_]{3,}\s*$|.*(?:\*\*Fonte:\*\*|<strong>\s*Fonte:\s*</strong>|<b>\s*Fonte:\s*</b>))",
+    re.IGNORECASE,
+)
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+# HTML delle risposte rimandate dal client web: immagini, link, a capo, titoli ed elenchi
+_HTML_IMAGE = re.compile(r"<img\b[^>]*>", re.IGNORECASE)
+_HTML_LINK = re.compile(r"<a\b[^>]*>(.*?)</a>", re.IGNORECASE | re.DOTALL)
+_HTML_BREAK = re.compile(r"<br\s*/?>[ \t]*(\r?\n)?", re.IGNORECASE)
+_HTML_HEADING = re.compile(r"<h([1-6])\b[^>]*>(.*?)</h\1>", re.IGNORECASE | re.DOTALL)
+_HTML_BULLET = re.compile(r"<div\b[^>]*>\s*•?\s*(.*?)</div>", re.IGNORECASE | re.DOTALL)
+_HTML_BOLD = re.compile(r"</?(?:strong|b)\b[^>]*>", re.IGNORECASE)
+_HTML_ITALIC = re.compile(r"</?(?:em|i)\b[^>]*>", re.IGNORECASE)
+_HTML_TAG = re.compile(r"</?[a-z][a-z0-9]*\b[^>]*>", re.IGNORECASE)
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+
+
+def _html_to_text(text: str) -> str:
+    """Riporta a righe di testo l'HTML del client: titoli ed elenchi tornano markdown"""
+    text = _HTML_IMAGE.sub("", text)
+    text = _HTML_LINK.sub(r"\1", text)
+    text = _HTML_BREAK.sub("\n", text)
+    text = _HTML_HEADING.sub(lambda match: f"{'#' * int(match.group(1))} {match.group(2).strip()}", text)
+    return _HTML_BULLET.sub(r"- \1", text)
+
+
+def strip_boilerplate(text: str) -> str:
+    """Risposta senza immagini, URL e righe di servizio: resta solo il contenuto"""
+    text = text or ""
+    if "<" in text:
+        text = _html_to_text(text)
+    text = _LINKED_IMAGE.sub("", text)
+    text = _IMAGE.sub("", text)
+    text = _IMAGE_HANDLE.sub("", text)
+    text = _LINK.sub(r"\1", text)
+    text = _URL.sub("", text)
+    lines = [line.rstrip() for line in text.splitlines() if not _BOILERPLATE_LINE.match(line)]
+    # Titoli rimasti senza contenuto (es. "### 📸 Colosseo" senza più immagini):
+    # un solo passaggio dal fondo, ricordando la prima riga non vuota che segue
+    kept, following = [], ""
+    for line in reversed(lines):
+        if not (line.lstrip().startswith("#") and (not following or following.lstrip().startswith("#"))):
+            kept.append(line)
+        if line.strip():
+            following = line
+    text = "\n".join(reversed(kept))
+    if "<" in text:
+        # Grassetto e corsivo tornano markdown, gli altri tag restano solo testo
+        text = _HTML_TAG.sub("", _HTML_ITALIC.sub("*", _HTML_BOLD.sub("**", text)))
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+
+def _truncate(text: str, tokens: int) -> str:
+    limit = max(0, tokens) * _CHARS_PER_TOKEN
+    return text if len(text) <= limit else text[: max(0, limit - 1)].rstrip() + "…"
+
+
+Turn = Tuple[str, str]  # (domanda dell'utente, risposta di Freya)
+
+
+def _turns(messages: List[ChatMessage]) -> List[Turn]:
+    """Scambi domanda/risposta; i messaggi di sistema del client non fanno parte della history"""
+    turns: List[List[str]] = []
+    for message in messages:
+        if message.role == "user":
+            turns.append([message.content, ""])
+        elif message.role == "assistant":
+            if not turns or turns[-1][1]:
+                turns.append(["", ""])
+            turns[-1][1] = strip_boilerplate(message.content)
+    return [(user, assistant) for user, assistant in turns]
+
+
+def _turn_tokens(turns: List[Turn]) -> int:
+    return sum(estimate_tokens(user) + estimate_tokens(assistant) for user, assistant in turns)
+
+
+def _chain(turns: List[Turn]) -> List[str]:
+    """Hash progressivi dei prefissi della conversazione: chiave del riassunto dei primi n scambi"""
+    digests, previous = [], ""
+    for user, assistant in turns:
+        previous = hashlib.sha1(f"{previous}\0{user}\0{assistant}".encode("utf-8")).hexdigest()[:20]
+        digests.append(previous)
+    return digests
+
+
+class HistoryCompactor:
+    """
+    Compattazione della chat history prima di ogni esecuzione dell'agente.
+
+    Il riassunto dei primi n scambi è indicizzato per l'hash del prefisso:
+    alla richiesta successiva della stessa chat si riparte dal riassunto già
+    pronto e si aggiungono solo gli scambi usciti dalla finestra recente.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = HISTORY_TOKEN_BUDGET,
+        keep_turns: int = HISTORY_KEEP_TURNS,
+        summary_tokens: int = HISTORY_SUMMARY_TOKENS,
+        use_llm: bool = HISTORY_SUMMARY_LLM,
+        cache_max: int = HISTORY_SUMMARY_CACHE_MAX,
+    ):
+        self.token_budget = token_budget
+        self.keep_turns = max(1, keep_turns)
+        self.summary_tokens = min(summary_tokens, token_budget // 2)
+        self.use_llm = use_llm
+        self.cache_max = cache_max
+        self._lock = threading.Lock()
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        self.requests = 0
+        self.compacted = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.summary_hits = 0
+        self.summary_llm = 0
+        self.summary_extractive = 0
+        self.summary_errors = 0
+
+    def compact(self, messages: List[ChatMessage]) -> List[BaseMessage]:
+        """Messaggi LangChain della history (senza la domanda corrente) entro il budget"""
+        turns = _turns(messages)
+        tokens_in = sum(estimate_tokens(message.content) for message in messages if message.role != "system")
+
+        # Finestra recente: al massimo keep_turns scambi, ridotta finché non entra nel budget
+        keep = min(self.keep_turns, len(turns))
+        while keep > 1:
+            reserve = self.summary_tokens if keep < len(turns) else 0
+            if _turn_tokens(turns[-keep:]) <= self.token_budget - reserve:
+                break
+            keep -= 1
+        older, recent = turns[: len(turns) - keep], turns[len(turns) - keep:]
+
+        history: List[BaseMessage] = []
+        if older:
+            summary = _truncate(self._summary(older), self.summary_tokens)
+            history.append(SystemMessage(content=f"📜 Riassunto della conversazione precedente:\n{summary}"))
+        available = self.token_budget - sum(estimate_tokens(message.content) for message in history)
+        for user, assistant in recent:
+            # Anche un solo scambio può superare il budget (es. un lungo elenco di hotel)
+            if estimate_tokens(user) + estimate_tokens(assistant) > available:
+                user = _truncate(user, max(available // 2, available - estimate_tokens(assistant)))
+                assistant = _truncate(assistant, available - estimate_tokens(user))
+            if user:
+                history.append(HumanMessage(content=user))
+            if assistant:
+                # Risposte precedenti come messaggi dell'assistente, non come istruzioni di sistema
+                history.append(AIMessage(content=assistant))
+            available -= estimate_tokens(user) + estimate_tokens(assistant)
+
+        tokens_out = sum(estimate_tokens(message.content) for message in history)
+        with self._lock:
+            self.requests += 1
+            self.compacted += 1 if older else 0
+            self.tokens_in += tokens_in
+            self.tokens_out += tokens_out
+        if tokens_out < tokens_in:
+            print(
+                f"🗜️ Chat history compattata: {tokens_in} → {tokens_out} token "
+                f"({len(older)} scambi riassunti, {len(recent)} testuali)"
+            )
+        return history
+
+    def _summary(self, turns: List[Turn]) -> str:
+        chain = _chain(turns)
+        start, previous = 0, ""
+        with self._lock:
+            # Riassunto più lungo già pronto per un prefisso di questa conversazione
+            for index in range(len(chain) - 1, -1, -1):
+                cached = self._summaries.get(chain[index])
+                if cached is not None:
+                    self._summaries.move_to_end(chain[index])
+                    start, previous = index + 1, cached
+                    break
+            if start == len(turns):
+                self.summary_hits += 1
+                return previous
+
+        summary = self._update(previous, turns[start:])
+        with self._lock:
+            self._summaries[chain[-1]] = summary
+            while len(self._summaries) > self.cache_max:
+                self._summaries.popitem(last=False)
+        return summary
+
+    def _update(self, previous: str, turns: List[Turn]) -> str:
+        """Riassunto aggiornato con i nuovi scambi: dal modello, o per estratti sotto carico"""
+        if self.use_llm and current_degradation().level == 0 and os.getenv("OPENAI_API_KEY"):
+            try:
+                summary = self._llm_update(previous, turns)
+                with self._lock:
+                    self.summary_llm += 1
+                return summary
+            except Exception as e:
+                print(f"⚠️ Riassunto della chat non generato dal modello, uso gli estratti: {e}")
+                with self._lock:
+                    self.summary_errors += 1
+        with self._lock:
+            self.summary_extractive += 1
+        return self._extractive_update(previous, turns)
+
+    def _llm_update(self, previous: str, turns: List[Turn]) -> str:
+        from .model_router import ModelRequirements, route_chat_model
+
+        model = route_chat_model(
+            "history_summary",
+            ModelRequirements(latency_target=5.0, max_output_tokens=self.summary_tokens, deterministic=True),
+        )
+        exchanges = "\n\n".join(
+            f"Utente: {_truncate(user, _SUMMARY_INPUT_CHARS // _CHARS_PER_TOKEN)}\n"
+            f"Freya: {_truncate(assistant, _SUMMARY_INPUT_CHARS // _CHARS_PER_TOKEN)}"
+            for user, assistant in turns
+        )
+        response = model.invoke([
+            SystemMessage(content=(
+                "Aggiorni il riassunto di una conversazione tra un utente e Freya, assistente di viaggio. "
+                "Conserva destinazioni, date, budget, preferenze, decisioni prese e richieste ancora aperte; "
+                "ometti saluti, immagini ed elenchi completi. Rispondi solo con il riassunto in italiano, "
+                f"in elenco puntato, al massimo {self.summary_tokens * 3 // 4} parole."
+            )),
+            HumanMessage(content=(
+                f"Riassunto attuale:\n{previous or '(nessuno)'}\n\nNuovi scambi:\n{exchanges}"
+            )),
+        ])
+        return response.content.strip()
+
+    def _extractive_update(self, previous: str, turns: List[Turn]) -> str:
+        lines = [previous] if previous else []
+        for user, assistant in turns:
+            answer = " ".join(assistant.split())
+            # Prima frase della risposta: di solito dice cosa Freya ha proposto
+            answer = re.split(r"(?<=[.!?])\s", answer, maxsplit=1)[0]
+            lines.append(f"- Utente: {_truncate(' '.join(user.split()), 40)} | Freya: {_truncate(answer, 40)}")
+        summary = "\n".join(lines)
+        # Oltre il limite si perdono gli scambi più vecchi
+        limit = self.summary_tokens * _CHARS_PER_TOKEN
+        return summary if len(summary) <= limit else "…" + summary[-(limit - 1):]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "compacted": self.compacted,
+                "tokens_in": self.tokens_in,
+                "tokens_out": self.tokens_out,
+                "saved_ratio": round(1 - self.tokens_out / self.tokens_in, 3) if self.tokens_in else None,
+                "summary_cache": len(self._summaries),
+                "summary_hits": self.summary_hits,
+                "summary_llm": self.summary_llm,
+                "summary_extractive": self.summary_extractive,
+                "summary_errors": self.summary_errors,
+                "token_budget": self.token_budget,
+            }
+
+
+history_compactor = HistoryCompactor()
@@ -0,0 +1,206 @@
+"""
+Hotel Cursor - Risultati di Google Hotels paginati su richiesta e conservati lato server
+"""
+
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+HOTEL_PAGE_SIZE = int(os.getenv("HOTEL_PAGE_SIZE", "5"))
+# Inattività dopo cui un cursore viene dimenticato e numero massimo di cursori aperti
+HOTEL_CURSOR_TTL = float(os.getenv("HOTEL_CURSOR_TTL", "1800"))
+HOTEL_CURSOR_MAX = int(os.getenv("HOTEL_CURSOR_MAX", "500"))
+# Pagine SerpAPI scaricabili in una sola richiesta quando i filtri scartano tutto
+HOTEL_MAX_FETCHES_PER_PAGE = int(os.getenv("HOTEL_MAX_FETCHES_PER_PAGE", "3"))
+
+
+class HotelCursorError(Exception):
+    """Cursore sconosciuto o scaduto (404) oppure SerpAPI non raggiungibile (502)"""
+
+    def __init__(self, message: str, status_code: int = 404):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def compact_hotel(hotel: Dict[str, Any]) -> Dict[str, Any]:
+    """Solo i campi utili per scegliere: la risposta completa di SerpAPI è troppo grande per il prompt"""
+    rate = hotel.get("rate_per_night") or {}
+    total = hotel.get("total_rate") or {}
+    compact = {
+        "name": hotel.get("name"),
+        "type": hotel.get("type"),
+        "price_per_night": rate.get("extracted_lowest"),
+        "price_per_night_text": rate.get("lowest"),
+        "total_price": total.get("extracted_lowest"),
+        "rating": hotel.get("overall_rating"),
+        "reviews": hotel.get("reviews"),
+        "hotel_class": hotel.get("extracted_hotel_class"),
+        "location_rating": hotel.get("location_rating"),
+        "amenities": (hotel.get("amenities") or [])[:6],
+        "link": hotel.get("link"),
+        "gps": hotel.get("gps_coordinates"),
+        "thumbnail": ((hotel.get("images") or [{}])[0] or {}).get("thumbnail"),
+    }
+    return {key: value for key, value in compact.items() if value not in (None, [], "")}
+
+
+def _matches(hotel: Dict[str, Any], max_price: Optional[float], min_rating: Optional[float]) -> bool:
+    if max_price is not None and (hotel.get("price_per_night") is None or hotel["price_per_night"] > max_price):
+        return False
+    if min_rating is not None and (hotel.get("rating") is None or hotel["rating"] < min_rating):
+        return False
+    return True
+
+
+class HotelCursor:
+    """
+    Ricerca hotel scorribile a pagine.
+
+    Gli hotel scaricati restano in memoria: le pagine già lette non vengono
+    mai richieste di nuovo a SerpAPI. Una nuova pagina SerpAPI (tramite
+    next_page_token) si scarica solo quando quelli già presenti non bastano
+    a riempire la pagina richiesta con i filtri correnti. Gli hotel scartati
+    dai filtri non vanno persi: restano da parte e vengono restituiti, prima
+    dei nuovi, alla prima chiamata con filtri che li accettano.
+    """
+
+    def __init__(self, handle: str, params: Dict[str, Any], fetch: Callable[[Dict[str, Any]], Dict[str, Any]]):
+        self.handle = handle
+        self.params = params
+        self._fetch = fetch
+        self._lock = threading.Lock()
+        self.hotels: List[Dict[str, Any]] = []
+        self.position = 0  # primo hotel non ancora esaminato
+        self.skipped: List[int] = []  # hotel esaminati ma scartati dai filtri, in ordine
+        self.next_page_token: Optional[str] = None
+        self.exhausted = False
+        self.fetches = 0
+        self.last_used = time.monotonic()
+
+    def _fetch_page(self):
+        params = dict(self.params)
+        if self.next_page_token:
+            params["next_page_token"] = self.next_page_token
+        try:
+            result = self._fetch(params)
+        except Exception as e:
+            # Timeout, breaker aperto o risposta illeggibile: il cursore resta utilizzabile
+            raise HotelCursorError(f"SerpAPI non disponibile: {e}", status_code=502) from e
+        if "error" in result:
+            # Nessun risultato per la ricerca: SerpAPI lo segnala come errore
+            if not self.hotels and self.fetches == 0:
+                raise HotelCursorError(str(result["error"]), status_code=502)
+            self.exhausted = True
+            return
+        self.fetches += 1
+        self.hotels.extend(compact_hotel(hotel) for hotel in result.get("properties") or [])
+        self.next_page_token = (result.get("serpapi_pagination") or {}).get("next_page_token")
+        if not self.next_page_token:
+            self.exhausted = True
+
+    def next_page(
+        self,
+        page_size: int = HOTEL_PAGE_SIZE,
+        max_price: Optional[float] = None,
+        min_rating: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """
+        Prossimi `page_size` hotel che rispettano i filtri: prima quelli
+        scartati in precedenza che ora passano, poi quelli non ancora esaminati.
+        `has_more` indica se restano hotel da esaminare; `hotels_skipped`
+        quanti, già esaminati, non passano i filtri correnti.
+        """
+        page_size = max(1, min(page_size, 20))
+        with self._lock:
+            self.last_used = time.monotonic()
+            page: List[Dict[str, Any]] = []
+            still_skipped: List[int] = []
+            for index in self.skipped:
+                if len(page) < page_size and _matches(self.hotels[index], max_price, min_rating):
+                    page.append(self.hotels[index])
+                else:
+                    still_skipped.append(index)
+            self.skipped = still_skipped
+            fetched_now = 0
+            while len(page) < page_size:
+                if self.position >= len(self.hotels):
+                    if self.exhausted or fetched_now >= HOTEL_MAX_FETCHES_PER_PAGE:
+                        break
+                    try:
+                        self._fetch_page()
+                    except HotelCursorError:
+                        # Gli hotel già in pagina sono stati tolti dal cursore: meglio una pagina corta
+                        if page:
+                            break
+                        raise
+                    fetched_now += 1
+                    continue
+                hotel = self.hotels[self.position]
+                if _matches(hotel, max_price, min_rating):
+                    page.append(hotel)
+                else:
+                    self.skipped.append(self.position)
+                self.position += 1
+            return {
+                "cursor": self.handle,
+                "hotels": page,
+                "hotels_found": len(page),
+                "has_more": not (self.exhausted and self.position >= len(self.hotels)),
+                "hotels_seen": self.position,
+                "hotels_skipped": len(self.skipped),
+                "pages_fetched": self.fetches,
+            }
+
+
+class HotelCursorStore:
+    """Cursori aperti, indicizzati da un handle breve (LRU con scadenza per inattività)"""
+
+    def __init__(self, ttl: float = HOTEL_CURSOR_TTL, max_cursors: int = HOTEL_CURSOR_MAX):
+        self.ttl = ttl
+        self.max_cursors = max(1, max_cursors)
+        self._lock = threading.Lock()
+        self._cursors: "OrderedDict[str, HotelCursor]" = OrderedDict()
+        self._opened = 0
+
+    def _expire(self):
+        now = time.monotonic()
+        for handle in [handle for handle, cursor in self._cursors.items() if now - cursor.last_used > self.ttl]:
+            del self._cursors[handle]
+
+    def open(self, params: Dict[str, Any], fetch: Callable[[Dict[str, Any]], Dict[str, Any]]) -> HotelCursor:
+        with self._lock:
+            self._expire()
+            handle = f"h{secrets.token_hex(3)}"
+            while handle in self._cursors:
+                handle = f"h{secrets.token_hex(3)}"
+            cursor = HotelCursor(handle, params, fetch)
+            self._cursors[handle] = cursor
+            self._opened += 1
+            while len(self._cursors) > self.max_cursors:
+                self._cursors.popitem(last=False)
+            return cursor
+
+    def get(self, handle: str) -> HotelCursor:
+        with self._lock:
+            self._expire()
+            cursor = self._cursors.get(handle.strip())
+            if cursor is None:
+                raise HotelCursorError(f"Cursore hotel '{handle}' sconosciuto o scaduto: ripeti la ricerca")
+            self._cursors.move_to_end(cursor.handle)
+            return cursor
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._expire()
+            return {
+                "open_cursors": len(self._cursors),
+                "opened": self._opened,
+                "pages_fetched": sum(cursor.fetches for cursor in self._cursors.values()),
+                "hotels_buffered": sum(len(cursor.hotels) for cursor in self._cursors.values()),
+            }
+
+
+hotel_cursors = HotelCursorStore()
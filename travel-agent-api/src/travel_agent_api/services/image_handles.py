@@ -0,0 +1,139 @@
+"""
+Image Handles - Immagini salvate lato server, mostrate al modello come segnaposto brevi
+
+Il modello vede solo `[img:colosseo-roma#1]` al posto di URL, fonti e
+dimensioni; i segnaposto che copia nella risposta vengono sostituiti con le
+immagini vere solo nella risposta finale.
+"""
+
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict, defaultdict
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+from .response_blocks import ImageBlock
+
+# Immagini ricordate prima di dimenticare le più vecchie (segnaposto non più espandibili)
+IMAGE_HANDLES_MAX = int(os.getenv("IMAGE_HANDLES_MAX", "20000"))
+
+_HANDLE = re.compile(r"\[img:([a-z0-9-]{1,40}#\d+)\]")
+
+
+def _subject_slug(subject: str) -> str:
+    ascii_name = unicodedata.normalize("NFKD", subject).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-z0-9]+", "-", ascii_name.lower()).strip("-")[:40].strip("-") or "img"
+
+
+def placeholder(handle: str) -> str:
+    return f"[img:{handle}]"
+
+
+def handles_in(text: str) -> List[str]:
+    return _HANDLE.findall(text or "")
+
+
+def render_image(image: ImageBlock) -> str:
+    """Markdown dell'immagine nella risposta finale: miniatura che apre l'originale"""
+    return f"[![{image.title}]({image.thumbnail or image.url})]({image.url})"
+
+
+class ImageHandleStore:
+    """
+    Immagini trovate dai tool, indicizzate per `<soggetto>#<n>`.
+
+    Lo stesso URL cercato per lo stesso soggetto riceve sempre lo stesso
+    segnaposto, così ricerche ripetute (o servite dalla tool cache) non
+    moltiplicano le voci. Oltre `max_images` si dimenticano le più vecchie.
+    """
+
+    def __init__(self, max_images: int = IMAGE_HANDLES_MAX):
+        self.max_images = max(1, max_images)
+        self._lock = threading.Lock()
+        self._images: "OrderedDict[str, ImageBlock]" = OrderedDict()
+        self._by_url: Dict[Tuple[str, str], str] = {}
+        self._last_index: Dict[str, int] = defaultdict(int)
+        self.expanded = 0
+        self.unknown = 0
+
+    def _put(self, handle: str, image: ImageBlock):
+        slug, _, index = handle.partition("#")
+        self._images[handle] = image
+        self._images.move_to_end(handle)
+        self._by_url[(slug, image.url)] = handle
+        self._last_index[slug] = max(self._last_index[slug], int(index))
+        while len(self._images) > self.max_images:
+            old_handle, old_image = self._images.popitem(last=False)
+            self._by_url.pop((old_handle.partition("#")[0], old_image.url), None)
+
+    def register(self, subject: str, images: Iterable[ImageBlock]) -> List[str]:
+        """Segnaposto delle immagini trovate per `subject`, nello stesso ordine"""
+        slug = _subject_slug(subject)
+        handles = []
+        with self._lock:
+            for image in images:
+                handle = self._by_url.get((slug, image.url))
+                # Segnaposto scaduto o riassegnato da restore: ne serve uno nuovo
+                current = self._images.get(handle) if handle else None
+                if current is None or current.url != image.url:
+                    handle = f"{slug}#{self._last_index[slug] + 1}"
+                self._put(handle, image)
+                handles.append(handle)
+        return handles
+
+    def restore(self, images: Mapping[str, dict]):
+        """Registra segnaposto già assegnati (es. quelli di una guida salvata su disco)"""
+        with self._lock:
+            for handle, data in images.items():
+                self._put(handle, ImageBlock.model_validate(data))
+
+    def get(self, handle: str) -> Optional[ImageBlock]:
+        with self._lock:
+            return self._images.get(handle)
+
+    def images_for(self, text: str) -> Dict[str, dict]:
+        """Immagini dei segnaposto presenti nel testo, serializzabili insieme al testo"""
+        found = {}
+        for handle in handles_in(text):
+            image = self.get(handle)
+            if image is not None:
+                found[handle] = image.model_dump(exclude_none=True)
+        return found
+
+    def expand(self, text: str, markdown: bool = True, images: Optional[Mapping[str, ImageBlock]] = None) -> str:
+        """
+        Sostituisce i segnaposto con le immagini in markdown (o li rimuove con
+        `markdown=False`, es. quando le immagini arrivano già come blocchi).
+        I segnaposto sconosciuti, inventati dal modello o scaduti, spariscono.
+        """
+        if not text or "[img:" not in text:
+            return text
+        lookup = images.get if images is not None else self.get
+        counts = {"expanded": 0, "unknown": 0}
+
+        def replace(match: "re.Match[str]") -> str:
+            image = lookup(match.group(1))
+            if image is None:
+                counts["unknown"] += 1
+                return ""
+            counts["expanded"] += 1
+            return render_image(image) if markdown else ""
+
+        expanded = _HANDLE.sub(replace, text)
+        with self._lock:
+            self.expanded += counts["expanded"]
+            self.unknown += counts["unknown"]
+        return expanded
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "images": len(self._images),
+                "subjects": len(self._last_index),
+                "expanded": self.expanded,
+                "unknown_handles": self.unknown,
+            }
+
+
+image_handles = ImageHandleStore()
@@ -0,0 +1,218 @@
+"""
+Image Proxy - Miniature locali con cache su disco e rimozione dei link non raggiungibili
+"""
+
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import requests
+from PIL import Image, features
+
+# Cartella della cache content-addressed delle immagini
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "cache/images")
+# URL pubblico dell'API usato nei link markdown delle miniature
+IMAGE_PROXY_BASE_URL = os.getenv("IMAGE_PROXY_BASE_URL", "http://127.0.0.1:8080").rstrip("/")
+IMAGE_PROXY_ENABLED = os.getenv("IMAGE_PROXY_ENABLED", "true").lower() in ("1", "true", "yes")
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "4"))
+IMAGE_FETCH_TIMEOUT = float(os.getenv("IMAGE_FETCH_TIMEOUT", "10"))
+IMAGE_PROBE_TIMEOUT = float(os.getenv("IMAGE_PROBE_TIMEOUT", "3"))
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(15 * 1024 * 1024)))
+IMAGE_CACHE_MAX_AGE = int(os.getenv("IMAGE_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+
+# Larghezze generate: le richieste vengono arrotondate alla prima larghezza sufficiente
+VARIANT_WIDTHS = (64, 160, 320, 640, 1280)
+THUMBNAIL_WIDTH = 160
+
+_VARIANT_FORMAT, _VARIANT_MEDIA_TYPE = (
+    ("WEBP", "image/webp") if features.check("webp") else ("JPEG", "image/jpeg")
+)
+
+_USER_AGENT = "Mozilla/5.0 (compatible; FreyaTravelAgent/2.0; +image-proxy)"
+# Lock a strisce per download e varianti: memoria fissa qualunque sia il numero di URL
+_LOCK_STRIPES = 64
+
+
+class ImageProxyError(Exception):
+    """Immagine non registrata o non recuperabile"""
+
+    def __init__(self, message: str, status_code: int = 502):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _resize(data: bytes, width: int) -> bytes:
+    """Ridimensiona un'immagine mantenendo le proporzioni (eseguito nel pool)"""
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft("RGB", (width, width))  # decodifica JPEG ridotta quando possibile
+        if img.width > width:
+            img.thumbnail((width, width * 4), Image.LANCZOS)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+        if _VARIANT_FORMAT == "JPEG" and img.mode == "RGBA":
+            img = img.convert("RGB")
+        out = io.BytesIO()
+        img.save(out, _VARIANT_FORMAT, quality=80)
+        return out.getvalue()
+
+
+class ImageProxy:
+    """
+    Proxy delle immagini di Google Images.
+
+    Gli URL originali vengono registrati con una chiave corta; alla prima
+    richiesta l'originale viene scaricato una sola volta e salvato per hash
+    del contenuto, poi le varianti ridimensionate sono generate nel pool di
+    worker e servite dal disco con ETag e Cache-Control.
+    """
+
+    def __init__(self, cache_dir: str = IMAGE_CACHE_DIR):
+        self.cache_dir = cache_dir
+        for sub in ("urls", "blobs", "variants"):
+            os.makedirs(os.path.join(cache_dir, sub), exist_ok=True)
+        self._pool = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="freya-image")
+        self._session = requests.Session()
+        self._session.headers["User-Agent"] = _USER_AGENT
+        adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=32)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._locks = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+
+    def _path(self, *parts: str) -> str:
+        return os.path.join(self.cache_dir, *parts)
+
+    def _lock_for(self, key: str) -> threading.Lock:
+        # Due chiavi sulla stessa striscia si attendono a vicenda, senza altri effetti
+        return self._locks[int(hashlib.sha1(key.encode("utf-8")).hexdigest()[:8], 16) % _LOCK_STRIPES]
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes):
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    # ---------------------------------------------------------------- registrazione
+
+    def register(self, url: str) -> str:
+        """Registra un URL sorgente e restituisce la chiave usata dal proxy"""
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:24]
+        path = self._path("urls", f"{key}.url")
+        if not os.path.exists(path):
+            self._write_atomic(path, url.encode("utf-8"))
+        return key
+
+    def proxy_url(self, url: str, width: int = THUMBNAIL_WIDTH) -> str:
+        """URL pubblico della variante di un'immagine (registra l'URL sorgente)"""
+        return f"{IMAGE_PROXY_BASE_URL}/images/{self.register(url)}?w={width}"
+
+    def _source_url(self, key: str) -> str:
+        try:
+            with open(self._path("urls", f"{key}.url"), "rb") as f:
+                return f.read().decode("utf-8")
+        except FileNotFoundError:
+            raise ImageProxyError("Immagine non registrata", status_code=404)
+
+    # ---------------------------------------------------------------- download e varianti
+
+    def _download(self, url: str) -> bytes:
+        with self._session.get(url, timeout=IMAGE_FETCH_TIMEOUT, stream=True) as response:
+            if response.status_code >= 400:
+                raise ImageProxyError(f"Upstream ha risposto {response.status_code}")
+            chunks, size = [], 0
+            for chunk in response.iter_content(64 * 1024):
+                size += len(chunk)
+                if size > IMAGE_MAX_BYTES:
+                    raise ImageProxyError("Immagine troppo grande", status_code=413)
+                chunks.append(chunk)
+            return b"".join(chunks)
+
+    def _original_digest(self, key: str) -> str:
+        """Hash del contenuto originale; scarica l'immagine solo la prima volta"""
+        pointer = self._path("urls", f"{key}.blob")
+        if os.path.exists(pointer):
+            with open(pointer, "rb") as f:
+                return f.read().decode("ascii")
+
+        with self._lock_for(key):
+            if os.path.exists(pointer):
+                with open(pointer, "rb") as f:
+                    return f.read().decode("ascii")
+            try:
+                data = self._download(self._source_url(key))
+            except requests.RequestException as e:
+                raise ImageProxyError(f"Immagine non raggiungibile: {e}")
+            digest = hashlib.sha256(data).hexdigest()
+            blob_path = self._path("blobs", digest)
+            if not os.path.exists(blob_path):
+                self._write_atomic(blob_path, data)
+            self._write_atomic(pointer, digest.encode("ascii"))
+            return digest
+
+    def variant(self, key: str, width: int) -> Tuple[str, bytes, str]:
+        """Restituisce (etag, contenuto, media type) della variante richiesta"""
+        width = next((w for w in VARIANT_WIDTHS if w >= width), VARIANT_WIDTHS[-1])
+        digest = self._original_digest(key)
+        etag = f"{digest[:32]}-{width}"
+        variant_path = self._path("variants", f"{etag}.{_VARIANT_FORMAT.lower()}")
+
+        if not os.path.exists(variant_path):
+            with self._lock_for(etag):
+                if not os.path.exists(variant_path):
+                    with open(self._path("blobs", digest), "rb") as f:
+                        original = f.read()
+                    try:
+                        data = self._pool.submit(_resize, original, width).result()
+                    except Exception as e:
+                        raise ImageProxyError(f"Immagine non valida: {e}", status_code=415)
+                    self._write_atomic(variant_path, data)
+
+        with open(variant_path, "rb") as f:
+            return etag, f.read(), _VARIANT_MEDIA_TYPE
+
+    def cache_headers(self, etag: str) -> Dict[str, str]:
+        return {
+            "ETag": f'"{etag}"',
+            "Cache-Control": f"public, max-age={IMAGE_CACHE_MAX_AGE}, immutable",
+        }
+
+    # ---------------------------------------------------------------- link non raggiungibili
+
+    def _is_reachable(self, url: str) -> bool:
+        try:
+            response = self._session.head(url, timeout=IMAGE_PROBE_TIMEOUT, allow_redirects=True)
+            if response.status_code in (403, 405, 501):
+                # Alcuni host non supportano HEAD: prova con una GET senza scaricare il corpo
+                response = self._session.get(url, timeout=IMAGE_PROBE_TIMEOUT, stream=True)
+                response.close()
+            if response.status_code >= 400:
+                return False
+            content_type = response.headers.get("Content-Type", "")
+            return not content_type or content_type.startswith("image/")
+        except requests.RequestException:
+            return False
+
+    def filter_reachable(self, urls: Iterable[str]) -> List[str]:
+        """Verifica in parallelo gli URL e restituisce quelli raggiungibili, in ordine"""
+        urls = list(urls)
+        if not urls:
+            return []
+        with ThreadPoolExecutor(max_workers=min(8, len(urls))) as probe_pool:
+            reachable = list(probe_pool.map(self._is_reachable, urls))
+        return [url for url, ok in zip(urls, reachable) if ok]
+
+
+_image_proxy: Optional[ImageProxy] = None
+_image_proxy_lock = threading.Lock()
+
+
+def get_image_proxy() -> ImageProxy:
+    """Restituisce il proxy immagini condiviso dal processo"""
+    global _image_proxy
+    with _image_proxy_lock:
+        if _image_proxy is None:
+            _image_proxy = ImageProxy()
+        return _image_proxy
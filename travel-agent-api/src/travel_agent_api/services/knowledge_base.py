@@ -0,0 +1,319 @@
+"""
+Knowledge Base - Indice BM25 offline su destinazioni e monumenti famosi
+"""
+
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from pydantic import BaseModel, Field
+
+from .vector_index import tokenize
+
+# Corpus JSONL (id, title, aliases, place, text): di default quello incluso nel package
+KNOWLEDGE_CORPUS = os.getenv("KNOWLEDGE_CORPUS") or os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "data", "knowledge_base.jsonl"
+)
+KNOWLEDGE_INDEX_DIR = os.getenv("KNOWLEDGE_INDEX_DIR", "cache/knowledge_index")
+KNOWLEDGE_BASE_ENABLED = os.getenv("KNOWLEDGE_BASE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Se False anche le corrispondenze certe passano dal modello (con contesto e risposta breve)
+KNOWLEDGE_DIRECT_ANSWERS = os.getenv("KNOWLEDGE_DIRECT_ANSWERS", "true").lower() in ("1", "true", "yes")
+# Punteggio BM25 minimo per usare i testi come contesto quando la domanda non cita un titolo o alias
+KNOWLEDGE_MIN_SCORE = float(os.getenv("KNOWLEDGE_MIN_SCORE", "4.0"))
+# Quota minima dei termini specifici della domanda presenti nel testo per rispondere senza LLM
+KNOWLEDGE_MIN_COVERAGE = float(os.getenv("KNOWLEDGE_MIN_COVERAGE", "0.75"))
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Parole tipiche delle richieste che non dicono nulla sul luogo cercato
+_GENERIC_TERMS = frozenset(
+    """
+    storia storie storico storica storici storiche informazioni info dettagli dettagliate dettagliato
+    cultura culturale culturali curiosita aneddoti monumenti monumento principali attrazioni attrazione
+    racconta raccontami parlami dimmi vorrei sapere cosa visitare vedere guida luogo luoghi famoso famosa
+    fornisci descrivi spiegami approfondite approfondimento conoscere
+    tell me about history historical information
+    """.split()
+)
+
+
+class KnowledgeMatch(BaseModel):
+    outcome: str = Field(description="direct (risposta senza LLM), grounded (contesto + risposta breve) o miss.")
+    documents: List[Dict[str, Any]] = Field(default_factory=list, description="Testi recuperati, dal più pertinente.")
+    score: float = Field(0.0, description="Punteggio BM25 del primo testo.")
+    coverage: float = Field(0.0, description="Quota dei termini specifici della domanda presenti nel primo testo.")
+
+
+def _phrase(text: str) -> str:
+    return " ".join(tokenize(text))
+
+
+def build_index(corpus_path: str = KNOWLEDGE_CORPUS, index_dir: str = KNOWLEDGE_INDEX_DIR) -> Dict[str, Any]:
+    """Compila il corpus in un indice invertito su array NumPy (postings in formato CSR)"""
+    started = time.perf_counter()
+    vocabulary: Dict[str, int] = {}
+    postings: List[Dict[int, int]] = []
+    doc_lengths: List[int] = []
+    aliases: Dict[str, int] = {}
+
+    tmp_dir = f"{index_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    doc_offsets: List[int] = []
+    with open(corpus_path, encoding="utf-8") as corpus, open(os.path.join(tmp_dir, "docs.jsonl"), "wb") as docs_file:
+        for line in corpus:
+            if not line.strip():
+                continue
+            doc = json.loads(line)
+            doc_id = len(doc_lengths)
+            for name in [doc["title"], *doc.get("aliases", [])]:
+                aliases.setdefault(_phrase(name), doc_id)
+
+            # Il titolo conta due volte: le domande citano quasi sempre il nome del luogo
+            names = " ".join([doc["title"], doc["title"], *doc.get("aliases", []), doc.get("place", "")])
+            tokens = tokenize(f"{names} {doc['text']}")
+            doc_lengths.append(len(tokens))
+            for token in tokens:
+                term_id = vocabulary.setdefault(token, len(vocabulary))
+                if term_id == len(postings):
+                    postings.append({})
+                postings[term_id][doc_id] = postings[term_id].get(doc_id, 0) + 1
+
+            doc_offsets.append(docs_file.tell())
+            docs_file.write((json.dumps(doc, ensure_ascii=False) + "\n").encode("utf-8"))
+
+    n_docs = len(doc_lengths)
+    offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(term_docs) for term_docs in postings])
+    docs = np.empty(int(offsets[-1]), dtype=np.int32)
+    tfs = np.empty(int(offsets[-1]), dtype=np.uint16)
+    for term_id, term_docs in enumerate(postings):
+        start = offsets[term_id]
+        for position, doc_id in enumerate(sorted(term_docs)):
+            docs[start + position] = doc_id
+            tfs[start + position] = min(term_docs[doc_id], 65535)
+    df = np.diff(offsets).astype(np.float64)
+    idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+    np.save(os.path.join(tmp_dir, "postings_offsets.npy"), offsets)
+    np.save(os.path.join(tmp_dir, "postings_docs.npy"), docs)
+    np.save(os.path.join(tmp_dir, "postings_tfs.npy"), tfs)
+    np.save(os.path.join(tmp_dir, "idf.npy"), idf)
+    np.save(os.path.join(tmp_dir, "doc_lengths.npy"), np.asarray(doc_lengths, dtype=np.int32))
+    np.save(os.path.join(tmp_dir, "doc_offsets.npy"), np.asarray(doc_offsets, dtype=np.int64))
+
+    stat = os.stat(corpus_path)
+    manifest = {
+        "corpus": os.path.abspath(corpus_path),
+        "corpus_size": stat.st_size,
+        "corpus_mtime_ns": stat.st_mtime_ns,
+        "documents": n_docs,
+        "terms": len(vocabulary),
+        "postings": int(offsets[-1]),
+        "avg_doc_length": (sum(doc_lengths) / n_docs) if n_docs else 0.0,
+        "vocabulary": sorted(vocabulary, key=vocabulary.get),
+        "aliases": aliases,
+    }
+    with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+    shutil.rmtree(index_dir, ignore_errors=True)
+    os.makedirs(os.path.dirname(os.path.abspath(index_dir)), exist_ok=True)
+    os.replace(tmp_dir, index_dir)
+    print(
+        f"📚 Knowledge base compilata: {n_docs} testi, {len(vocabulary)} termini "
+        f"in {time.perf_counter() - started:.2f}s"
+    )
+    return manifest
+
+
+def _is_stale(corpus_path: str, index_dir: str) -> bool:
+    try:
+        with open(os.path.join(index_dir, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return True
+    stat = os.stat(corpus_path)
+    return (
+        manifest.get("corpus") != os.path.abspath(corpus_path)
+        or manifest.get("corpus_size") != stat.st_size
+        or manifest.get("corpus_mtime_ns") != stat.st_mtime_ns
+    )
+
+
+class KnowledgeBase:
+    """
+    Knowledge base offline per chain_historical_expert.
+
+    L'indice invertito è salvato come array NumPy (offset, documenti e
+    frequenze dei postings, idf, lunghezze) caricati in memory-map. Una
+    domanda che cita un luogo del corpus e ne copre i termini specifici
+    riceve direttamente il testo; un punteggio BM25 sufficiente fornisce
+    solo il contesto per una risposta più breve del modello.
+    """
+
+    def __init__(self, index_dir: str = KNOWLEDGE_INDEX_DIR):
+        started = time.perf_counter()
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+        self._vocabulary = {term: term_id for term_id, term in enumerate(manifest.pop("vocabulary"))}
+        self._aliases: Dict[str, int] = manifest.pop("aliases")
+        self.manifest = manifest
+
+        def load(name: str) -> np.ndarray:
+            return np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+
+        self._offsets = load("postings_offsets")
+        self._docs = load("postings_docs")
+        self._tfs = load("postings_tfs")
+        self._idf = load("idf")
+        self._doc_lengths = np.asarray(load("doc_lengths"), dtype=np.float32)
+        self._doc_offsets = load("doc_offsets")
+        self._avg_doc_length = float(manifest["avg_doc_length"]) or 1.0
+        self._lock = threading.Lock()
+        self._counts = {"lookups": 0, "direct": 0, "grounded": 0, "miss": 0}
+        self.load_seconds = round(time.perf_counter() - started, 4)
+
+    def __len__(self) -> int:
+        return int(self.manifest["documents"])
+
+    def document(self, doc_id: int) -> Dict[str, Any]:
+        with open(os.path.join(self.index_dir, "docs.jsonl"), "rb") as docs_file:
+            docs_file.seek(int(self._doc_offsets[doc_id]))
+            return json.loads(docs_file.readline())
+
+    def _postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = int(self._offsets[term_id]), int(self._offsets[term_id + 1])
+        return self._docs[start:end], self._tfs[start:end]
+
+    def scores(self, terms: List[str]) -> np.ndarray:
+        """Punteggi BM25 di tutti i testi per i termini della domanda"""
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term in set(terms):
+            term_id = self._vocabulary.get(term)
+            if term_id is None:
+                continue
+            docs, tfs = self._postings(term_id)
+            tfs = tfs.astype(np.float32)
+            norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self._doc_lengths[docs] / self._avg_doc_length)
+            scores[docs] += self._idf[term_id] * tfs * (BM25_K1 + 1.0) / (tfs + norm)
+        return scores
+
+    def _coverage(self, terms: List[str], doc_id: int) -> float:
+        specific = {term for term in terms if term not in _GENERIC_TERMS}
+        if not specific:
+            return 1.0
+        found = 0
+        for term in specific:
+            term_id = self._vocabulary.get(term)
+            if term_id is None:
+                continue
+            docs, _ = self._postings(term_id)
+            position = int(np.searchsorted(docs, doc_id))
+            if position < len(docs) and int(docs[position]) == doc_id:
+                found += 1
+        return found / len(specific)
+
+    def _subject(self, terms: List[str], scores: np.ndarray) -> Optional[int]:
+        """
+        Luogo di cui parla la domanda: il testo il cui titolo (o alias) vi compare.
+        Se sono citati un monumento e la sua città ("Colosseo Roma") vince il monumento;
+        con più soggetti indipendenti non c'è un unico testo da restituire.
+        """
+        query = f" {' '.join(terms)} "
+        mentioned = {doc_id for alias, doc_id in self._aliases.items() if alias and f" {alias} " in query}
+        if len(mentioned) > 1:
+            places = {doc_id: _phrase(self.document(doc_id).get("place", "")) for doc_id in mentioned}
+            names = {
+                doc_id: [alias for alias, alias_doc in self._aliases.items() if alias_doc == doc_id]
+                for doc_id in mentioned
+            }
+            mentioned = {
+                doc_id for doc_id in mentioned
+                if not any(
+                    f" {name} " in f" {places[other]} "
+                    for other in mentioned if other != doc_id
+                    for name in names[doc_id]
+                )
+            }
+        if len(mentioned) != 1:
+            return None
+        subject = mentioned.pop()
+        return subject if scores[subject] > 0 else None
+
+    def lookup(self, query: str, k: int = 2) -> KnowledgeMatch:
+        """Classifica la domanda come risposta diretta, contesto per il modello o mancata"""
+        terms = tokenize(query)
+        scores = self.scores(terms)
+        ranked = [int(doc_id) for doc_id in np.argsort(-scores)[:k] if scores[doc_id] > 0]
+
+        match = KnowledgeMatch(outcome="miss")
+        # Prima il luogo citato per titolo o alias: "Colosseo" da solo ha un punteggio BM25
+        # basso ma una corrispondenza esatta, e la soglia vale solo senza soggetto
+        subject = self._subject(terms, scores)
+        if ranked and (subject is not None or scores[ranked[0]] >= KNOWLEDGE_MIN_SCORE):
+            top = subject if subject is not None else ranked[0]
+            match.score = round(float(scores[top]), 3)
+            match.coverage = round(self._coverage(terms, top), 3)
+            kept = [top] + [
+                doc_id for doc_id in ranked if doc_id != top and scores[doc_id] >= scores[top] * 0.5
+            ]
+            match.documents = [self.document(doc_id) for doc_id in kept[:k]]
+            direct = subject is not None and match.coverage >= KNOWLEDGE_MIN_COVERAGE
+            match.outcome = "direct" if direct and KNOWLEDGE_DIRECT_ANSWERS else "grounded"
+
+        with self._lock:
+            self._counts["lookups"] += 1
+            self._counts[match.outcome] += 1
+        return match
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+        lookups = counts["lookups"]
+        return {
+            "documents": len(self),
+            "terms": self.manifest["terms"],
+            "load_seconds": self.load_seconds,
+            **counts,
+            "hit_rate": round(counts["direct"] / lookups, 3) if lookups else None,
+            "llm_calls_avoided": counts["direct"],
+        }
+
+
+_knowledge_base: Optional[KnowledgeBase] = None
+_knowledge_base_lock = threading.Lock()
+
+
+def get_knowledge_base() -> Optional[KnowledgeBase]:
+    """Restituisce la knowledge base condivisa (compilandola se il corpus è cambiato)"""
+    global _knowledge_base
+    if not KNOWLEDGE_BASE_ENABLED:
+        return None
+    with _knowledge_base_lock:
+        if _knowledge_base is None:
+            try:
+                if _is_stale(KNOWLEDGE_CORPUS, KNOWLEDGE_INDEX_DIR):
+                    build_index(KNOWLEDGE_CORPUS, KNOWLEDGE_INDEX_DIR)
+                _knowledge_base = KnowledgeBase(KNOWLEDGE_INDEX_DIR)
+                print(
+                    f"📚 Knowledge base caricata: {len(_knowledge_base)} testi "
+                    f"in {_knowledge_base.load_seconds}s"
+                )
+            except Exception as e:
+                print(f"⚠️ Knowledge base non disponibile: {e}")
+                return None
+        return _knowledge_base
+
+
+if __name__ == "__main__":
+    # python -m travel_agent_api.services.knowledge_base [corpus.jsonl] [cartella indice]
+    build_index(*sys.argv[1:3])
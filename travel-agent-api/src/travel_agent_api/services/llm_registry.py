@@ -0,0 +1,161 @@
+"""
+LLM Registry - Client chat condivisi dal processo con connessioni HTTP in pool
+"""
+
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+from .cassettes import AsyncCassetteTransport, CassetteTransport
+from .llm_scheduler import AsyncScheduledTransport, ScheduledTransport
+from .resilience import AsyncResilientTransport, ResilientTransport
+
+# Configurazione comune a tutti i client OpenAI
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "60"))
+# Un solo retry: gli errori ripetuti li gestisce il circuit breaker (services/resilience.py)
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "10"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+
+
+class LLMClientRegistry:
+    """
+    Registro dei modelli chat condiviso da agente e chain tool.
+
+    Tutti i ChatOpenAI usano gli stessi client httpx (sync e async), quindi
+    condividono connessioni keep-alive, timeout e retry. I modelli sono
+    memorizzati per chiave (modello + parametri) e creati una sola volta.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: Dict[Tuple, ChatOpenAI] = {}
+        self._http_client: Optional[httpx.Client] = None
+        self._http_async_client: Optional[httpx.AsyncClient] = None
+        self._hits = 0
+        self._misses = 0
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        )
+
+    def _ensure_http_clients(self):
+        if self._http_client is None:
+            timeout = httpx.Timeout(LLM_REQUEST_TIMEOUT, connect=10.0)
+            # Ogni chiamata OpenAI attende i limiti RPM/TPM nello scheduler, poi passa
+            # dal trasporto resiliente (circuit breaker e hedging); le cassette registrano
+            # o servono le risposte solo quando una conversazione è in registrazione/replay
+            self._http_client = httpx.Client(
+                transport=ScheduledTransport(
+                    ResilientTransport(
+                        CassetteTransport(httpx.HTTPTransport(limits=self._limits())), upstream="openai"
+                    )
+                ),
+                timeout=timeout,
+            )
+            self._http_async_client = httpx.AsyncClient(
+                transport=AsyncScheduledTransport(
+                    AsyncResilientTransport(
+                        AsyncCassetteTransport(httpx.AsyncHTTPTransport(limits=self._limits())), upstream="openai"
+                    )
+                ),
+                timeout=timeout,
+            )
+
+    def get_chat_model(
+        self,
+        model: str = "gpt-4o-mini",
+        temperature: float = 0.7,
+        **params: Any,
+    ) -> ChatOpenAI:
+        """Restituisce il ChatOpenAI condiviso per modello e parametri"""
+        key = (model, temperature, tuple(sorted((name, _freeze(value)) for name, value in params.items())))
+        with self._lock:
+            chat_model = self._models.get(key)
+            if chat_model is not None:
+                self._hits += 1
+                return chat_model
+
+            self._misses += 1
+            self._ensure_http_clients()
+            chat_model = ChatOpenAI(
+                model_name=model,
+                temperature=temperature,
+                openai_api_key=os.getenv("OPENAI_API_KEY"),
+                request_timeout=LLM_REQUEST_TIMEOUT,
+                max_retries=LLM_MAX_RETRIES,
+                http_client=self._http_client,
+                http_async_client=self._http_async_client,
+                **params,
+            )
+            self._models[key] = chat_model
+            print(f"🔌 Nuovo client LLM condiviso: {model} (temperature={temperature})")
+            return chat_model
+
+    def stats(self) -> Dict[str, Any]:
+        """Statistiche del registro e del pool di connessioni HTTP"""
+        with self._lock:
+            stats = {
+                "models": len(self._models),
+                "hits": self._hits,
+                "misses": self._misses,
+                "request_timeout": LLM_REQUEST_TIMEOUT,
+                "max_retries": LLM_MAX_RETRIES,
+                "max_connections": LLM_MAX_CONNECTIONS,
+                "max_keepalive_connections": LLM_MAX_KEEPALIVE,
+                "sync_pool": _pool_stats(self._http_client),
+                "async_pool": _pool_stats(self._http_async_client),
+            }
+        return stats
+
+    async def aclose(self):
+        """Chiude i client HTTP condivisi (allo shutdown del servizio)"""
+        with self._lock:
+            http_client, http_async_client = self._http_client, self._http_async_client
+            self._http_client = None
+            self._http_async_client = None
+            self._models.clear()
+        if http_client is not None:
+            http_client.close()
+        if http_async_client is not None:
+            await http_async_client.aclose()
+
+
+def _freeze(value: Any) -> Any:
+    """Rende hashabili i parametri (es. la lista dei callback) per la chiave del registro"""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    return value
+
+
+def _pool_stats(client) -> Dict[str, int]:
+    """Conta le connessioni del pool httpcore sottostante"""
+    transport = getattr(client, "_transport", None)
+    # Scheduler e trasporto resiliente avvolgono quello httpx che possiede il pool
+    while hasattr(transport, "inner"):
+        transport = transport.inner
+    pool = getattr(transport, "_pool", None)
+    connections = list(getattr(pool, "connections", []) or [])
+    idle = sum(1 for conn in connections if conn.is_idle())
+    return {
+        "connections": len(connections),
+        "idle": idle,
+        "active": len(connections) - idle,
+    }
+
+
+llm_registry = LLMClientRegistry()
+
+
+def get_chat_model(model: str = "gpt-4o-mini", temperature: float = 0.7, **params: Any) -> ChatOpenAI:
+    """Scorciatoia per llm_registry.get_chat_model"""
+    return llm_registry.get_chat_model(model=model, temperature=temperature, **params)
@@ -0,0 +1,390 @@
+"""
+LLM Scheduler - Limiti RPM/TPM di OpenAI con coda a priorità davanti a ogni chiamata
+"""
+
+import asyncio
+import itertools
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import httpx
+
+LLM_SCHEDULER_ENABLED = os.getenv("LLM_SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+# Limiti iniziali dell'account; vengono aggiornati dagli header x-ratelimit-* delle risposte
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", "500"))
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", "200000"))
+# Token di completamento stimati quando la richiesta non fissa max_tokens
+LLM_DEFAULT_COMPLETION_TOKENS = int(os.getenv("LLM_DEFAULT_COMPLETION_TOKENS", "1024"))
+# Attesa massima in coda prima di rinunciare alla chiamata (secondi)
+LLM_SCHEDULER_MAX_WAIT = float(os.getenv("LLM_SCHEDULER_MAX_WAIT", "60"))
+# Dopo questa attesa una chiamata in background passa davanti al traffico interattivo
+LLM_SCHEDULER_AGING = float(os.getenv("LLM_SCHEDULER_AGING", "15"))
+LLM_INTERACTIVE_CALL_SITES = {
+    site.strip() for site in os.getenv("LLM_INTERACTIVE_CALL_SITES", "agent").split(",") if site.strip()
+}
+
+# Header interno con il punto di chiamata: impostato dal model router, rimosso prima dell'invio
+CALL_SITE_HEADER = "x-freya-call-site"
+
+_CHARS_PER_TOKEN = 4
+_DURATION_PART = re.compile(r"([\d.]+)(ms|h|m|s)")
+
+
+class RateLimitWaitTimeout(Exception):
+    """La chiamata è rimasta in coda oltre LLM_SCHEDULER_MAX_WAIT"""
+
+
+def estimate_tokens(body: bytes) -> int:
+    """
+    Stima i token che OpenAI conteggia per la richiesta: caratteri del prompt
+    (messaggi e definizioni dei tool) / 4 più i token di completamento
+    richiesti, come fa il provider per il limite TPM.
+    """
+    try:
+        payload = json.loads(body or b"{}")
+    except ValueError:
+        return LLM_DEFAULT_COMPLETION_TOKENS
+    prompt_chars = 0
+    for message in payload.get("messages") or []:
+        prompt_chars += len(json.dumps(message.get("content") or "", ensure_ascii=False))
+        prompt_chars += len(json.dumps(message.get("tool_calls") or "", ensure_ascii=False))
+        prompt_chars += 4 * _CHARS_PER_TOKEN  # overhead per messaggio
+    if payload.get("tools"):
+        prompt_chars += len(json.dumps(payload["tools"], ensure_ascii=False))
+    if isinstance(payload.get("input"), (str, list)):  # embeddings
+        prompt_chars += len(json.dumps(payload["input"], ensure_ascii=False))
+    completion = payload.get("max_completion_tokens") or payload.get("max_tokens")
+    if completion is None:
+        completion = 0 if "input" in payload else LLM_DEFAULT_COMPLETION_TOKENS
+    return math.ceil(prompt_chars / _CHARS_PER_TOKEN) + int(completion) * int(payload.get("n") or 1)
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Converte le durate degli header OpenAI ("1s", "6m0s", "20ms") in secondi"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+    return sum(float(amount) * scale[unit] for amount, unit in parts)
+
+
+class TokenBucket:
+    """Bucket che si riempie in modo continuo fino a `limit` unità al minuto"""
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.level = float(self.limit)
+        self._updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.limit, self.level + (now - self._updated) * self.limit / 60.0)
+        self._updated = now
+
+    def seconds_until(self, amount: float) -> float:
+        # Una richiesta più grande del bucket intero aspetta solo che si riempia
+        missing = min(amount, self.limit) - self.level
+        return 0.0 if missing <= 0 else missing * 60.0 / self.limit
+
+
+class _Waiter:
+    """Chiamata in coda; può essere svegliata sia da un thread che da un event loop"""
+
+    def __init__(self, priority: str, cost: int, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.priority = priority
+        self.cost = cost
+        self.enqueued = time.monotonic()
+        self._loop = loop
+        self.event = threading.Event()
+        self.future: Optional[asyncio.Future] = None
+
+    def arm(self):
+        if self._loop is not None:
+            self.future = self._loop.create_future()
+        else:
+            self.event.clear()
+
+    def notify(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._resolve)
+        else:
+            self.event.set()
+
+    def _resolve(self):
+        if self.future is not None and not self.future.done():
+            self.future.set_result(True)
+
+
+class LLMScheduler:
+    """
+    Scheduler di processo per le chiamate OpenAI.
+
+    Ogni richiesta consuma una unità dal bucket RPM e i token stimati dal
+    bucket TPM. Se i bucket non bastano attende in coda: le chiamate
+    interattive (l'agente) passano prima di quelle in background (chain tool),
+    che dopo LLM_SCHEDULER_AGING secondi di attesa recuperano la precedenza.
+    Gli header x-ratelimit-* delle risposte riallineano limiti e bucket; un
+    429 sospende l'invio fino al reset indicato dal provider.
+    """
+
+    def __init__(self, rpm: int = OPENAI_RPM_LIMIT, tpm: int = OPENAI_TPM_LIMIT):
+        self._lock = threading.Lock()
+        self._requests = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self._queue: List[Any] = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self._waits: Dict[str, Deque[float]] = {
+            "interactive": deque(maxlen=500),
+            "background": deque(maxlen=500),
+        }
+        self._calls: Dict[str, int] = defaultdict(int)
+        self._estimated_tokens = 0
+        self._throttled = 0
+        self._timeouts = 0
+
+    @staticmethod
+    def priority_for(call_site: Optional[str]) -> str:
+        return "interactive" if call_site is None or call_site in LLM_INTERACTIVE_CALL_SITES else "background"
+
+    # ---------------------------------------------------------------- coda (con lock)
+
+    def _head(self, now: float) -> Optional[_Waiter]:
+        def rank(entry):
+            sequence, waiter = entry
+            urgent = waiter.priority == "interactive" or now - waiter.enqueued >= LLM_SCHEDULER_AGING
+            return (0 if urgent else 1, sequence)
+
+        return min(self._queue, key=rank)[1] if self._queue else None
+
+    def _try_take(self, waiter: _Waiter, now: float) -> float:
+        """0 se la chiamata può partire (e consuma i bucket), altrimenti i secondi da attendere"""
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._requests.refill(now)
+        self._tokens.refill(now)
+        delay = max(self._requests.seconds_until(1), self._tokens.seconds_until(waiter.cost))
+        if delay > 0:
+            return delay
+        self._requests.level -= 1
+        self._tokens.level -= waiter.cost
+        return 0.0
+
+    def _remove(self, waiter: _Waiter, now: float):
+        self._queue = [entry for entry in self._queue if entry[1] is not waiter]
+        head = self._head(now)
+        if head is not None:
+            head.notify()
+
+    def _step(self, waiter: _Waiter) -> Optional[float]:
+        """Un passo di attesa: None se la chiamata è partita, altrimenti i secondi da dormire"""
+        with self._lock:
+            now = time.monotonic()
+            if self._head(now) is waiter:
+                delay = self._try_take(waiter, now)
+                if delay == 0:
+                    self._remove(waiter, now)
+                    self._waits[waiter.priority].append(now - waiter.enqueued)
+                    return None
+            else:
+                delay = LLM_SCHEDULER_MAX_WAIT
+                if waiter.priority == "background":
+                    # Nessuno la sveglia quando l'aging la porta in testa: si sveglia da sola
+                    aged_in = waiter.enqueued + LLM_SCHEDULER_AGING - now
+                    if aged_in > 0:
+                        delay = aged_in
+            remaining = waiter.enqueued + LLM_SCHEDULER_MAX_WAIT - now
+            if remaining <= 0:
+                self._remove(waiter, now)
+                self._timeouts += 1
+                raise RateLimitWaitTimeout(
+                    f"Chiamata LLM in coda da oltre {LLM_SCHEDULER_MAX_WAIT:.0f}s per i limiti di frequenza OpenAI"
+                )
+            waiter.arm()
+            return min(delay, remaining)
+
+    def _enqueue(self, call_site: Optional[str], cost: int, loop=None) -> _Waiter:
+        waiter = _Waiter(self.priority_for(call_site), cost, loop)
+        with self._lock:
+            self._queue.append((next(self._sequence), waiter))
+            self._calls[call_site or "unknown"] += 1
+            self._estimated_tokens += cost
+        return waiter
+
+    def acquire(self, call_site: Optional[str], cost: int):
+        """Blocca il thread finché la chiamata rientra nei limiti"""
+        waiter = self._enqueue(call_site, cost)
+        while (delay := self._step(waiter)) is not None:
+            waiter.event.wait(delay)
+
+    async def acquire_async(self, call_site: Optional[str], cost: int):
+        """Come acquire(), senza bloccare l'event loop"""
+        waiter = self._enqueue(call_site, cost, asyncio.get_running_loop())
+        try:
+            while (delay := self._step(waiter)) is not None:
+                await asyncio.wait({waiter.future}, timeout=delay)
+        except asyncio.CancelledError:
+            with self._lock:
+                self._remove(waiter, time.monotonic())
+            raise
+
+    # ---------------------------------------------------------------- header del provider
+
+    def observe(self, response: httpx.Response):
+        """Riallinea limiti e bucket agli header x-ratelimit-* della risposta"""
+        headers = response.headers
+        with self._lock:
+            now = time.monotonic()
+            for bucket, kind in ((self._requests, "requests"), (self._tokens, "tokens")):
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                if limit and limit.isdigit() and int(limit) != bucket.limit:
+                    print(f"📏 Limite OpenAI {kind}/min aggiornato: {bucket.limit} → {limit}")
+                    bucket.limit = max(1, int(limit))
+                if remaining and remaining.isdigit():
+                    bucket.refill(now)
+                    # Il conteggio del provider include anche altri processi con la stessa chiave
+                    bucket.level = min(bucket.level, float(remaining))
+            if response.status_code == 429:
+                self._throttled += 1
+                pause = (
+                    parse_duration(headers.get("retry-after"))
+                    or max(
+                        parse_duration(headers.get("x-ratelimit-reset-requests")) or 0.0,
+                        parse_duration(headers.get("x-ratelimit-reset-tokens")) or 0.0,
+                    )
+                    or 1.0
+                )
+                self._paused_until = max(self._paused_until, now + pause)
+                print(f"⏸️ 429 da OpenAI: chiamate sospese per {pause:.1f}s")
+
+    def stats(self) -> Dict[str, Any]:
+        """Stato dei bucket, coda per priorità e attese"""
+        with self._lock:
+            now = time.monotonic()
+            self._requests.refill(now)
+            self._tokens.refill(now)
+            queued = defaultdict(int)
+            for _, waiter in self._queue:
+                queued[waiter.priority] += 1
+            waits = {}
+            for priority, samples in self._waits.items():
+                ordered = sorted(samples)
+                waits[priority] = {
+                    "p50": round(ordered[len(ordered) // 2], 3) if ordered else None,
+                    "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3) if ordered else None,
+                }
+            return {
+                "enabled": LLM_SCHEDULER_ENABLED,
+                "rpm_limit": self._requests.limit,
+                "tpm_limit": self._tokens.limit,
+                "requests_available": int(self._requests.level),
+                "tokens_available": int(self._tokens.level),
+                "queued": dict(queued),
+                "waits": waits,
+                "calls_per_site": dict(self._calls),
+                "estimated_tokens": self._estimated_tokens,
+                "throttled_429": self._throttled,
+                "wait_timeouts": self._timeouts,
+                "paused_for": round(max(0.0, self._paused_until - now), 1),
+            }
+
+
+llm_scheduler = LLMScheduler()
+
+
+# Osservatori della latenza del provider: (modello, secondi, errore) per ogni chiamata,
+# misurata da quando lo scheduler concede lo slot (l'attesa in coda non conta)
+_latency_observers: List[Callable[[str, float, bool], None]] = []
+
+
+def observe_latency(callback: Callable[[str, float, bool], None]):
+    """Registra una funzione chiamata con la latenza di ogni richiesta inviata a OpenAI"""
+    _latency_observers.append(callback)
+
+
+def _report_latency(body: bytes, started: float, error: bool):
+    if not _latency_observers:
+        return
+    try:
+        model = json.loads(body or b"{}").get("model")
+    except ValueError:
+        model = None
+    if not model:
+        return
+    latency = time.perf_counter() - started
+    for callback in _latency_observers:
+        callback(model, latency, error)
+
+
+def _prepare(request: httpx.Request) -> Optional[str]:
+    """Rimuove l'header interno del punto di chiamata e lo restituisce"""
+    call_site = request.headers.get(CALL_SITE_HEADER)
+    if call_site is not None:
+        del request.headers[CALL_SITE_HEADER]
+        # Resta disponibile ai trasporti interni (es. registrazione delle cassette)
+        request.extensions["freya_call_site"] = call_site
+    return call_site
+
+
+class ScheduledTransport(httpx.BaseTransport):
+    """Trasporto httpx che fa attendere ogni richiesta OpenAI nello scheduler"""
+
+    def __init__(self, inner: httpx.BaseTransport, scheduler: LLMScheduler = llm_scheduler):
+        self.inner = inner
+        self.scheduler = scheduler
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        call_site = _prepare(request)
+        body = request.read()
+        if LLM_SCHEDULER_ENABLED:
+            self.scheduler.acquire(call_site, estimate_tokens(body))
+        started = time.perf_counter()
+        try:
+            response = self.inner.handle_request(request)
+        except Exception:
+            _report_latency(body, started, error=True)
+            raise
+        _report_latency(body, started, error=response.status_code >= 400)
+        self.scheduler.observe(response)
+        return response
+
+    def close(self):
+        self.inner.close()
+
+
+class AsyncScheduledTransport(httpx.AsyncBaseTransport):
+    """Come ScheduledTransport, per il client httpx asincrono"""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, scheduler: LLMScheduler = llm_scheduler):
+        self.inner = inner
+        self.scheduler = scheduler
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        call_site = _prepare(request)
+        body = await request.aread()
+        if LLM_SCHEDULER_ENABLED:
+            await self.scheduler.acquire_async(call_site, estimate_tokens(body))
+        started = time.perf_counter()
+        try:
+            response = await self.inner.handle_async_request(request)
+        except Exception:
+            _report_latency(body, started, error=True)
+            raise
+        _report_latency(body, started, error=response.status_code >= 400)
+        self.scheduler.observe(response)
+        return response
+
+    async def aclose(self):
+        await self.inner.aclose()
@@ -0,0 +1,163 @@
+"""
+Model Router - Sceglie il modello per ogni chiamata LLM in base alla latenza osservata
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from langchain_openai import ChatOpenAI
+from pydantic import BaseModel, Field
+
+from .llm_registry import get_chat_model
+from .llm_scheduler import CALL_SITE_HEADER, observe_latency
+
+# Campioni di latenza conservati per modello e minimo per fidarsi del p95
+ROUTER_WINDOW = int(os.getenv("LLM_ROUTER_WINDOW", "100"))
+ROUTER_MIN_SAMPLES = int(os.getenv("LLM_ROUTER_MIN_SAMPLES", "5"))
+# Età massima dei campioni: un modello escluso torna a essere provato dopo questo tempo
+ROUTER_SAMPLE_TTL = float(os.getenv("LLM_ROUTER_SAMPLE_TTL", "300"))
+
+
+class ModelCandidate(BaseModel):
+    name: str = Field(description="Nome del modello OpenAI, es. gpt-4o-mini.")
+    base_url: Optional[str] = Field(None, description="Endpoint compatibile OpenAI alternativo.")
+    max_output_tokens: Optional[int] = Field(None, description="Massimo di token in uscita supportati.")
+
+
+class ModelRequirements(BaseModel):
+    latency_target: float = Field(description="Latenza p95 accettabile in secondi.")
+    max_output_tokens: Optional[int] = Field(None, description="Token massimi della risposta.")
+    deterministic: bool = Field(False, description="Se True la risposta deve essere riproducibile.")
+
+
+def _load_candidates() -> List[ModelCandidate]:
+    """Legge i modelli configurati da LLM_ROUTER_MODELS (lista JSON o nomi separati da virgola)"""
+    raw = os.getenv("LLM_ROUTER_MODELS", "gpt-4o-mini,gpt-4.1-nano").strip()
+    if raw.startswith("["):
+        return [ModelCandidate(**item) for item in json.loads(raw)]
+    return [ModelCandidate(name=name.strip()) for name in raw.split(",") if name.strip()]
+
+
+class ModelRouter:
+    """
+    Router dei modelli LLM basato sulla latenza osservata.
+
+    Ogni punto di chiamata dichiara i propri requisiti (ModelRequirements).
+    Il router sceglie il primo modello configurato il cui p95 rientra nel
+    budget; se nessuno rientra ripiega sul modello con p95 più basso.
+    I campioni scadono dopo ROUTER_SAMPLE_TTL secondi, così un modello
+    escluso viene riprovato quando la sua finestra si svuota.
+
+    Le latenze arrivano dal trasporto dello scheduler e partono da quando
+    la chiamata ottiene lo slot: l'attesa per i limiti RPM/TPM non rende
+    lento un modello.
+    """
+
+    def __init__(self, candidates: Optional[List[ModelCandidate]] = None):
+        self.candidates = candidates or _load_candidates()
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, Deque[Tuple[float, float]]] = defaultdict(
+            lambda: deque(maxlen=ROUTER_WINDOW)
+        )
+        self._errors: Dict[str, int] = defaultdict(int)
+        self._decisions: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._fallbacks: Dict[str, int] = defaultdict(int)
+
+    def record(self, model: str, latency: float, error: bool = False):
+        """Registra la latenza di una chiamata completata"""
+        with self._lock:
+            self._latencies[model].append((time.monotonic(), latency))
+            if error:
+                self._errors[model] += 1
+
+    def _samples(self, model: str) -> List[float]:
+        """Latenze ordinate della finestra mobile, senza i campioni scaduti"""
+        cutoff = time.monotonic() - ROUTER_SAMPLE_TTL
+        with self._lock:
+            window = self._latencies[model]
+            while window and window[0][0] < cutoff:
+                window.popleft()
+            return sorted(latency for _, latency in window)
+
+    def p95(self, model: str) -> Optional[float]:
+        """p95 della finestra mobile, None se i campioni sono insufficienti"""
+        samples = self._samples(model)
+        if len(samples) < ROUTER_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    def select(self, call_site: str, requirements: ModelRequirements) -> ModelCandidate:
+        """Sceglie il modello per un punto di chiamata"""
+        eligible = [
+            candidate for candidate in self.candidates
+            if not requirements.max_output_tokens
+            or not candidate.max_output_tokens
+            or candidate.max_output_tokens >= requirements.max_output_tokens
+        ] or self.candidates
+
+        # Calcolati una volta: i campioni possono scadere durante la scelta
+        p95s = {candidate.name: self.p95(candidate.name) for candidate in eligible}
+        chosen = None
+        for candidate in eligible:
+            p95 = p95s[candidate.name]
+            if p95 is None or p95 <= requirements.latency_target:
+                chosen = candidate
+                break
+
+        if chosen is None:
+            # Tutti oltre il budget: usa il modello con il p95 più basso
+            chosen = min(eligible, key=lambda candidate: p95s[candidate.name])
+
+        with self._lock:
+            self._decisions[call_site][chosen.name] += 1
+            if chosen is not eligible[0]:
+                self._fallbacks[call_site] += 1
+                print(f"🔀 {call_site}: {eligible[0].name} oltre il budget, uso {chosen.name}")
+        return chosen
+
+    def chat_model(self, call_site: str, requirements: ModelRequirements) -> ChatOpenAI:
+        """Restituisce il client condiviso del modello scelto per il punto di chiamata"""
+        candidate = self.select(call_site, requirements)
+        params: Dict[str, Any] = {
+            # Letto (e rimosso) dallo scheduler per la priorità della chiamata
+            "default_headers": {CALL_SITE_HEADER: call_site},
+        }
+        if requirements.max_output_tokens:
+            params["max_tokens"] = requirements.max_output_tokens
+        if candidate.base_url:
+            params["base_url"] = candidate.base_url
+        if requirements.deterministic:
+            params["seed"] = 0
+        temperature = 0.0 if requirements.deterministic else 0.7
+        return get_chat_model(candidate.name, temperature=temperature, **params)
+
+    def stats(self) -> Dict[str, Any]:
+        """Metriche di routing: latenze per modello e decisioni per punto di chiamata"""
+        models = {}
+        for candidate in self.candidates:
+            samples = self._samples(candidate.name)
+            with self._lock:
+                errors = self._errors[candidate.name]
+            models[candidate.name] = {
+                "samples": len(samples),
+                "errors": errors,
+                "p50": samples[len(samples) // 2] if samples else None,
+                "p95": self.p95(candidate.name),
+            }
+        with self._lock:
+            decisions = {site: dict(counts) for site, counts in self._decisions.items()}
+            fallbacks = dict(self._fallbacks)
+        return {"models": models, "decisions": decisions, "fallbacks": fallbacks}
+
+
+model_router = ModelRouter()
+observe_latency(model_router.record)
+
+
+def route_chat_model(call_site: str, requirements: ModelRequirements) -> ChatOpenAI:
+    """Scorciatoia per model_router.chat_model"""
+    return model_router.chat_model(call_site, requirements)
@@ -0,0 +1,129 @@
+"""
+Parallel Executor - Esegue in parallelo le tool call emesse nello stesso turno
+"""
+
+import contextvars
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from langchain.agents import AgentExecutor
+from langchain_core.agents import AgentAction, AgentFinish, AgentStep
+from langchain_core.callbacks import CallbackManagerForChainRun
+from langchain_core.tools import BaseTool
+from pydantic import PrivateAttr
+
+from .request_profiler import profiled_call
+from .response_blocks import collected_blocks, emit_blocks, parse_blocks
+
+# Numero massimo di tool eseguiti contemporaneamente in un singolo step
+TOOL_CALL_CONCURRENCY = int(os.getenv("TOOL_CALL_CONCURRENCY", "4"))
+
+
+class ParallelAgentExecutor(AgentExecutor):
+    """
+    AgentExecutor che esegue in parallelo le tool call di uno stesso step.
+
+    Con l'API tools-calling il modello può chiedere più tool in un solo turno
+    (es. images_finder per quattro attrazioni). L'executor di base li esegue
+    uno dopo l'altro: qui vengono sottomessi a un pool limitato a
+    `max_parallel_tools` thread e i risultati restituiti nell'ordine originale.
+
+    Se `run_checkpoint` è impostato, ogni step completato viene salvato e un
+    nuovo tentativo della stessa richiesta riparte dall'ultimo step salvato.
+    Con la risposta a blocchi vengono salvate anche le schede già emesse.
+    """
+
+    max_parallel_tools: int = TOOL_CALL_CONCURRENCY
+    # RunCheckpoint dell'esecuzione corrente: ripristina e salva gli step completati
+    run_checkpoint: Optional[Any] = None
+
+    _step_state: threading.local = PrivateAttr(default_factory=threading.local)
+
+    def _take_next_step(
+        self,
+        name_to_tool_map: Dict[str, BaseTool],
+        color_mapping: Dict[str, str],
+        inputs: Dict[str, str],
+        intermediate_steps: List[Tuple[AgentAction, str]],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> Union[AgentFinish, List[Tuple[AgentAction, str]]]:
+        checkpoint = self.run_checkpoint
+        if checkpoint is not None and not intermediate_steps:
+            # Primo step: riprendi dagli step completati in un tentativo precedente
+            restored = checkpoint.load_steps()
+            if restored:
+                print(f"♻️ Ripresa dal checkpoint con {len(restored)} step già completati")
+                intermediate_steps.extend(restored)
+                # I tool degli step ripristinati non girano: le loro schede tornano dal checkpoint
+                emit_blocks(*parse_blocks(checkpoint.restored_blocks))
+
+        output = super()._take_next_step(
+            name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager
+        )
+
+        if checkpoint is not None and not isinstance(output, AgentFinish):
+            checkpoint.save_steps(intermediate_steps + output, blocks=collected_blocks())
+        return output
+
+    def _iter_next_step(
+        self,
+        name_to_tool_map: Dict[str, BaseTool],
+        color_mapping: Dict[str, str],
+        inputs: Dict[str, str],
+        intermediate_steps: List[Tuple[AgentAction, str]],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> Iterator[Union[AgentFinish, AgentAction, AgentStep]]:
+        with ThreadPoolExecutor(
+            max_workers=max(1, self.max_parallel_tools),
+            thread_name_prefix="freya-tool",
+        ) as pool:
+            self._step_state.pool = pool
+            try:
+                # Consuma tutto lo step: le azioni vengono sottomesse al pool
+                # man mano che l'executor di base le "esegue"
+                items = list(
+                    super()._iter_next_step(
+                        name_to_tool_map,
+                        color_mapping,
+                        inputs,
+                        intermediate_steps,
+                        run_manager,
+                    )
+                )
+            finally:
+                self._step_state.pool = None
+
+            pending = [item for item in items if isinstance(item, Future)]
+            if len(pending) > 1:
+                print(f"⚡ Eseguendo {len(pending)} tool in parallelo (max {self.max_parallel_tools})")
+
+            for item in items:
+                yield item.result() if isinstance(item, Future) else item
+
+    def _perform_agent_action(
+        self,
+        name_to_tool_map: Dict[str, BaseTool],
+        color_mapping: Dict[str, str],
+        agent_action: AgentAction,
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> Union[AgentStep, "Future[AgentStep]"]:
+        pool = getattr(self._step_state, "pool", None)
+        if pool is None:
+            return super()._perform_agent_action(
+                name_to_tool_map, color_mapping, agent_action, run_manager
+            )
+
+        # Propaga il contesto (config e callback di LangChain) al thread del pool;
+        # se la richiesta è in profilazione anche il thread del tool viene profilato
+        context = contextvars.copy_context()
+        return pool.submit(
+            context.run,
+            profiled_call,
+            super()._perform_agent_action,
+            name_to_tool_map,
+            color_mapping,
+            agent_action,
+            run_manager,
+        )
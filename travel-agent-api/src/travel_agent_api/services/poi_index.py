@@ -0,0 +1,178 @@
+"""
+POI Index - Coordinate delle attrazioni principali delle destinazioni (dataset incluso nel package)
+
+Il dataset (data/pois.csv) viene caricato una volta: i nomi delle attrazioni,
+con i loro alias italiani, inglesi e locali, si risolvono per città con un
+accesso a dizionario, poi cercando un nome noto dentro la descrizione
+("Visita ai Musei Vaticani") e infine con i refusi.
+"""
+
+import csv
+import difflib
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+# Dataset CSV (city, name, lat, lon, aliases): di default quello incluso nel package
+POI_FILE = os.getenv("POI_FILE") or os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "data", "pois.csv"
+)
+
+
+class Poi(BaseModel):
+    city: str = Field(description="Città dell'attrazione (nome italiano).")
+    name: str
+    lat: float
+    lon: float
+    aliases: List[str] = Field(default_factory=list)
+
+    def keys(self) -> List[str]:
+        return [key for key in (name_key(name) for name in (self.name, *self.aliases)) if key]
+
+
+def name_key(text: str) -> str:
+    """Nome normalizzato: "Sacré-Cœur" -> "sacre coeur", "Campo de' Fiori" -> "campo de fiori" """
+    ascii_name = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode("ascii")
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", ascii_name.lower()).split())
+
+
+class PoiIndex:
+    """Attrazioni per città: nome o alias normalizzato -> POI"""
+
+    def __init__(self, path: str = POI_FILE):
+        started = time.perf_counter()
+        with open(path, encoding="utf-8", newline="") as handle:
+            rows = [row for row in csv.DictReader(handle) if row.get("name")]
+
+        self.pois: List[Poi] = [
+            Poi(
+                city=row["city"].strip(),
+                name=row["name"].strip(),
+                lat=float(row["lat"]),
+                lon=float(row["lon"]),
+                aliases=[alias.strip() for alias in (row.get("aliases") or "").split("|") if alias.strip()],
+            )
+            for row in rows
+        ]
+        self._by_city: Dict[str, Dict[str, int]] = {}
+        for position, poi in enumerate(self.pois):
+            names = self._by_city.setdefault(name_key(poi.city), {})
+            for key in poi.keys():
+                # A parità di alias vince la prima riga (es. "Duomo" a Milano)
+                names.setdefault(key, position)
+        # Chiavi più lunghe prima: "basilica di san pietro" prima di "san pietro"
+        self._keys_by_length = {
+            city: sorted(names, key=len, reverse=True) for city, names in self._by_city.items()
+        }
+        self._city_of: Dict[str, Optional[str]] = {}
+
+        self._lock = threading.Lock()
+        self.counts = {"exact": 0, "contained": 0, "fuzzy": 0, "not_found": 0, "unknown_city": 0}
+        self.load_seconds = round(time.perf_counter() - started, 4)
+
+    def __len__(self) -> int:
+        return len(self.pois)
+
+    def _count(self, outcome: str):
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def cities(self) -> List[str]:
+        return list(dict.fromkeys(poi.city for poi in self.pois))
+
+    def city_key(self, destination: str) -> Optional[str]:
+        """Città del dataset per una destinazione ("Roma, Italia", "Rome", "Parigi e dintorni")"""
+        with self._lock:
+            if destination in self._city_of:
+                return self._city_of[destination]
+        key = name_key(destination)
+        city = key if key in self._by_city else None
+        if city is None:
+            padded = f" {key} "
+            city = next((name for name in self._by_city if f" {name} " in padded), None)
+        if city is None:
+            city = self._city_from_airports(destination)
+        with self._lock:
+            self._city_of[destination] = city
+        return city
+
+    def _city_from_airports(self, destination: str) -> Optional[str]:
+        """Nomi inglesi e alias delle città ("Rome", "Lisbon") già noti all'indice aeroporti"""
+        from .airports import AirportNotFound, get_airport_index
+
+        index = get_airport_index()
+        if index is None:
+            return None
+        try:
+            codes = index.resolve(destination)
+        except AirportNotFound:
+            return None
+        for code in codes:
+            airport = index.get(code)
+            if airport is not None and name_key(airport.city) in self._by_city:
+                return name_key(airport.city)
+        return None
+
+    def locate(self, name: str, destination: str) -> Optional[Poi]:
+        """POI dell'attrazione nella città della destinazione, None se non è nel dataset"""
+        city = self.city_key(destination)
+        if city is None:
+            self._count("unknown_city")
+            return None
+        names = self._by_city[city]
+        key = name_key(name)
+        if not key:
+            self._count("not_found")
+            return None
+
+        if key in names:
+            self._count("exact")
+            return self.pois[names[key]]
+
+        # Nome noto dentro una descrizione più lunga: "Tramonto al Piazzale Michelangelo"
+        padded = f" {key} "
+        for known in self._keys_by_length[city]:
+            if f" {known} " in padded:
+                self._count("contained")
+                return self.pois[names[known]]
+
+        # Errori di battitura: "Colloseo", "Sagrada Famiglia"
+        close = difflib.get_close_matches(key, self._keys_by_length[city], n=1, cutoff=0.85)
+        if close:
+            self._count("fuzzy")
+            return self.pois[names[close[0]]]
+        self._count("not_found")
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self.counts)
+        return {
+            "pois": len(self),
+            "cities": len(self._by_city),
+            "load_seconds": self.load_seconds,
+            **counts,
+        }
+
+
+_poi_index: Optional[PoiIndex] = None
+_poi_index_lock = threading.Lock()
+
+
+def get_poi_index() -> Optional[PoiIndex]:
+    """Restituisce l'indice condiviso, caricato al primo utilizzo (None se il dataset manca)"""
+    global _poi_index
+    with _poi_index_lock:
+        if _poi_index is None:
+            try:
+                _poi_index = PoiIndex(POI_FILE)
+                print(f"📍 Indice attrazioni caricato: {len(_poi_index)} attrazioni in {_poi_index.load_seconds}s")
+            except Exception as e:
+                print(f"⚠️ Indice attrazioni non disponibile: {e}")
+                return None
+        return _poi_index
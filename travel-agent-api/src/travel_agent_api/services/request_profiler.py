@@ -0,0 +1,333 @@
+"""
+Request Profiler - cProfile e tracemalloc su richiesta per singole esecuzioni dell'agente
+"""
+
+import contextvars
+import cProfile
+import json
+import os
+import pstats
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Senza token amministratore la profilazione è disattivata (nessun costo per le richieste)
+PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN", "")
+# Quota di richieste profilate anche senza header (0 = solo su richiesta esplicita)
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_DIR = os.getenv("PROFILING_DIR", "cache/profiles")
+# Profili conservati su disco prima di eliminare i più vecchi
+PROFILING_MAX_PROFILES = int(os.getenv("PROFILING_MAX_PROFILES", "50"))
+# Righe del riepilogo: funzioni più costose e allocazioni più grandi
+PROFILING_TOP_N = int(os.getenv("PROFILING_TOP_N", "30"))
+PROFILING_TRACEMALLOC_FRAMES = int(os.getenv("PROFILING_TRACEMALLOC_FRAMES", "10"))
+
+# Header di /chat/travel-agent che chiede la profilazione (valore = token amministratore)
+PROFILE_HEADER = "X-Freya-Profile"
+
+_PROFILE_ID = re.compile(r"^\d{8}-\d{6}-[0-9a-f]{6}$")
+
+# Da Python 3.12 cProfile usa sys.monitoring: un solo profiler attivo per processo,
+# che vede già tutti i thread (niente profiler separati per i thread dei tool)
+_PROCESS_WIDE_PROFILER = sys.version_info >= (3, 12)
+
+
+class ProfileNotFound(Exception):
+    """Profilo inesistente, eliminato o con id non valido"""
+
+
+def profiling_enabled() -> bool:
+    return bool(PROFILING_ADMIN_TOKEN)
+
+
+def is_admin(token: Optional[str]) -> bool:
+    """Confronto a tempo costante con il token amministratore configurato"""
+    return profiling_enabled() and bool(token) and secrets.compare_digest(token, PROFILING_ADMIN_TOKEN)
+
+
+def should_profile(header_value: Optional[str]) -> bool:
+    """True se la richiesta va profilata (header dell'amministratore o campionamento)"""
+    if not PROFILING_ADMIN_TOKEN:
+        return False
+    if header_value is not None:
+        return is_admin(header_value)
+    return PROFILING_SAMPLE_RATE > 0 and random.random() < PROFILING_SAMPLE_RATE
+
+
+def new_profile_id() -> str:
+    return f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(3)}"
+
+
+class ProfileSession:
+    """Profiler dei thread che lavorano per una stessa richiesta (agente e tool paralleli)"""
+
+    def __init__(self, profile_id: str, label: str):
+        self.profile_id = profile_id
+        self.label = label
+        self._lock = threading.Lock()
+        self._profilers: List[cProfile.Profile] = []
+        # False se un altro profiler occupava il processo: solo tempi e allocazioni
+        self.cpu_profiled = True
+        # Disponibili all'uscita da profile_request
+        self.seconds = 0.0
+        self.snapshot: Optional[tracemalloc.Snapshot] = None
+        self.peak_bytes = 0
+
+    def add(self, profiler: cProfile.Profile):
+        with self._lock:
+            self._profilers.append(profiler)
+
+    @property
+    def threads(self) -> int:
+        with self._lock:
+            return len(self._profilers)
+
+    def stats(self) -> Optional[pstats.Stats]:
+        with self._lock:
+            profilers = list(self._profilers)
+        if not profilers:
+            return None
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        return stats
+
+
+# Sessione della richiesta in corso, copiata nei thread dei tool dal ParallelAgentExecutor
+_active_session: contextvars.ContextVar[Optional[ProfileSession]] = contextvars.ContextVar(
+    "freya_profile_session", default=None
+)
+
+# tracemalloc è globale al processo: resta attivo finché c'è almeno una richiesta profilata
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_owned = False
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_owned
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILING_TRACEMALLOC_FRAMES)
+            _tracemalloc_owned = True
+        _tracemalloc_users += 1
+
+
+def _stop_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_owned
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and _tracemalloc_owned:
+            tracemalloc.stop()
+            _tracemalloc_owned = False
+
+
+def _start_profiler() -> Optional[cProfile.Profile]:
+    """Profiler avviato, o None se un altro profiler è già attivo (Python 3.12+, debugger, ...)"""
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return None
+    return profiler
+
+
+def profiled_call(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Esegue `fn` profilando il thread corrente se la richiesta è in profilazione"""
+    session = _active_session.get()
+    if session is None or _PROCESS_WIDE_PROFILER:
+        return fn(*args, **kwargs)
+    profiler = _start_profiler()
+    if profiler is None:
+        return fn(*args, **kwargs)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profiler.disable()
+        session.add(profiler)
+
+
+def _function_label(key) -> str:
+    filename, line, name = key
+    return f"{name} ({filename}:{line})" if line else name
+
+
+def _top_functions(stats: pstats.Stats, sort_index: int) -> List[Dict[str, Any]]:
+    # stats.stats: (file, riga, funzione) -> (chiamate primitive, chiamate, tempo proprio, tempo cumulativo, chiamanti)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][sort_index], reverse=True)
+    return [
+        {
+            "function": _function_label(key),
+            "calls": calls,
+            "self_seconds": round(self_time, 4),
+            "cumulative_seconds": round(cumulative, 4),
+        }
+        for key, (_, calls, self_time, cumulative, _) in rows[:PROFILING_TOP_N]
+    ]
+
+
+def _top_allocations(snapshot: tracemalloc.Snapshot) -> List[Dict[str, Any]]:
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ])
+    return [
+        {
+            "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+            "size_kb": round(stat.size / 1024, 1),
+            "count": stat.count,
+        }
+        for stat in snapshot.statistics("lineno")[:PROFILING_TOP_N]
+    ]
+
+
+class ProfileStore:
+    """Profili salvati su disco: `<id>.prof` (pstats, apribile con snakeviz) e `<id>.json` (riepilogo)"""
+
+    def __init__(self, directory: str = PROFILING_DIR, max_profiles: int = PROFILING_MAX_PROFILES):
+        self.directory = directory
+        self.max_profiles = max(1, max_profiles)
+        self._lock = threading.Lock()
+        self._saved = 0
+
+    def _path(self, profile_id: str, extension: str) -> str:
+        if not _PROFILE_ID.match(profile_id):
+            raise ProfileNotFound(f"Id di profilo non valido: {profile_id}")
+        return os.path.join(self.directory, f"{profile_id}.{extension}")
+
+    def save(
+        self,
+        session: ProfileSession,
+        seconds: float,
+        snapshot: Optional[tracemalloc.Snapshot],
+        peak_bytes: int,
+    ) -> Dict[str, Any]:
+        stats = session.stats()
+        summary = {
+            "id": session.profile_id,
+            "label": session.label,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "seconds": round(seconds, 3),
+            "cpu_profiled": session.cpu_profiled,
+            "threads_profiled": session.threads,
+            "peak_traced_kb": round(peak_bytes / 1024, 1),
+            "top_cumulative": _top_functions(stats, 3) if stats else [],
+            "top_self": _top_functions(stats, 2) if stats else [],
+            "top_allocations": _top_allocations(snapshot) if snapshot else [],
+        }
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            if stats:
+                stats.dump_stats(self._path(session.profile_id, "prof"))
+            with open(self._path(session.profile_id, "json"), "w", encoding="utf-8") as handle:
+                json.dump(summary, handle, ensure_ascii=False, indent=1)
+            self._saved += 1
+            self._prune()
+        print(f"🔬 Profilo {session.profile_id} salvato ({summary['seconds']}s, picco {summary['peak_traced_kb']} KB)")
+        return summary
+
+    def _ids(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            name[:-5] for name in os.listdir(self.directory) if name.endswith(".json") and _PROFILE_ID.match(name[:-5])
+        )
+
+    def _prune(self):
+        for profile_id in self._ids()[: -self.max_profiles]:
+            for extension in ("prof", "json"):
+                try:
+                    os.remove(self._path(profile_id, extension))
+                except FileNotFoundError:
+                    pass
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Profili disponibili, dal più recente"""
+        profiles = []
+        for profile_id in reversed(self._ids()):
+            try:
+                summary = self.get(profile_id)
+            except ProfileNotFound:
+                continue
+            profiles.append({
+                key: summary.get(key) for key in ("id", "label", "created_at", "seconds", "peak_traced_kb")
+            })
+        return profiles
+
+    def get(self, profile_id: str) -> Dict[str, Any]:
+        try:
+            with open(self._path(profile_id, "json"), encoding="utf-8") as handle:
+                return json.load(handle)
+        except (FileNotFoundError, ValueError):
+            raise ProfileNotFound(f"Profilo '{profile_id}' non trovato")
+
+    def stats_path(self, profile_id: str) -> str:
+        path = self._path(profile_id, "prof")
+        if not os.path.exists(path):
+            raise ProfileNotFound(f"Profilo '{profile_id}' non trovato")
+        return path
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": profiling_enabled(),
+            "sample_rate": PROFILING_SAMPLE_RATE,
+            "stored": len(self._ids()),
+            "saved_since_start": self._saved,
+            "tracemalloc_active": tracemalloc.is_tracing(),
+        }
+
+
+profile_store = ProfileStore()
+
+
+@contextmanager
+def profile_request(
+    profile_id: str,
+    label: str,
+    store: Optional[ProfileStore] = profile_store,
+) -> Iterator[ProfileSession]:
+    """
+    Profila il blocco (thread corrente e thread dei tool) con cProfile e tracemalloc.
+
+    Le allocazioni sono quelle dell'intero processo durante la richiesta: con
+    altre richieste in corso il riepilogo include anche le loro. Lo stesso vale
+    per cProfile da Python 3.12, dove il profiler è unico per il processo: se è
+    già occupato (un'altra richiesta profilata) la richiesta prosegue senza
+    profilo CPU (`cpu_profiled` False). Con `store=None` il profilo non viene
+    salvato e resta solo nella sessione restituita.
+    """
+    session = ProfileSession(profile_id, label)
+    _start_tracemalloc()
+    token = _active_session.set(session)
+    started = time.perf_counter()
+    profiler = _start_profiler()
+    if profiler is None:
+        session.cpu_profiled = False
+        print(f"⚠️ Profilo {profile_id}: cProfile già attivo nel processo, solo tempi e allocazioni")
+    try:
+        yield session
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            session.add(profiler)
+        session.seconds = time.perf_counter() - started
+        _active_session.reset(token)
+        try:
+            if tracemalloc.is_tracing():
+                session.snapshot = tracemalloc.take_snapshot()
+                session.peak_bytes = tracemalloc.get_traced_memory()[1]
+        finally:
+            _stop_tracemalloc()
+        try:
+            if store is not None:
+                store.save(session, session.seconds, session.snapshot, session.peak_bytes)
+        except Exception as e:
+            print(f"⚠️ Profilo {profile_id} non salvato: {e}")
@@ -0,0 +1,484 @@
+"""
+Resilience - Circuit breaker e richieste hedged verso OpenAI e SerpAPI
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Any, Callable, Deque, Dict, Iterator, Optional, Tuple
+
+import httpx
+
+from .cassettes import serpapi_call
+from .serialization import loads
+
+# Finestra mobile su cui si valutano errori e lentezza
+BREAKER_WINDOW_SECONDS = float(os.getenv("BREAKER_WINDOW_SECONDS", "60"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "10"))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_SLOW_RATE = float(os.getenv("BREAKER_SLOW_RATE", "0.8"))
+# Secondi in cui il breaker resta aperto prima di lasciar passare una chiamata di prova
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+# Chiamate riuscite necessarie per stimare il p95 oltre cui partire con la richiesta hedged
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.05"))
+HEDGE_WORKERS = int(os.getenv("HEDGE_WORKERS", "32"))
+
+SERPAPI_BASE_URL = os.getenv("SERPAPI_BASE_URL", "https://serpapi.com").rstrip("/")
+SERPAPI_TIMEOUT = float(os.getenv("SERPAPI_TIMEOUT", "20"))
+SERPAPI_SLOW_CALL_SECONDS = float(os.getenv("SERPAPI_SLOW_CALL_SECONDS", "8"))
+SERPAPI_HEDGE = os.getenv("SERPAPI_HEDGE", "true").lower() in ("1", "true", "yes")
+LLM_SLOW_CALL_SECONDS = float(os.getenv("LLM_SLOW_CALL_SECONDS", "45"))
+# Hedging delle sole richieste sicure (GET) verso OpenAI: le completion (POST) non vengono mai
+# duplicate, costerebbero token due volte
+LLM_HEDGE = os.getenv("LLM_HEDGE", "false").lower() in ("1", "true", "yes")
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Upstream escluso dal circuit breaker: la chiamata fallisce subito"""
+
+    def __init__(self, upstream: str, retry_in: float):
+        super().__init__(
+            f"Servizio {upstream} temporaneamente non disponibile, nuovo tentativo tra {retry_in:.0f}s"
+        )
+        self.upstream = upstream
+        self.retry_in = retry_in
+
+
+class UpstreamBudgetExceeded(Exception):
+    """Il budget di chiamate upstream dell'ambito corrente è esaurito"""
+
+
+class UpstreamCallCounter:
+    """
+    Chiamate upstream effettive (OpenAI, SerpAPI) eseguite nel suo ambito.
+
+    Conta ogni tentativo, compresi quelli hedged e le pagine successive di
+    una ricerca; oltre `limit` i nuovi tentativi sollevano UpstreamBudgetExceeded.
+    """
+
+    def __init__(self, limit: Optional[int] = None):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._calls: Dict[str, int] = defaultdict(int)
+        self._denied = 0
+
+    def charge(self, upstream: str):
+        with self._lock:
+            if self.limit is not None and sum(self._calls.values()) >= self.limit:
+                self._denied += 1
+                raise UpstreamBudgetExceeded(f"Budget di {self.limit} chiamate upstream esaurito")
+            self._calls[upstream] += 1
+
+    @property
+    def exhausted(self) -> bool:
+        with self._lock:
+            return self.limit is not None and sum(self._calls.values()) >= self.limit
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"total": sum(self._calls.values()), "denied": self._denied, **self._calls}
+
+
+# Contatore dell'ambito in corso (None = chiamate non conteggiate); i tentativi hedged lo ereditano
+_call_counter: contextvars.ContextVar[Optional[UpstreamCallCounter]] = contextvars.ContextVar(
+    "freya_upstream_calls", default=None
+)
+
+
+@contextmanager
+def counting_upstream_calls(counter: UpstreamCallCounter) -> Iterator[UpstreamCallCounter]:
+    """Le chiamate upstream eseguite nel blocco vengono conteggiate (e limitate) da `counter`"""
+    token = _call_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _call_counter.reset(token)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker su finestra mobile.
+
+    Si apre quando, con almeno `min_calls` chiamate negli ultimi
+    `window_seconds`, la quota di errori o di chiamate lente supera la
+    soglia. Da aperto rifiuta subito le chiamate; dopo `open_seconds` lascia
+    passare una sola chiamata di prova (half-open) che decide se richiudere.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        slow_call_seconds: float,
+        window_seconds: float = BREAKER_WINDOW_SECONDS,
+        min_calls: int = BREAKER_MIN_CALLS,
+        error_rate: float = BREAKER_ERROR_RATE,
+        slow_rate: float = BREAKER_SLOW_RATE,
+        open_seconds: float = BREAKER_OPEN_SECONDS,
+    ):
+        self.name = name
+        self.slow_call_seconds = slow_call_seconds
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        # (istante, latenza, ok)
+        self._calls: Deque[Tuple[float, float, bool]] = deque()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._counts = {"opened": 0, "rejected": 0}
+
+    def _trim(self, now: float):
+        cutoff = now - self.window_seconds
+        while self._calls and self._calls[0][0] < cutoff:
+            self._calls.popleft()
+
+    def before_call(self):
+        """Solleva CircuitOpenError se la chiamata non può partire"""
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            now = time.monotonic()
+            if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+                self._state = HALF_OPEN
+                self._probe_in_flight = False
+            if self._state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            self._counts["rejected"] += 1
+            retry_in = max(0.0, self.open_seconds - (now - self._opened_at))
+        raise CircuitOpenError(self.name, retry_in)
+
+    def record(self, latency: float, ok: bool):
+        """Registra l'esito di una chiamata e aggiorna lo stato"""
+        with self._lock:
+            now = time.monotonic()
+            if self._state == HALF_OPEN:
+                self._probe_in_flight = False
+                if ok and latency < self.slow_call_seconds:
+                    print(f"🟢 Circuit breaker {self.name} richiuso")
+                    self._state = CLOSED
+                    self._calls.clear()
+                else:
+                    self._open(now)
+                return
+            self._calls.append((now, latency, ok))
+            self._trim(now)
+            if self._state == CLOSED and len(self._calls) >= self.min_calls:
+                errors = sum(1 for _, _, call_ok in self._calls if not call_ok)
+                slow = sum(1 for _, call_latency, _ in self._calls if call_latency >= self.slow_call_seconds)
+                if errors / len(self._calls) >= self.error_rate or slow / len(self._calls) >= self.slow_rate:
+                    self._open(now)
+
+    def _open(self, now: float):
+        self._state = OPEN
+        self._opened_at = now
+        self._counts["opened"] += 1
+        print(f"🔴 Circuit breaker {self.name} aperto per {self.open_seconds:.0f}s")
+
+    def p95(self) -> Optional[float]:
+        """p95 delle chiamate riuscite nella finestra, None se i campioni sono pochi"""
+        with self._lock:
+            self._trim(time.monotonic())
+            latencies = sorted(latency for _, latency, ok in self._calls if ok)
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._trim(time.monotonic())
+            calls = len(self._calls)
+            errors = sum(1 for _, _, ok in self._calls if not ok)
+            slow = sum(1 for _, latency, _ in self._calls if latency >= self.slow_call_seconds)
+            stats = {
+                "state": self._state,
+                "calls": calls,
+                "error_rate": round(errors / calls, 3) if calls else None,
+                "slow_rate": round(slow / calls, 3) if calls else None,
+                **self._counts,
+            }
+        stats["p95"] = self.p95()
+        return stats
+
+
+class Upstream:
+    """
+    Servizio esterno protetto da circuit breaker, con hedging opzionale.
+
+    Per le chiamate idempotenti, se la prima richiesta supera il p95
+    osservato ne parte una seconda identica e vince la prima che risponde.
+    La perdente non può essere interrotta: il suo risultato viene scartato
+    (e chiuso tramite `discard`, es. una risposta HTTP ancora aperta).
+    """
+
+    def __init__(self, name: str, slow_call_seconds: float, hedge: bool):
+        self.name = name
+        self.hedge = hedge
+        self.breaker = CircuitBreaker(name, slow_call_seconds)
+        self._lock = threading.Lock()
+        self._hedges = 0
+        self._hedge_wins = 0
+
+    def _hedge_delay(self) -> Optional[float]:
+        p95 = self.breaker.p95()
+        return None if p95 is None else max(HEDGE_MIN_DELAY, p95)
+
+    def _charge(self):
+        counter = _call_counter.get()
+        if counter is not None:
+            counter.charge(self.name)
+
+    def _attempt(self, fn: Callable, is_failure: Optional[Callable[[Any], bool]], *args, **kwargs):
+        """Esegue un tentativo registrandone latenza ed esito nel breaker"""
+        self._charge()
+        started = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.breaker.record(time.monotonic() - started, ok=False)
+            raise
+        failed = bool(is_failure and is_failure(result))
+        self.breaker.record(time.monotonic() - started, ok=not failed)
+        return result
+
+    def call(
+        self,
+        fn: Callable,
+        *args,
+        idempotent: bool = False,
+        is_failure: Optional[Callable[[Any], bool]] = None,
+        discard: Optional[Callable[[Any], None]] = None,
+        **kwargs,
+    ):
+        """Chiama `fn` attraverso il breaker (e con hedging se idempotente)"""
+        self.breaker.before_call()
+        delay = self._hedge_delay() if idempotent and self.hedge else None
+        if delay is None:
+            return self._attempt(fn, is_failure, *args, **kwargs)
+
+        pool = _hedge_pool()
+        primary = pool.submit(contextvars.copy_context().run, self._attempt, fn, is_failure, *args, **kwargs)
+        try:
+            return primary.result(timeout=delay)
+        except FutureTimeout:
+            pass
+
+        with self._lock:
+            self._hedges += 1
+        secondary = pool.submit(contextvars.copy_context().run, self._attempt, fn, is_failure, *args, **kwargs)
+        pending = {primary, secondary}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                if future is secondary:
+                    with self._lock:
+                        self._hedge_wins += 1
+                for loser in pending:
+                    loser.add_done_callback(_discard_callback(discard))
+                return future.result()
+        raise error
+
+    async def acall(
+        self,
+        fn: Callable,
+        *args,
+        idempotent: bool = False,
+        is_failure: Optional[Callable[[Any], bool]] = None,
+        discard: Optional[Callable[[Any], Any]] = None,
+        **kwargs,
+    ):
+        """Versione asincrona di call() per coroutine (client httpx async)"""
+        self.breaker.before_call()
+
+        async def attempt():
+            self._charge()
+            started = time.monotonic()
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception:
+                self.breaker.record(time.monotonic() - started, ok=False)
+                raise
+            self.breaker.record(time.monotonic() - started, ok=not (is_failure and is_failure(result)))
+            return result
+
+        delay = self._hedge_delay() if idempotent and self.hedge else None
+        if delay is None:
+            return await attempt()
+
+        primary = asyncio.ensure_future(attempt())
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        with self._lock:
+            self._hedges += 1
+        secondary = asyncio.ensure_future(attempt())
+        pending = {primary, secondary}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                if task is secondary:
+                    with self._lock:
+                        self._hedge_wins += 1
+                for loser in pending:
+                    loser.add_done_callback(_discard_task_callback(discard))
+                return task.result()
+        raise error
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hedges, wins = self._hedges, self._hedge_wins
+        return {
+            **self.breaker.stats(),
+            "hedging": self.hedge,
+            "hedges": hedges,
+            "hedge_wins": wins,
+            "hedge_win_rate": round(wins / hedges, 3) if hedges else None,
+        }
+
+
+def _discard_callback(discard: Optional[Callable[[Any], None]]):
+    def callback(future: Future):
+        if discard is not None and future.exception() is None:
+            discard(future.result())
+    return callback
+
+
+def _discard_task_callback(discard: Optional[Callable[[Any], Any]]):
+    def callback(task: "asyncio.Future"):
+        if discard is not None and not task.cancelled() and task.exception() is None:
+            result = discard(task.result())
+            if asyncio.iscoroutine(result):
+                asyncio.ensure_future(result)
+    return callback
+
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _hedge_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="freya-hedge")
+        return _pool
+
+
+UPSTREAMS: Dict[str, Upstream] = {
+    "openai": Upstream("openai", slow_call_seconds=LLM_SLOW_CALL_SECONDS, hedge=LLM_HEDGE),
+    "serpapi": Upstream("serpapi", slow_call_seconds=SERPAPI_SLOW_CALL_SECONDS, hedge=SERPAPI_HEDGE),
+}
+
+
+def resilience_stats() -> Dict[str, Any]:
+    """Stato dei breaker e statistiche di hedging per upstream"""
+    return {name: upstream.stats() for name, upstream in UPSTREAMS.items()}
+
+
+# ---------------------------------------------------------------- SerpAPI
+
+
+def serpapi_search(search_class, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Ricerca SerpAPI (GET idempotente) con cache, timeout, circuit breaker e hedging"""
+    from .tool_cache import tool_cache
+
+    # Namespace = motore (google_images, google_hotels, ...); la chiave API non fa parte della chiave
+    namespace = params.get("engine", "google")
+    cache_args = {name: value for name, value in params.items() if name != "api_key"}
+    # Le pagine successive (next_page_token) restano nei cursori, non in cache né nello storico
+    cacheable = "next_page_token" not in params
+    cached = tool_cache.get(namespace, cache_args) if cacheable else None
+    if cached is not None:
+        return cached
+
+    search = search_class(params)
+    search.BACKEND = SERPAPI_BASE_URL
+    search.timeout = SERPAPI_TIMEOUT
+    search.params_dict["output"] = "json"
+    # get_dict() non controlla lo status HTTP: si usa la risposta per contare i 5xx come errori
+    # (con una cassetta attiva la risposta viene registrata o, nel replay, servita senza rete)
+    response = serpapi_call(params, lambda: UPSTREAMS["serpapi"].call(
+        search.get_response,
+        idempotent=True,
+        is_failure=lambda result: result.status_code >= 500,
+    ))
+    result = dict(loads(response.text))
+    if cacheable and response.status_code < 400 and "error" not in result:
+        tool_cache.put(namespace, cache_args, result)
+    return result
+
+
+# ---------------------------------------------------------------- OpenAI (trasporto httpx)
+
+
+# Metodi HTTP che si possono ripetere senza effetti: solo queste richieste vengono hedged
+_SAFE_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+
+def _is_server_error(response: httpx.Response) -> bool:
+    # 429 non apre il breaker: è un limite di quota, non un guasto del servizio
+    return response.status_code >= 500
+
+
+class ResilientTransport(httpx.BaseTransport):
+    """Trasporto httpx che fa passare ogni richiesta dall'upstream indicato"""
+
+    def __init__(self, inner: httpx.BaseTransport, upstream: str):
+        self.inner = inner
+        self.upstream = UPSTREAMS[upstream]
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()  # il corpo deve essere riutilizzabile dalla richiesta hedged
+        return self.upstream.call(
+            self.inner.handle_request,
+            request,
+            # Una completion (POST) inviata due volte verrebbe fatturata due volte
+            idempotent=request.method in _SAFE_METHODS,
+            is_failure=_is_server_error,
+            discard=lambda response: response.close(),
+        )
+
+    def close(self):
+        self.inner.close()
+
+
+class AsyncResilientTransport(httpx.AsyncBaseTransport):
+    """Come ResilientTransport, per il client httpx asincrono"""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, upstream: str):
+        self.inner = inner
+        self.upstream = UPSTREAMS[upstream]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        return await self.upstream.acall(
+            self.inner.handle_async_request,
+            request,
+            idempotent=request.method in _SAFE_METHODS,
+            is_failure=_is_server_error,
+            discard=lambda response: response.aclose(),
+        )
+
+    async def aclose(self):
+        await self.inner.aclose()
@@ -0,0 +1,208 @@
+"""
+Response Blocks - Risposta della chat come lista ordinata di blocchi tipizzati
+"""
+
+import contextvars
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Literal, Optional
+
+from pydantic import BaseModel, Field
+
+# Blocchi massimi per risposta (immagini, hotel e voli oltre il limite vengono scartati)
+RESPONSE_BLOCKS_MAX = int(os.getenv("RESPONSE_BLOCKS_MAX", "40"))
+# Opzioni di volo trasformate in blocchi per ogni ricerca
+RESPONSE_BLOCKS_MAX_FLIGHTS = int(os.getenv("RESPONSE_BLOCKS_MAX_FLIGHTS", "5"))
+
+# Istruzione aggiunta al messaggio dell'utente: i dati dei tool arrivano già come schede
+BLOCKS_INSTRUCTION = (
+    "📦 Le immagini, gli hotel, i voli e i giorni dell'itinerario trovati dai tool vengono "
+    "mostrati all'utente come schede separate: NON ripetere nella risposta URL, immagini, "
+    "elenchi di hotel o di voli, scrivi solo il commento, il confronto e i consigli."
+)
+
+
+class TextBlock(BaseModel):
+    type: Literal["text"] = "text"
+    text: str = Field(description="Testo in markdown semplice (grassetto, corsivo, link).")
+
+
+class ImageBlock(BaseModel):
+    type: Literal["image"] = "image"
+    title: str
+    url: str = Field(description="Immagine originale a piena risoluzione.")
+    thumbnail: Optional[str] = Field(None, description="Miniatura (proxy locale) se diversa dall'originale.")
+    width: Optional[int] = None
+    height: Optional[int] = None
+    source: Optional[str] = None
+
+
+class HotelBlock(BaseModel):
+    type: Literal["hotel"] = "hotel"
+    name: str
+    price_per_night: Optional[float] = None
+    total_price: Optional[float] = None
+    rating: Optional[float] = None
+    reviews: Optional[int] = None
+    hotel_class: Optional[int] = None
+    amenities: Optional[List[str]] = None
+    link: Optional[str] = None
+    thumbnail: Optional[str] = None
+
+
+class FlightBlock(BaseModel):
+    type: Literal["flight"] = "flight"
+    price: Optional[float] = None
+    airline: Optional[str] = None
+    airline_logo: Optional[str] = None
+    departure: Optional[str] = Field(None, description="Codice IATA di partenza.")
+    departure_time: Optional[str] = None
+    arrival: Optional[str] = Field(None, description="Codice IATA di arrivo.")
+    arrival_time: Optional[str] = None
+    duration: Optional[int] = Field(None, description="Durata totale in minuti.")
+    stops: int = 0
+    flight_numbers: Optional[List[str]] = None
+
+
+class RouteStop(BaseModel):
+    name: str
+    slot: Optional[str] = Field(None, description="Fascia della tappa: morning, afternoon, evening.")
+    lat: float
+    lon: float
+    km: Optional[float] = Field(None, description="Distanza a piedi dalla tappa precedente.")
+    minutes: Optional[int] = Field(None, description="Minuti a piedi dalla tappa precedente.")
+    transit: bool = Field(False, description="Tappa precedente troppo lontana: meglio i mezzi.")
+
+
+class DayBlock(BaseModel):
+    type: Literal["day"] = "day"
+    day: int
+    title: Optional[str] = None
+    slots: Optional[Dict[str, str]] = Field(None, description="Attività per fascia: morning, afternoon, evening.")
+    attractions: Optional[List[str]] = Field(None, description="Attrazioni nell'ordine di visita.")
+    images: Optional[List[ImageBlock]] = None
+    route: Optional[List[RouteStop]] = Field(None, description="Tappe con coordinate, per la mappa del giorno.")
+    walking_km: Optional[float] = None
+    walking_minutes: Optional[int] = None
+
+
+class BlockCollector:
+    """Blocchi prodotti dai tool durante una richiesta (anche da thread paralleli)"""
+
+    def __init__(self, max_blocks: int = RESPONSE_BLOCKS_MAX):
+        self.max_blocks = max_blocks
+        self._lock = threading.Lock()
+        self._blocks: List[BaseModel] = []
+        self.dropped = 0
+
+    def add(self, *blocks: BaseModel):
+        with self._lock:
+            for block in blocks:
+                if len(self._blocks) >= self.max_blocks:
+                    self.dropped += 1
+                    continue
+                self._blocks.append(block)
+
+    @property
+    def blocks(self) -> List[BaseModel]:
+        with self._lock:
+            return list(self._blocks)
+
+
+# Collettore della richiesta in corso: None se il client vuole solo markdown
+_collector: contextvars.ContextVar[Optional[BlockCollector]] = contextvars.ContextVar(
+    "freya_response_blocks", default=None
+)
+
+
+@contextmanager
+def collect_blocks(max_blocks: int = RESPONSE_BLOCKS_MAX) -> Iterator[BlockCollector]:
+    """I tool eseguiti nel blocco registrano i loro risultati come blocchi nel collettore"""
+    collector = BlockCollector(max_blocks)
+    token = _collector.set(collector)
+    try:
+        yield collector
+    finally:
+        _collector.reset(token)
+
+
+def collecting_blocks() -> bool:
+    """True se la richiesta in corso ha chiesto la risposta a blocchi (evita lavoro inutile nei tool)"""
+    return _collector.get() is not None
+
+
+def collected_blocks() -> List[Dict[str, Any]]:
+    """Blocchi emessi finora nella richiesta in corso, serializzati (vuoto in modalità markdown)"""
+    collector = _collector.get()
+    if collector is None:
+        return []
+    return [block.model_dump(exclude_none=True) for block in collector.blocks]
+
+
+def emit_blocks(*blocks: BaseModel):
+    """Aggiunge blocchi alla risposta in corso (nessun effetto in modalità markdown)"""
+    collector = _collector.get()
+    if collector is not None and blocks:
+        collector.add(*blocks)
+
+
+# Modello di ciascun tipo, per ricostruire i blocchi salvati (es. nelle guide pre-generate)
+_BLOCK_TYPES = {
+    block.model_fields["type"].default: block
+    for block in (TextBlock, ImageBlock, HotelBlock, FlightBlock, DayBlock)
+}
+
+
+def parse_blocks(data: List[Dict[str, Any]]) -> List[BaseModel]:
+    """Blocchi da una lista di dict prodotti da model_dump (tipi sconosciuti ignorati)"""
+    return [_BLOCK_TYPES[item["type"]].model_validate(item) for item in data if item.get("type") in _BLOCK_TYPES]
+
+
+def hotel_block(hotel: Dict[str, Any]) -> HotelBlock:
+    """Scheda da un hotel già compattato da hotel_cursor.compact_hotel"""
+    return HotelBlock(
+        name=hotel.get("name") or "Hotel",
+        price_per_night=hotel.get("price_per_night"),
+        total_price=hotel.get("total_price"),
+        rating=hotel.get("rating"),
+        reviews=hotel.get("reviews"),
+        hotel_class=hotel.get("hotel_class"),
+        amenities=hotel.get("amenities") or None,
+        link=hotel.get("link"),
+        thumbnail=hotel.get("thumbnail"),
+    )
+
+
+def flight_blocks(flights_data: Dict[str, Any], limit: int = RESPONSE_BLOCKS_MAX_FLIGHTS) -> List[FlightBlock]:
+    """Opzioni di volo (prima le migliori secondo Google Flights) dalla risposta di SerpAPI"""
+    options = (flights_data.get("best_flights") or []) + (flights_data.get("other_flights") or [])
+    blocks = []
+    for option in options[:limit]:
+        legs = option.get("flights") or []
+        if not legs:
+            continue
+        first, last = legs[0], legs[-1]
+        blocks.append(FlightBlock(
+            price=option.get("price"),
+            airline=first.get("airline"),
+            airline_logo=option.get("airline_logo") or first.get("airline_logo"),
+            departure=(first.get("departure_airport") or {}).get("id"),
+            departure_time=(first.get("departure_airport") or {}).get("time"),
+            arrival=(last.get("arrival_airport") or {}).get("id"),
+            arrival_time=(last.get("arrival_airport") or {}).get("time"),
+            duration=option.get("total_duration"),
+            stops=len(legs) - 1,
+            flight_numbers=[leg["flight_number"] for leg in legs if leg.get("flight_number")] or None,
+        ))
+    return blocks
+
+
+def compose_blocks(output: str, collector: BlockCollector) -> List[Dict[str, Any]]:
+    """Risposta finale: il testo dell'agente seguito dalle schede dei tool, nell'ordine di esecuzione"""
+    blocks: List[BaseModel] = []
+    if output and output.strip():
+        blocks.append(TextBlock(text=output.strip()))
+    blocks.extend(collector.blocks)
+    # Campi vuoti omessi: il payload resta più piccolo del markdown equivalente
+    return [block.model_dump(exclude_none=True) for block in blocks]
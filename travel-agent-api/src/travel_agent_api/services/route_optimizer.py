@@ -0,0 +1,260 @@
+"""
+Route Optimizer - Ordine di visita delle attrazioni di un giorno, con le distanze a piedi
+
+Le attrazioni vengono geolocalizzate sull'indice POI e ordinate fascia per
+fascia (mattina, pomeriggio, sera): nearest neighbour per un primo percorso,
+poi 2-opt sulla matrice delle distanze calcolata una sola volta con NumPy.
+Le attrazioni senza coordinate restano nella loro fascia, in coda.
+"""
+
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from pydantic import BaseModel, Field
+
+from .airports import haversine_km
+from .poi_index import Poi, get_poi_index, name_key
+from .response_blocks import RouteStop
+
+# false = le attrazioni restano nell'ordine scelto dal modello
+ROUTE_OPTIMIZATION_ENABLED = os.getenv("ROUTE_OPTIMIZATION_ENABLED", "true").lower() in ("1", "true", "yes")
+# Strade vere contro linea d'aria: a piedi in città si percorre circa il 30% in più
+ROUTE_WALKING_DETOUR = float(os.getenv("ROUTE_WALKING_DETOUR", "1.3"))
+ROUTE_WALKING_SPEED_KMH = float(os.getenv("ROUTE_WALKING_SPEED_KMH", "4.5"))
+# Oltre questa distanza tra due tappe si consigliano i mezzi
+ROUTE_WALKING_MAX_KM = float(os.getenv("ROUTE_WALKING_MAX_KM", "3.0"))
+
+# Tetto alle mosse 2-opt: con 30 tappe ne bastano di solito meno di 50
+_MAX_TWO_OPT_MOVES = 1000
+
+
+class DayRoute(BaseModel):
+    order: List[str] = Field(description="Tutte le attrazioni del giorno nell'ordine di visita.")
+    stops: List[RouteStop] = Field(default_factory=list, description="Tappe geolocalizzate nell'ordine di visita.")
+    unlocated: List[str] = Field(default_factory=list, description="Attrazioni senza coordinate nel dataset.")
+    walking_km: float = 0.0
+    walking_minutes: int = 0
+    original_km: float = Field(0.0, description="Percorso a piedi nell'ordine proposto dal modello.")
+
+
+def walking_minutes(km: float) -> int:
+    return int(round(km / ROUTE_WALKING_SPEED_KMH * 60))
+
+
+def _path_length(distances: np.ndarray, path: Sequence[int]) -> float:
+    path = np.asarray(path, dtype=int)
+    return float(distances[path[:-1], path[1:]].sum()) if len(path) > 1 else 0.0
+
+
+def _nearest_neighbour(weights: np.ndarray, first: Optional[int]) -> List[int]:
+    """Percorso da 0 (partenza) a m-1 (arrivo) scegliendo ogni volta la tappa più vicina"""
+    size = len(weights)
+    unvisited = np.ones(size, dtype=bool)
+    unvisited[[0, size - 1]] = False
+    path, current = [0], 0
+    if first is not None:
+        path.append(first)
+        unvisited[first] = False
+        current = first
+    while unvisited.any():
+        current = int(np.where(unvisited, weights[current], np.inf).argmin())
+        path.append(current)
+        unvisited[current] = False
+    path.append(size - 1)
+    return path
+
+
+def _two_opt(weights: np.ndarray, path: List[int]) -> List[int]:
+    """
+    2-opt con estremi fissi: a ogni passo valuta insieme, con un'unica
+    operazione sulla matrice, tutte le inversioni di segmento e applica la migliore.
+    """
+    path = np.asarray(path, dtype=int)
+    inner = np.arange(1, len(path) - 1)
+    if len(inner) < 2:
+        return path.tolist()
+    upper = np.triu(np.ones((len(inner), len(inner)), dtype=bool), k=1)
+    for _ in range(_MAX_TWO_OPT_MOVES):
+        edges = weights[path[:-1], path[1:]]
+        before, first, after = path[inner - 1], path[inner], path[inner + 1]
+        # Invertire path[i..j]: gli archi (i-1, i) e (j, j+1) diventano (i-1, j) e (i, j+1)
+        delta = (
+            weights[before[:, None], first[None, :]]
+            + weights[first[:, None], after[None, :]]
+            - edges[inner - 1][:, None]
+            - edges[inner][None, :]
+        )
+        delta = np.where(upper, delta, 0.0)
+        best = int(delta.argmin())
+        if delta.flat[best] >= -1e-9:
+            break
+        i, j = divmod(best, len(inner))
+        path[i + 1:j + 2] = path[i + 1:j + 2][::-1].copy()
+    return path.tolist()
+
+
+def _route(distances: np.ndarray, nodes: List[int], anchor: Optional[int]) -> List[int]:
+    """
+    Ordine di visita di `nodes` partendo da `anchor` (ultima tappa della fascia
+    precedente) o da un punto libero; l'arrivo è sempre libero.
+
+    Partenza e arrivo liberi sono nodi fittizi a distanza zero da tutti: così
+    il 2-opt a estremi fissi può anche scegliere la prima e l'ultima tappa.
+    """
+    if len(nodes) < 2:
+        return list(nodes)
+    size = len(nodes) + 2
+    weights = np.zeros((size, size))
+    weights[1:-1, 1:-1] = distances[np.ix_(nodes, nodes)]
+    first = None
+    if anchor is not None:
+        weights[0, 1:-1] = distances[anchor, nodes]
+        weights[1:-1, 0] = distances[nodes, anchor]
+    else:
+        # Senza punto di partenza si comincia dalla tappa più periferica
+        first = int(weights[1:-1, 1:-1].sum(axis=1).argmax()) + 1
+    path = _two_opt(weights, _nearest_neighbour(weights, first))
+    return [nodes[position - 1] for position in path[1:-1]]
+
+
+class RouteOptimizer:
+    """Percorsi giornalieri degli itinerari e statistiche per /metrics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.days = 0
+        self.stops = 0
+        self.located = 0
+        self.original_km = 0.0
+        self.optimized_km = 0.0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def plan_day(self, attractions: Sequence[str], slots: Sequence[str] = (), destination: str = "") -> DayRoute:
+        """
+        Percorso di un giorno: `slots` sono i testi delle fasce nell'ordine della
+        giornata; un'attrazione citata in una fascia resta in quella fascia.
+        """
+        started = time.perf_counter()
+        names = list(dict.fromkeys(name.strip() for name in attractions if name and name.strip()))
+        index = get_poi_index()
+        pois: List[Optional[Poi]] = [index.locate(name, destination) if index else None for name in names]
+        located = [position for position, poi in enumerate(pois) if poi is not None]
+
+        # Matrice completa delle distanze in linea d'aria tra le tappe geolocalizzate
+        distances = np.zeros((len(names), len(names)))
+        if located:
+            lat = np.array([pois[position].lat for position in located])
+            lon = np.array([pois[position].lon for position in located])
+            distances[np.ix_(located, located)] = haversine_km(lat[:, None], lon[:, None], lat[None, :], lon[None, :])
+
+        groups = self._groups(names, pois, [name_key(text) for text in slots], distances)
+        order: List[int] = []
+        stop_slot: Dict[int, int] = {}
+        anchor: Optional[int] = None
+        for group, members in enumerate(groups):
+            path = _route(distances, [member for member in members if pois[member] is not None], anchor)
+            order.extend(path)
+            order.extend(member for member in members if pois[member] is None)
+            stop_slot.update({member: group for member in members})
+            if path:
+                anchor = path[-1]
+
+        route = self._day_route(names, pois, order, stop_slot, distances)
+        route.original_km = round(_path_length(distances, located) * ROUTE_WALKING_DETOUR, 1)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.days += 1
+            self.stops += len(names)
+            self.located += len(located)
+            self.original_km += route.original_km
+            self.optimized_km += _path_length(distances, [stop for stop in order if pois[stop] is not None]) * ROUTE_WALKING_DETOUR
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+        return route
+
+    @staticmethod
+    def _groups(
+        names: List[str], pois: List[Optional[Poi]], slot_keys: List[str], distances: np.ndarray
+    ) -> List[List[int]]:
+        """Attrazioni per fascia; quelle non citate nei testi vanno nella fascia della tappa più vicina"""
+        groups: List[List[int]] = [[] for _ in range(max(1, len(slot_keys)))]
+        slot_of: List[Optional[int]] = []
+        for position, name in enumerate(names):
+            keys = [name_key(name)] + (pois[position].keys() if pois[position] else [])
+            slot_of.append(next(
+                (slot for slot, text in enumerate(slot_keys) if any(key and f" {key} " in f" {text} " for key in keys)),
+                None,
+            ))
+
+        placed = [position for position, slot in enumerate(slot_of) if slot is not None and pois[position] is not None]
+        for position, slot in enumerate(slot_of):
+            if slot is None:
+                if pois[position] is not None and placed:
+                    slot = slot_of[placed[int(distances[position, placed].argmin())]]
+                else:
+                    # Senza coordinate resta dopo l'attrazione che la precede nell'elenco
+                    slot = next((slot_of[other] for other in range(position - 1, -1, -1) if slot_of[other] is not None), 0)
+                slot_of[position] = slot
+            groups[slot].append(position)
+        return groups
+
+    @staticmethod
+    def _day_route(
+        names: List[str],
+        pois: List[Optional[Poi]],
+        order: List[int],
+        stop_slot: Dict[int, int],
+        distances: np.ndarray,
+    ) -> DayRoute:
+        slot_names = ("morning", "afternoon", "evening")
+        stops: List[RouteStop] = []
+        previous: Optional[int] = None
+        walking_km = 0.0
+        for position in order:
+            poi = pois[position]
+            if poi is None:
+                continue
+            stop = RouteStop(
+                name=names[position],
+                slot=slot_names[stop_slot[position]] if stop_slot[position] < len(slot_names) else None,
+                lat=poi.lat,
+                lon=poi.lon,
+            )
+            if previous is not None:
+                km = float(distances[previous, position]) * ROUTE_WALKING_DETOUR
+                stop.km = round(km, 1)
+                if km > ROUTE_WALKING_MAX_KM:
+                    stop.transit = True
+                else:
+                    stop.minutes = walking_minutes(km)
+                    walking_km += km
+            stops.append(stop)
+            previous = position
+        return DayRoute(
+            order=[names[position] for position in order],
+            stops=stops,
+            unlocated=[name for name, poi in zip(names, pois) if poi is None],
+            walking_km=round(walking_km, 1),
+            walking_minutes=walking_minutes(walking_km),
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": ROUTE_OPTIMIZATION_ENABLED,
+                "days": self.days,
+                "stops": self.stops,
+                "located_ratio": round(self.located / self.stops, 3) if self.stops else None,
+                "original_km": round(self.original_km, 1),
+                "optimized_km": round(self.optimized_km, 1),
+                "avg_ms": round(self.total_ms / self.days, 3) if self.days else None,
+                "max_ms": round(self.max_ms, 3),
+            }
+
+
+route_optimizer = RouteOptimizer()
@@ -0,0 +1,251 @@
+"""
+Run Checkpoint - Salva ogni step dell'agente per riprendere le esecuzioni interrotte
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain.agents.output_parsers.tools import ToolAgentAction
+from langchain_core.agents import AgentAction
+from langchain_core.messages import messages_from_dict, messages_to_dict
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.checkpoint.memory import InMemorySaver
+
+try:
+    from langgraph.checkpoint.sqlite import SqliteSaver
+except ImportError:
+    print("⚠️ langgraph-checkpoint-sqlite non disponibile, checkpoint solo in memoria")
+    SqliteSaver = None
+
+# Percorso del database locale dei checkpoint (vuoto = solo in memoria)
+CHECKPOINT_DB_PATH = os.getenv("AGENT_CHECKPOINT_DB", "checkpoints/agent_runs.sqlite")
+# Numero massimo di esecuzioni tenute in memoria/disco prima di eliminare le più vecchie
+CHECKPOINT_MAX_RUNS = int(os.getenv("AGENT_CHECKPOINT_MAX_RUNS", "500"))
+# Secondi entro cui un retry riprende gli step salvati (oltre, il checkpoint viene eliminato)
+CHECKPOINT_TTL = int(os.getenv("AGENT_CHECKPOINT_TTL", "3600"))
+# Secondi entro cui un retry riceve la risposta finale già prodotta
+CHECKPOINT_FINAL_TTL = int(os.getenv("AGENT_CHECKPOINT_FINAL_TTL", "300"))
+
+_checkpointer = None
+_checkpointer_lock = threading.Lock()
+_known_threads: "OrderedDict[str, None]" = OrderedDict()
+
+
+def get_checkpointer():
+    """Restituisce il checkpointer LangGraph condiviso dal processo"""
+    global _checkpointer
+    with _checkpointer_lock:
+        if _checkpointer is None:
+            if SqliteSaver is not None and CHECKPOINT_DB_PATH:
+                directory = os.path.dirname(CHECKPOINT_DB_PATH)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                conn = sqlite3.connect(CHECKPOINT_DB_PATH, check_same_thread=False)
+                _checkpointer = SqliteSaver(conn)
+                print(f"💾 Checkpoint dell'agente su {CHECKPOINT_DB_PATH}")
+                _prune_saved_threads(_checkpointer)
+            else:
+                _checkpointer = InMemorySaver()
+                print("💾 Checkpoint dell'agente in memoria")
+        return _checkpointer
+
+
+def _prune_saved_threads(checkpointer):
+    """
+    Elimina i checkpoint scaduti rimasti su disco da esecuzioni precedenti del
+    processo e ricostruisce l'ordine dei thread per il limite CHECKPOINT_MAX_RUNS.
+    """
+    latest: Dict[str, float] = {}
+    try:
+        for saved in checkpointer.list(None):
+            thread_id = saved.config["configurable"]["thread_id"]
+            saved_at = float((saved.metadata or {}).get("saved_at") or 0)
+            latest[thread_id] = max(saved_at, latest.get(thread_id, 0))
+    except Exception as e:
+        print(f"⚠️ Impossibile leggere i checkpoint salvati: {e}")
+        return
+
+    now = time.time()
+    expired = [thread_id for thread_id, saved_at in latest.items() if now - saved_at > CHECKPOINT_TTL]
+    alive = sorted(
+        (item for item in latest.items() if now - item[1] <= CHECKPOINT_TTL), key=lambda item: item[1]
+    )
+    # Già sotto _checkpointer_lock (chiamata da get_checkpointer)
+    for thread_id, _ in alive:
+        _known_threads[thread_id] = None
+    while len(_known_threads) > CHECKPOINT_MAX_RUNS:
+        expired.append(_known_threads.popitem(last=False)[0])
+
+    for thread_id in expired:
+        try:
+            checkpointer.delete_thread(thread_id)
+        except Exception as e:
+            print(f"⚠️ Impossibile eliminare il checkpoint {thread_id}: {e}")
+    if expired:
+        print(f"🧹 Eliminati {len(expired)} checkpoint scaduti")
+
+
+def run_thread_id(
+    messages: Any,
+    request_id: Optional[str],
+    conversation_id: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Calcola la chiave del checkpoint per una richiesta.
+
+    Solo il client sa se una richiesta è un retry: senza request_id non c'è
+    checkpoint (None). L'hash dei messaggi evita che un request_id riusato per
+    una domanda diversa riceva la risposta di un'altra.
+    """
+    if not request_id:
+        return None
+    payload = json.dumps(messages, sort_keys=True, ensure_ascii=False, default=str)
+    digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+    return f"{conversation_id or 'anon'}:{request_id}:{digest}"
+
+
+def _dump_step(action: AgentAction, observation: Any) -> Dict[str, Any]:
+    """Converte uno step in un dizionario serializzabile"""
+    return {
+        "tool": action.tool,
+        "tool_input": action.tool_input,
+        "log": action.log,
+        "tool_call_id": getattr(action, "tool_call_id", None),
+        "message_log": messages_to_dict(getattr(action, "message_log", [])),
+        "observation": observation,
+    }
+
+
+def _load_step(data: Dict[str, Any]) -> Tuple[AgentAction, Any]:
+    """Ricostruisce uno step salvato con _dump_step"""
+    if data.get("tool_call_id"):
+        action = ToolAgentAction(
+            tool=data["tool"],
+            tool_input=data["tool_input"],
+            log=data["log"],
+            message_log=messages_from_dict(data["message_log"]),
+            tool_call_id=data["tool_call_id"],
+        )
+    else:
+        action = AgentAction(tool=data["tool"], tool_input=data["tool_input"], log=data["log"])
+    return action, data["observation"]
+
+
+class RunCheckpoint:
+    """
+    Checkpoint di una singola esecuzione dell'agente.
+
+    Salva gli step completati (azione + osservazione) e la risposta finale
+    nel checkpointer LangGraph, sotto il thread_id della richiesta.
+    """
+
+    def __init__(self, thread_id: str, checkpointer=None):
+        self.thread_id = thread_id
+        self.checkpointer = checkpointer or get_checkpointer()
+        self.config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+        self._version = 0
+        # Blocchi di risposta salvati con gli step ripristinati da load_steps
+        self.restored_blocks: List[Dict[str, Any]] = []
+        self._remember_thread()
+
+    def _remember_thread(self):
+        """Tiene traccia dei thread e rimuove i più vecchi oltre il limite"""
+        with _checkpointer_lock:
+            _known_threads.pop(self.thread_id, None)
+            _known_threads[self.thread_id] = None
+            expired = []
+            while len(_known_threads) > CHECKPOINT_MAX_RUNS:
+                expired.append(_known_threads.popitem(last=False)[0])
+        for thread_id in expired:
+            try:
+                self.checkpointer.delete_thread(thread_id)
+            except Exception as e:
+                print(f"⚠️ Impossibile eliminare il checkpoint {thread_id}: {e}")
+
+    def _load_values(self, ttl: int = CHECKPOINT_TTL) -> Dict[str, Any]:
+        saved = self.checkpointer.get_tuple(self.config)
+        if saved is None:
+            return {}
+        self._version = int(saved.checkpoint["channel_versions"].get("state", 0))
+        values = saved.checkpoint["channel_values"].get("state") or {}
+        saved_at = float((saved.metadata or {}).get("saved_at") or 0)
+        if time.time() - saved_at > (CHECKPOINT_FINAL_TTL if "final" in values else ttl):
+            self.discard()
+            return {}
+        return values
+
+    def _save_values(self, values: Dict[str, Any], step: int):
+        self._version += 1
+        checkpoint = empty_checkpoint()
+        checkpoint["channel_values"] = {"state": values}
+        checkpoint["channel_versions"] = {"state": self._version}
+        self.checkpointer.put(
+            self.config,
+            checkpoint,
+            {"source": "loop", "step": step, "writes": None, "parents": {}, "saved_at": time.time()},
+            {"state": self._version},
+        )
+
+    def load_steps(self) -> List[Tuple[AgentAction, Any]]:
+        """
+        Restituisce gli step già completati in un'esecuzione precedente.
+
+        I blocchi di risposta emessi da quegli step restano in `restored_blocks`:
+        i loro tool non vengono rieseguiti e non li emetterebbero di nuovo.
+        """
+        try:
+            values = self._load_values()
+            self.restored_blocks = values.get("blocks") or []
+            return [_load_step(step) for step in values.get("steps", [])]
+        except Exception as e:
+            print(f"⚠️ Checkpoint {self.thread_id} non leggibile, riparto da zero: {e}")
+            return []
+
+    def load_final(self) -> Optional[Dict[str, Any]]:
+        """
+        Restituisce la risposta finale se l'esecuzione era già terminata.
+
+        La risposta viene consegnata una sola volta, entro CHECKPOINT_FINAL_TTL:
+        poi il thread viene eliminato.
+        """
+        try:
+            final = self._load_values().get("final")
+        except Exception as e:
+            print(f"⚠️ Checkpoint {self.thread_id} non leggibile: {e}")
+            return None
+        if final:
+            self.discard()
+        return final
+
+    def save_steps(self, steps: List[Tuple[AgentAction, Any]], blocks: Optional[List[Dict[str, Any]]] = None):
+        """Salva tutti gli step completati finora (e i blocchi di risposta già emessi)"""
+        try:
+            values: Dict[str, Any] = {"steps": [_dump_step(action, observation) for action, observation in steps]}
+            if blocks:
+                values["blocks"] = blocks
+            self._save_values(values, len(steps))
+        except Exception as e:
+            print(f"⚠️ Impossibile salvare il checkpoint {self.thread_id}: {e}")
+
+    def save_final(self, result: Dict[str, Any]):
+        """Salva la risposta finale (al posto degli step): un retry la riceve senza rieseguire l'agente"""
+        try:
+            self._save_values({"final": result}, -1)
+        except Exception as e:
+            print(f"⚠️ Impossibile salvare il checkpoint {self.thread_id}: {e}")
+
+    def discard(self):
+        """Elimina il checkpoint della richiesta"""
+        with _checkpointer_lock:
+            _known_threads.pop(self.thread_id, None)
+        try:
+            self.checkpointer.delete_thread(self.thread_id)
+        except Exception as e:
+            print(f"⚠️ Impossibile eliminare il checkpoint {self.thread_id}: {e}")
+        self._version = 0
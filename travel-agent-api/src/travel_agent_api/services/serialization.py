@@ -0,0 +1,51 @@
+"""
+Serialization - JSON veloce (orjson) per le risposte HTTP e i risultati dei tool
+"""
+
+import json
+from typing import Any, Union
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    print("⚠️ orjson non disponibile: serializzazione con il modulo json standard")
+    orjson = None
+
+
+def dump_bytes(value: Any) -> bytes:
+    """JSON compatto (senza spazi, UTF-8 non escapato) in una sola passata"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # Es. interi oltre 64 bit: li gestisce il modulo standard
+            pass
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def dumps(value: Any) -> str:
+    return dump_bytes(value).decode("utf-8")
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """Risposta JSON di FastAPI serializzata con orjson invece di json.dumps"""
+
+    def render(self, content: Any) -> bytes:
+        return dump_bytes(content)
+
+
+def tool_payload(result: Any) -> str:
+    """
+    Risultato di un tool serializzato una volta sola.
+
+    L'agente ripete le osservazioni precedenti nel prompt a ogni iterazione:
+    restituendo già la stringa compatta, LangChain non riserializza il dict
+    a ogni step e la stessa stringa viene usata per i log e i checkpoint.
+    """
+    return result if isinstance(result, str) else dumps(result)
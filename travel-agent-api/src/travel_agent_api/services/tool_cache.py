@@ -0,0 +1,181 @@
+"""
+Tool Cache - Risultati di SerpAPI e dell'esperto storico con TTL e storico delle richieste
+"""
+
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from .cassettes import cached_lookup
+
+TOOL_CACHE_ENABLED = os.getenv("TOOL_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+TOOL_CACHE_MAX_ENTRIES = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "5000"))
+# Durata per tipo di risultato: le immagini e la storia cambiano poco, prezzi e disponibilità sì
+TOOL_CACHE_TTLS = {
+    "google_images": float(os.getenv("IMAGES_CACHE_TTL", str(7 * 86400))),
+    "google_hotels": float(os.getenv("HOTELS_CACHE_TTL", str(6 * 3600))),
+    "google_flights": float(os.getenv("FLIGHTS_CACHE_TTL", "3600")),
+    "historical_expert": float(os.getenv("HISTORICAL_CACHE_TTL", str(7 * 86400))),
+}
+# Storico delle richieste (una riga JSON per lookup) usato dal cache warmer
+REQUEST_HISTORY_FILE = os.getenv("REQUEST_HISTORY_FILE", "cache/request_history.jsonl")
+REQUEST_HISTORY_MAX_BYTES = int(os.getenv("REQUEST_HISTORY_MAX_BYTES", str(20 * 1024 * 1024)))
+
+# True mentre il cache warmer esegue le richieste: niente storico, il risultato è "warm"
+_warming: contextvars.ContextVar[bool] = contextvars.ContextVar("freya_cache_warming", default=False)
+
+
+@contextmanager
+def warming_scope() -> Iterator[None]:
+    """Le chiamate nel blocco ignorano la cache e salvano risultati marcati come pre-caricati"""
+    token = _warming.set(True)
+    try:
+        yield
+    finally:
+        _warming.reset(token)
+
+
+def _cache_key(namespace: str, args: Dict[str, Any]) -> str:
+    canonical = json.dumps(args, sort_keys=True, ensure_ascii=False, default=str)
+    return f"{namespace}:{hashlib.sha1(canonical.encode('utf-8')).hexdigest()}"
+
+
+class ToolCache:
+    """
+    Cache in memoria (LRU con TTL per namespace) dei risultati dei tool.
+
+    Ogni lookup fuori dal warm-up viene anche accodato allo storico delle
+    richieste, da cui il cache warmer ricava le ricerche più frequenti. Le
+    voci create dal warmer sono marcate, così si può misurare quante siano
+    state effettivamente servite agli utenti.
+    """
+
+    def __init__(self, max_entries: int = TOOL_CACHE_MAX_ENTRIES, history_file: str = REQUEST_HISTORY_FILE):
+        self.max_entries = max(1, max_entries)
+        self.history_file = history_file
+        self._lock = threading.Lock()
+        self._history_lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._stats: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {"hits": 0, "misses": 0, "stores": 0, "warmed": 0, "warmed_hits": 0, "evicted": 0}
+        )
+
+    @staticmethod
+    def ttl(namespace: str) -> float:
+        return TOOL_CACHE_TTLS.get(namespace, 3600.0)
+
+    # ---------------------------------------------------------------- storico
+
+    def _record(self, namespace: str, args: Dict[str, Any]):
+        line = json.dumps({"ts": time.time(), "ns": namespace, "args": args}, ensure_ascii=False, default=str)
+        try:
+            with self._history_lock:
+                directory = os.path.dirname(self.history_file)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                if os.path.exists(self.history_file) and os.path.getsize(self.history_file) > REQUEST_HISTORY_MAX_BYTES:
+                    # Si conserva un solo file precedente
+                    os.replace(self.history_file, self.history_file + ".1")
+                with open(self.history_file, "a", encoding="utf-8") as handle:
+                    handle.write(line + "\n")
+        except OSError as e:
+            print(f"⚠️ Storico delle richieste non aggiornato: {e}")
+
+    def history(self, since: float) -> List[Dict[str, Any]]:
+        """Richieste registrate dopo il timestamp `since` (file corrente e precedente)"""
+        records = []
+        with self._history_lock:
+            for path in (self.history_file + ".1", self.history_file):
+                if not os.path.exists(path):
+                    continue
+                with open(path, encoding="utf-8") as handle:
+                    for line in handle:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            continue  # riga troncata da un arresto improvviso
+                        if record.get("ts", 0) >= since:
+                            records.append(record)
+        return records
+
+    # ---------------------------------------------------------------- cache
+
+    def get(self, namespace: str, args: Dict[str, Any]) -> Optional[Any]:
+        """Risultato ancora valido per gli argomenti, o None"""
+        if not TOOL_CACHE_ENABLED or _warming.get():
+            return None
+        # Con una cassetta attiva il risultato è registrato (o servito nel replay)
+        return cached_lookup(namespace, args, lambda: self._lookup(namespace, args))
+
+    def _lookup(self, namespace: str, args: Dict[str, Any]) -> Optional[Any]:
+        self._record(namespace, args)
+        key = _cache_key(namespace, args)
+        with self._lock:
+            stats = self._stats[namespace]
+            entry = self._entries.get(key)
+            if entry is None or entry["expires"] < time.time():
+                stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            stats["hits"] += 1
+            if entry["warmed"] and entry["hits"] == 0:
+                stats["warmed_hits"] += 1
+            entry["hits"] += 1
+            return entry["value"]
+
+    def put(self, namespace: str, args: Dict[str, Any], value: Any):
+        """Memorizza un risultato riuscito"""
+        if not TOOL_CACHE_ENABLED:
+            return
+        key = _cache_key(namespace, args)
+        warmed = _warming.get()
+        with self._lock:
+            self._entries[key] = {
+                "value": value,
+                "expires": time.time() + self.ttl(namespace),
+                "warmed": warmed,
+                "hits": 0,
+                "namespace": namespace,
+            }
+            self._entries.move_to_end(key)
+            stats = self._stats[namespace]
+            stats["stores"] += 1
+            if warmed:
+                stats["warmed"] += 1
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._stats[evicted["namespace"]]["evicted"] += 1
+
+    def remaining_ttl(self, namespace: str, args: Dict[str, Any]) -> float:
+        """Secondi di validità residua (0 se assente o scaduto)"""
+        with self._lock:
+            entry = self._entries.get(_cache_key(namespace, args))
+            return max(0.0, entry["expires"] - time.time()) if entry else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit rate per namespace e quota delle voci pre-caricate poi servite"""
+        with self._lock:
+            namespaces = {}
+            for namespace, counts in self._stats.items():
+                lookups = counts["hits"] + counts["misses"]
+                namespaces[namespace] = {
+                    **counts,
+                    "entries": sum(1 for entry in self._entries.values() if entry["namespace"] == namespace),
+                    "hit_rate": round(counts["hits"] / lookups, 3) if lookups else None,
+                    "warmed_hit_ratio": round(counts["warmed_hits"] / counts["warmed"], 3) if counts["warmed"] else None,
+                }
+            return {
+                "enabled": TOOL_CACHE_ENABLED,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "namespaces": namespaces,
+            }
+
+
+tool_cache = ToolCache()
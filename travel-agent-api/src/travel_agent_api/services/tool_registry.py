@@ -0,0 +1,145 @@
+"""
+Tool Registry - Caricamento lazy dei tool e warm-up in background
+"""
+
+import importlib
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# Package radice (funziona sia come travel_agent_api che come src.travel_agent_api)
+_PACKAGE = __name__.rsplit(".", 2)[0]
+
+# SDK pesanti importati prima dei tool, per separarne il costo nel breakdown
+HEAVY_MODULES = [
+    "pydantic",
+    "langchain_core.tools",
+    "langchain_openai",
+    "langchain.agents",
+    "serpapi",
+    "numpy",
+]
+
+# (nome del tool nell'agente, modulo in tools/, attributo esportato)
+TOOL_SPECS = [
+    ("flights_finder", "flights_finder", "flights_finder_tool"),
+    ("hotels_finder", "hotels_finder", "hotels_finder_tool"),
+    ("hotels_next_page", "hotels_finder", "hotels_next_page_tool"),
+    ("historical_expert", "chain_historical_expert", "chain_historical_expert_tool"),
+    ("travel_plan", "chain_travel_plan", "chain_travel_plan_tool"),
+    ("images_finder", "images_finder", "images_finder_tool"),
+    ("images_batch", "images_finder", "images_batch_tool"),
+    ("destination_guide", "destination_guide", "create_destination_guide_tool"),
+    ("itinerary_with_images", "itinerary_with_images", "create_itinerary_with_images_tool"),
+    ("travel_documents_search", "travel_documents_search", "travel_documents_search_tool"),
+]
+
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
+
+class LazyToolRegistry:
+    """
+    Registro dei tool dell'agente caricati al primo utilizzo.
+
+    Nessun tool (e nessun SDK pesante) viene importato all'avvio del servizio:
+    il caricamento avviene alla prima richiesta oppure nel warm-up in
+    background. Il tempo di import di ogni modulo viene registrato.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tools: Optional[List[Tuple[str, Any]]] = None
+        self._import_times: Dict[str, float] = {}
+        self._errors: Dict[str, str] = {}
+        self._ready = threading.Event()
+        self._warmup_thread: Optional[threading.Thread] = None
+        self._warmup_seconds: Optional[float] = None
+
+    def _timed_import(self, module_name: str):
+        started = time.perf_counter()
+        try:
+            return importlib.import_module(module_name)
+        finally:
+            self._import_times[module_name] = round(time.perf_counter() - started, 4)
+
+    def load_tools(self) -> List[Tuple[str, Any]]:
+        """Importa (una sola volta) e restituisce i tool come coppie (nome, tool)"""
+        with self._lock:
+            if self._tools is not None:
+                return self._tools
+
+            for module_name in HEAVY_MODULES:
+                try:
+                    self._timed_import(module_name)
+                except ImportError as e:
+                    self._errors[module_name] = str(e)
+
+            tools = []
+            for name, module, attribute in TOOL_SPECS:
+                try:
+                    tool_module = self._timed_import(f"{_PACKAGE}.tools.{module}")
+                    tools.append((name, getattr(tool_module, attribute)))
+                except Exception as e:
+                    print(f"⚠️ Errore nell'importazione del tool '{name}': {e}")
+                    self._errors[name] = str(e)
+                    tools.append((name, None))
+
+            self._tools = tools
+            print("✅ Tool importati con successo")
+            return tools
+
+    def warm_up(self):
+        """Carica tool, servizio agente e client LLM prima della prima richiesta"""
+        started = time.perf_counter()
+        try:
+            self.load_tools()
+            agent_service = self._timed_import(f"{_PACKAGE}.services.agent_service")
+            # Crea il client LLM condiviso senza costruire un agente completo
+            agent_service.route_chat_model("agent", agent_service.AGENT_REQUIREMENTS)
+            # Indice BM25 della knowledge base in memory-map (compilato se il corpus è cambiato)
+            self._timed_import(f"{_PACKAGE}.services.knowledge_base").get_knowledge_base()
+        except Exception as e:
+            # Il processo non può servire: /ready resta 503 finché un nuovo warm-up non riesce
+            self._errors["warm_up"] = str(e)
+            print(f"⚠️ Warm-up non riuscito: {e}")
+        else:
+            self._errors.pop("warm_up", None)
+            self._ready.set()
+            print(f"🔥 Warm-up completato in {round(time.perf_counter() - started, 4)}s")
+        finally:
+            self._warmup_seconds = round(time.perf_counter() - started, 4)
+
+    def start_background_warm_up(self):
+        """Avvia il warm-up in un thread daemon (idempotente, ripetibile dopo un warm-up fallito)"""
+        with self._lock:
+            if self._ready.is_set() or (self._warmup_thread is not None and self._warmup_thread.is_alive()):
+                return
+            self._warmup_thread = threading.Thread(
+                target=self.warm_up, name="freya-warmup", daemon=True
+            )
+            self._warmup_thread.start()
+
+    @property
+    def ready(self) -> bool:
+        if "warm_up" in self._errors:
+            return False
+        return self._ready.is_set() or self._tools is not None
+
+    @property
+    def failed(self) -> bool:
+        """Ultimo warm-up terminato con un errore"""
+        return "warm_up" in self._errors
+
+    def stats(self) -> Dict[str, Any]:
+        """Stato del caricamento e tempi di import per modulo"""
+        return {
+            "ready": self.ready,
+            "tools_loaded": self._tools is not None,
+            "warmup_seconds": self._warmup_seconds,
+            "import_seconds": dict(self._import_times),
+            "errors": dict(self._errors),
+        }
+
+
+tool_registry = LazyToolRegistry()
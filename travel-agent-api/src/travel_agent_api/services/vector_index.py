@@ -0,0 +1,418 @@
+"""
+Vector Index - Indice vettoriale locale su documenti caricati e itinerari generati
+"""
+
+import contextvars
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pydantic import BaseModel, Field
+
+# Cartella dell'indice (una sottocartella per embedder e dimensione)
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "vector_index")
+VECTOR_INDEX_ENABLED = os.getenv("VECTOR_INDEX_ENABLED", "true").lower() in ("1", "true", "yes")
+# hashing (locale, offline) oppure openai
+VECTOR_EMBEDDER = os.getenv("VECTOR_EMBEDDER", "hashing")
+VECTOR_DIM = int(os.getenv("VECTOR_DIM", "256"))
+VECTOR_OPENAI_MODEL = os.getenv("VECTOR_OPENAI_MODEL", "text-embedding-3-small")
+VECTOR_CHUNK_CHARS = int(os.getenv("VECTOR_CHUNK_CHARS", "800"))
+VECTOR_CHUNK_OVERLAP = int(os.getenv("VECTOR_CHUNK_OVERLAP", "120"))
+# Righe della matrice moltiplicate per blocco durante la ricerca
+VECTOR_SEARCH_BLOCK = int(os.getenv("VECTOR_SEARCH_BLOCK", "131072"))
+
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+# Parole troppo frequenti per distinguere i passaggi (senza accenti, come dopo _normalize_text)
+_STOPWORDS = frozenset(
+    """
+    a ad al alla alle agli ai all allo anche che chi ci come con da dal dalla dalle dai degli dei del
+    della delle dello di e ed gli ha hai hanno ho i il in la le lo ma mi ne negli nei nel nella nelle
+    non o per piu quale quando questo questa se si sono su sua suo sul sulla ti tra tu un una uno
+    the of and or to in on at for from with is are was be by an as it this that
+    """.split()
+)
+
+
+def chunk_text(text: str, size: int = VECTOR_CHUNK_CHARS, overlap: int = VECTOR_CHUNK_OVERLAP) -> List[str]:
+    """Divide un testo in passaggi sovrapposti, tagliando preferibilmente tra paragrafi o frasi"""
+    text = (text or "").strip()
+    if len(text) <= size:
+        return [text] if text else []
+    chunks, start = [], 0
+    while start < len(text):
+        end = min(len(text), start + size)
+        if end < len(text):
+            cut = max(text.rfind("\n", start + size // 2, end), text.rfind(". ", start + size // 2, end))
+            if cut > start:
+                end = cut + 1
+        chunks.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return [chunk for chunk in chunks if chunk]
+
+
+# ---------------------------------------------------------------- embedder
+
+
+class Embedder:
+    """Interfaccia degli embedder: restituiscono vettori float32 normalizzati (L2)"""
+
+    name = "base"
+    dim = VECTOR_DIM
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        raise NotImplementedError
+
+
+@lru_cache(maxsize=200_000)
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _normalize_text(text: str) -> str:
+    """Minuscolo e senza accenti, così "città" e "citta" coincidono"""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def words(text: str) -> List[str]:
+    """Parole normalizzate del testo nell'ordine originale, stopword comprese"""
+    return _TOKEN_PATTERN.findall(_normalize_text(text))
+
+
+def tokenize(text: str) -> List[str]:
+    """Parole normalizzate del testo, senza stopword (condiviso con la knowledge base)"""
+    return [token for token in words(text) if token not in _STOPWORDS]
+
+
+class HashingEmbedder(Embedder):
+    """
+    Embedder locale basato sul feature hashing (nessuna rete, nessun modello).
+
+    Parole (escluse le stopword) e coppie di parole vengono mappate su `dim`
+    componenti con un hash stabile e un segno, con peso sublineare sulla
+    frequenza. Non cattura i sinonimi, ma funziona offline ed è
+    deterministico tra riavvii.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = VECTOR_DIM):
+        self.dim = dim
+
+    def _features(self, text: str) -> Dict[str, int]:
+        tokens = tokenize(text)
+        counts: Dict[str, int] = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for first, second in zip(tokens, tokens[1:]):
+            bigram = f"{first} {second}"
+            counts[bigram] = counts.get(bigram, 0) + 1
+        return counts
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in self._features(text).items():
+                hashed = _feature_hash(feature)
+                sign = 1.0 if hashed & 1 else -1.0
+                vectors[row, (hashed >> 1) % self.dim] += sign * (1.0 + np.log(count))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class OpenAIEmbedder(Embedder):
+    """Embedder OpenAI (richiede OPENAI_API_KEY e rete)"""
+
+    name = "openai"
+
+    def __init__(self, dim: int = VECTOR_DIM, model: str = VECTOR_OPENAI_MODEL):
+        from langchain_openai import OpenAIEmbeddings
+
+        from .llm_registry import LLM_MAX_RETRIES, LLM_REQUEST_TIMEOUT
+
+        self.dim = dim
+        self.name = f"openai-{model}"
+        self._client = OpenAIEmbeddings(
+            model=model,
+            dimensions=dim,
+            max_retries=LLM_MAX_RETRIES,
+            request_timeout=LLM_REQUEST_TIMEOUT,
+        )
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.asarray(self._client.embed_documents(list(texts)), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+EMBEDDERS = {
+    "hashing": HashingEmbedder,
+    "openai": OpenAIEmbedder,
+}
+
+
+def create_embedder(name: str = VECTOR_EMBEDDER, dim: int = VECTOR_DIM) -> Embedder:
+    """Crea l'embedder configurato (VECTOR_EMBEDDER)"""
+    try:
+        return EMBEDDERS[name](dim=dim)
+    except KeyError:
+        raise ValueError(f"Embedder sconosciuto: {name} (disponibili: {', '.join(EMBEDDERS)})")
+
+
+# ---------------------------------------------------------------- ambito
+
+
+class SearchScope(BaseModel):
+    owner: Optional[str] = Field(None, description="conversation_id della richiesta: i suoi itinerari generati.")
+    document_ids: List[str] = Field(default_factory=list, description="Documenti caricati inviati con la richiesta.")
+
+
+# Ambito della richiesta in corso: l'indice è condiviso tra tutti gli utenti
+_current_scope: contextvars.ContextVar[Optional[SearchScope]] = contextvars.ContextVar(
+    "freya_search_scope", default=None
+)
+
+
+def current_search_scope() -> Optional[SearchScope]:
+    """Documenti e itinerari che la richiesta in corso può leggere (None = nessuno)"""
+    return _current_scope.get()
+
+
+@contextmanager
+def search_scope(owner: Optional[str], document_ids: Optional[List[str]] = None) -> Iterator[Optional[SearchScope]]:
+    """Limita le ricerche e le nuove righe del codice eseguito nel blocco alla richiesta"""
+    scope = SearchScope(owner=owner, document_ids=list(document_ids or [])) if owner or document_ids else None
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+
+
+# ---------------------------------------------------------------- indice
+
+
+class VectorIndex:
+    """
+    Indice vettoriale su file, con matrice memory-mapped.
+
+    I vettori sono righe float32 di `vectors.f32`, aggiunte in coda senza
+    ricostruire nulla; i testi stanno in `chunks.jsonl` con gli offset in
+    `offsets.u64` per la lettura diretta. La ricerca moltiplica la matrice a
+    blocchi per uno o più vettori query e tiene i migliori k con argpartition.
+    """
+
+    def __init__(self, embedder: Optional[Embedder] = None, root: str = VECTOR_INDEX_DIR):
+        self.embedder = embedder or create_embedder()
+        self.dim = self.embedder.dim
+        self.path = os.path.join(root, f"{self.embedder.name}-{self.dim}")
+        os.makedirs(self.path, exist_ok=True)
+        self._vectors_path = os.path.join(self.path, "vectors.f32")
+        self._offsets_path = os.path.join(self.path, "offsets.u64")
+        self._chunks_path = os.path.join(self.path, "chunks.jsonl")
+        self._lock = threading.RLock()
+        self._matrix: Optional[np.memmap] = None
+        self._offsets: Optional[np.memmap] = None
+        self._count = 0
+        # Intervalli di righe per proprietario (owner), ricostruiti da chunks.jsonl al primo uso
+        self._owner_rows: Optional[Dict[str, List[List[int]]]] = None
+        self._stats = {"searches": 0, "search_seconds": 0.0, "appends": 0, "embed_seconds": 0.0}
+        self._recover()
+        self._remap()
+
+    def _recover(self):
+        """Allinea i file dopo un'interruzione durante un'aggiunta"""
+        row_bytes = self.dim * 4
+        for path in (self._vectors_path, self._offsets_path, self._chunks_path):
+            if not os.path.exists(path):
+                open(path, "wb").close()
+        vector_rows = os.path.getsize(self._vectors_path) // row_bytes
+        offset_rows = os.path.getsize(self._offsets_path) // 8
+        count = min(vector_rows, offset_rows)
+        if vector_rows != count or os.path.getsize(self._vectors_path) != count * row_bytes:
+            os.truncate(self._vectors_path, count * row_bytes)
+        if offset_rows != count:
+            os.truncate(self._offsets_path, count * 8)
+        self._count = count
+
+    def _remap(self):
+        if self._count == 0:
+            self._matrix, self._offsets = None, None
+            return
+        self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(self._count, self.dim))
+        self._offsets = np.memmap(self._offsets_path, dtype=np.uint64, mode="r", shape=(self._count,))
+
+    def __len__(self) -> int:
+        return self._count
+
+    # ---------------------------------------------------------------- scrittura
+
+    def add(self, texts: Sequence[str], metadatas: Optional[Sequence[Dict[str, Any]]] = None) -> Tuple[int, int]:
+        """Aggiunge passaggi in coda e restituisce l'intervallo di righe [inizio, fine)"""
+        texts = [text for text in texts if text and text.strip()]
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        if not texts:
+            return self._count, self._count
+
+        started = time.perf_counter()
+        vectors = np.ascontiguousarray(self.embedder.embed(texts), dtype=np.float32)
+        embed_seconds = time.perf_counter() - started
+
+        with self._lock:
+            start = self._count
+            offsets = np.empty(len(texts), dtype=np.uint64)
+            with open(self._chunks_path, "ab") as chunks_file:
+                position = chunks_file.tell()
+                for row, (text, meta) in enumerate(zip(texts, metadatas)):
+                    line = (json.dumps({**meta, "text": text}, ensure_ascii=False) + "\n").encode("utf-8")
+                    offsets[row] = position
+                    chunks_file.write(line)
+                    position += len(line)
+            # Prima i testi, poi gli offset, infine i vettori: _recover() tronca le righe incomplete
+            with open(self._offsets_path, "ab") as offsets_file:
+                offsets_file.write(offsets.tobytes())
+            with open(self._vectors_path, "ab") as vectors_file:
+                vectors_file.write(vectors.tobytes())
+            self._count += len(texts)
+            self._remap()
+            if self._owner_rows is not None:
+                for row, meta in enumerate(metadatas[: len(texts)], start):
+                    if meta.get("owner"):
+                        self._note_owner_row(meta["owner"], row)
+            self._stats["appends"] += len(texts)
+            self._stats["embed_seconds"] += embed_seconds
+            return start, self._count
+
+    def add_text(self, text: str, **meta: Any) -> Tuple[int, int]:
+        """Divide un testo in passaggi e li aggiunge con gli stessi metadati"""
+        chunks = chunk_text(text)
+        return self.add(chunks, [dict(meta, chunk=number) for number in range(len(chunks))])
+
+    def _note_owner_row(self, owner: str, row: int):
+        ranges = self._owner_rows.setdefault(owner, [])
+        if ranges and ranges[-1][1] == row:
+            ranges[-1][1] = row + 1
+        else:
+            ranges.append([row, row + 1])
+
+    def owner_rows(self, owner: str) -> List[Tuple[int, int]]:
+        """Intervalli di righe [inizio, fine) aggiunti con metadato owner"""
+        with self._lock:
+            if self._owner_rows is None:
+                self._owner_rows = {}
+                with open(self._chunks_path, "rb") as chunks_file:
+                    for row, line in zip(range(self._count), chunks_file):
+                        if b'"owner"' in line:
+                            row_owner = json.loads(line).get("owner")
+                            if row_owner:
+                                self._note_owner_row(row_owner, row)
+            return [tuple(pair) for pair in self._owner_rows.get(owner, [])]
+
+    # ---------------------------------------------------------------- ricerca
+
+    def _chunk(self, offsets: np.ndarray, row: int) -> Dict[str, Any]:
+        with open(self._chunks_path, "rb") as chunks_file:
+            chunks_file.seek(int(offsets[row]))
+            return json.loads(chunks_file.readline())
+
+    def search_vectors(
+        self,
+        queries: np.ndarray,
+        k: int = 5,
+        rows: Optional[Iterable[Tuple[int, int]]] = None,
+    ) -> List[List[Tuple[int, float]]]:
+        """Top-k (riga, punteggio) per ogni vettore query, eventualmente entro intervalli di righe"""
+        with self._lock:
+            matrix, count = self._matrix, self._count
+        if matrix is None or k <= 0:
+            return [[] for _ in range(len(queries))]
+
+        queries = np.ascontiguousarray(queries, dtype=np.float32).T  # (dim, n_query)
+        # rows=None: tutto l'indice; una lista vuota non seleziona nessuna riga
+        ranges = [(max(0, s), min(count, e)) for s, e in (rows if rows is not None else [(0, count)])]
+        best_rows: List[np.ndarray] = []
+        best_scores: List[np.ndarray] = []
+        for range_start, range_end in ranges:
+            for block_start in range(range_start, range_end, VECTOR_SEARCH_BLOCK):
+                block_end = min(range_end, block_start + VECTOR_SEARCH_BLOCK)
+                scores = matrix[block_start:block_end] @ queries  # (righe, n_query)
+                if scores.shape[0] > k:
+                    top = np.argpartition(-scores, k - 1, axis=0)[:k]
+                    scores = np.take_along_axis(scores, top, axis=0)
+                else:
+                    top = np.broadcast_to(np.arange(scores.shape[0])[:, None], scores.shape)
+                best_rows.append(top + block_start)
+                best_scores.append(scores)
+
+        if not best_rows:
+            return [[] for _ in range(queries.shape[1])]
+        all_rows = np.concatenate(best_rows, axis=0)
+        all_scores = np.concatenate(best_scores, axis=0)
+        results = []
+        for column in range(all_scores.shape[1]):
+            order = np.argsort(-all_scores[:, column])[:k]
+            results.append([(int(all_rows[i, column]), float(all_scores[i, column])) for i in order])
+        return results
+
+    def search(
+        self,
+        query: str,
+        k: int = 5,
+        rows: Optional[Iterable[Tuple[int, int]]] = None,
+        min_score: float = 0.0,
+    ) -> List[Dict[str, Any]]:
+        """Passaggi più simili alla query, con testo, metadati e punteggio"""
+        started = time.perf_counter()
+        hits = self.search_vectors(self.embedder.embed([query]), k=k, rows=rows)[0]
+        with self._lock:
+            offsets = self._offsets
+        results = []
+        for row, score in hits:
+            if score < min_score:
+                continue
+            results.append({**self._chunk(offsets, row), "score": round(score, 4), "row": row})
+        with self._lock:
+            self._stats["searches"] += 1
+            self._stats["search_seconds"] += time.perf_counter() - started
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        searches = stats.pop("searches")
+        search_seconds = stats.pop("search_seconds")
+        return {
+            "embedder": self.embedder.name,
+            "dim": self.dim,
+            "chunks": self._count,
+            "index_bytes": self._count * self.dim * 4,
+            "searches": searches,
+            "avg_search_ms": round(search_seconds / searches * 1000, 2) if searches else None,
+            "appends": stats["appends"],
+            "embed_seconds": round(stats["embed_seconds"], 3),
+        }
+
+
+_vector_index: Optional[VectorIndex] = None
+_vector_index_lock = threading.Lock()
+
+
+def get_vector_index() -> VectorIndex:
+    """Restituisce l'indice vettoriale condiviso dal processo"""
+    global _vector_index
+    with _vector_index_lock:
+        if _vector_index is None:
+            _vector_index = VectorIndex()
+            print(f"🧭 Indice vettoriale pronto: {len(_vector_index)} passaggi ({_vector_index.embedder.name})")
+        return _vector_index
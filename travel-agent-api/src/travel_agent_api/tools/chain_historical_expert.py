@@ -1,10 +1,32 @@
 from langchain_core.tools import tool
-from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
 import os
-from dotenv import load_dotenv
+from ..services.model_router import ModelRequirements, route_chat_model
+from ..services.knowledge_base import get_knowledge_base
+from ..services.tool_cache import tool_cache
 
-load_dotenv()
+# Schede storiche brevi: risposta rapida, contenuta e riproducibile
+HISTORICAL_EXPERT_REQUIREMENTS = ModelRequirements(
+      latency_target=15.0,
+      max_output_tokens=900,
+      deterministic=True,
+)
+
+# Con i testi della knowledge base come contesto basta una risposta più corta
+HISTORICAL_EXPERT_GROUNDED_REQUIREMENTS = ModelRequirements(
+      latency_target=10.0,
+      max_output_tokens=450,
+      deterministic=True,
+)
+
+
+def _format_knowledge_answer(document: dict) -> str:
+      """Risposta diretta dalla knowledge base offline (nessuna chiamata al modello)"""
+      return (
+            f"🏛️ **{document['title']}** ({document['place']})\n\n"
+            f"{document['text']}\n\n"
+            f"📚 _Fonte: knowledge base offline di Freya_"
+      )
 
 
 @tool
@@ -22,14 +44,30 @@ def chain_historical_expert(input_text: str) -> str:
       str: Informazioni storiche dettagliate e coinvolgenti.
       """
       try:
+            # Luoghi famosi: prima la knowledge base offline, poi eventualmente il modello
+            knowledge_base = get_knowledge_base()
+            match = knowledge_base.lookup(input_text) if knowledge_base else None
+            if match and match.outcome == "direct":
+                  print(f"📚 Risposta dalla knowledge base per: {input_text}")
+                  return _format_knowledge_answer(match.documents[0])
+
             if not os.getenv("OPENAI_API_KEY"):
                   return "❌ OPENAI_API_KEY non configurata. Aggiungi la chiave API nel file .env"
+
+            # Schede già generate (anche dal cache warmer) per lo stesso luogo
+            cache_args = {"input_text": " ".join(input_text.lower().split())}
+            cached = tool_cache.get("historical_expert", cache_args)
+            if cached is not None:
+                  print(f"♻️ Informazioni storiche dalla cache per: {input_text}")
+                  return cached
             
-            model = ChatOpenAI(
-                  model_name="gpt-4o-mini",
-                  temperature=0.7,
-                  openai_api_key=os.getenv("OPENAI_API_KEY")
-            )
+            # Modello scelto dal router in base alla latenza osservata
+            if match and match.outcome == "grounded":
+                  model = route_chat_model(
+                        "chain_historical_expert_grounded", HISTORICAL_EXPERT_GROUNDED_REQUIREMENTS
+                  )
+            else:
+                  model = route_chat_model("chain_historical_expert", HISTORICAL_EXPERT_REQUIREMENTS)
             
             system_prompt = """
             🏛️ Sei un esperto storico specializzato in storia del turismo e delle destinazioni di viaggio.
@@ -46,18 +84,35 @@ def chain_historical_expert(input_text: str) -> str:
             Sii professionale ma accessibile, rendendo la storia viva e interessante.
             """
             
+            user_prompt = "Fornisci informazioni storiche dettagliate su: {input}"
+            context = ""
+            if match and match.outcome == "grounded":
+                  # Testi verificati come base: risposta più breve e più affidabile
+                  context = "\n\n".join(
+                        f"{document['title']} ({document['place']}): {document['text']}"
+                        for document in match.documents
+                  )
+                  user_prompt = (
+                        "Usa come base queste informazioni verificate:\n{context}\n\n"
+                        "Rispondi in modo conciso (al massimo tre paragrafi) su: {input}"
+                  )
+            
             prompt = ChatPromptTemplate([
                   ("system", system_prompt), 
-                  ("user", "Fornisci informazioni storiche dettagliate su: {input}")
+                  ("user", user_prompt)
             ])
             
             chain = prompt | model
             print(f"🔍 Cercando informazioni storiche su: {input_text}")
             
-            result = chain.invoke({"input": input_text})
+            variables = {"input": input_text, "context": context} if context else {"input": input_text}
+            result = chain.invoke(variables)
             
             # Restituisce solo il contenuto del messaggio
-            return result.content if hasattr(result, 'content') else str(result)
+            content = result.content if hasattr(result, 'content') else str(result)
+            if content:
+                  tool_cache.put("historical_expert", cache_args, content)
+            return content
             
       except Exception as e:
             print(f"❌ Errore nell'esperto storico: {e}")
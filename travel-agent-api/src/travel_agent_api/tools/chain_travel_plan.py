@@ -1,13 +1,19 @@
 from langchain_core.tools import tool
-from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
 from pydantic import BaseModel , Field
-from typing import Optional
-from langchain_core.output_parsers import PydanticOutputParser
+from typing import Dict, List, Optional
 import os
-from dotenv import load_dotenv
+from ..services.model_router import ModelRequirements, route_chat_model
+from ..services.response_blocks import DayBlock, collecting_blocks, emit_blocks
+from ..services.route_optimizer import ROUTE_OPTIMIZATION_ENABLED, DayRoute, route_optimizer
+from ..services.vector_index import VECTOR_INDEX_ENABLED, current_search_scope, get_vector_index
 
-load_dotenv()
+# Itinerari completi: generazione lunga, tollera più latenza
+TRAVEL_PLAN_REQUIREMENTS = ModelRequirements(
+      latency_target=45.0,
+      max_output_tokens=3000,
+      deterministic=False,
+)
 
 class TravelPlanInput(BaseModel):
       start_date: str = Field(description="The start date of the trip (YYYY-MM-DD) e.g. 2024-12-13.")
@@ -24,12 +30,160 @@ class TravelPlanInputSchema(BaseModel):
       params : TravelPlanInput
 
 class TravelDayOutput(BaseModel):
+      day: int = Field(description="The day number, starting from 1.")
+      title: str = Field(description="A short title for the day, e.g. 'Roma antica'.")
       morning: str = Field(description="The activities for the morning.")
       afternoon: str = Field(description="The activities for the afternoon.")
-      evening: str = Field(description="The activities for the evening.")
+      evening: str = Field(description="The activities for the evening, including where to eat.")
+      attractions: list[str] = Field(
+            default_factory=list,
+            description="The exact names of the attractions visited this day, e.g. 'Colosseo', 'Fontana di Trevi'.",
+      )
 
 class TravelPlanOutput(BaseModel):
       travel_plan: list[TravelDayOutput]
+      tips: list[str] = Field(default_factory=list, description="Practical tips for the whole trip.")
+
+# Fasce della giornata nell'ordine in cui vengono mostrate
+DAY_SLOTS = [("morning", "🌅 Mattina"), ("afternoon", "☀️ Pomeriggio"), ("evening", "🌙 Sera")]
+
+# Tentativi di generazione se il modello restituisce un piano non valido
+TRAVEL_PLAN_ATTEMPTS = int(os.getenv("TRAVEL_PLAN_ATTEMPTS", "2"))
+
+def generate_travel_plan(params: TravelPlanInput) -> TravelPlanOutput:
+      """Genera l'itinerario strutturato (giorni, fasce orarie e attrazioni) per i parametri del viaggio"""
+      # Modello scelto dal router in base alla latenza osservata
+      model = route_chat_model("chain_travel_plan", TRAVEL_PLAN_REQUIREMENTS)
+      
+      system_prompt = f"""
+      🗺️ Sei un esperto travel planner specializzato nella creazione di itinerari personalizzati.
+      
+      Crea un piano di viaggio dettagliato con queste specifiche:
+      📅 Date: dal {params.start_date} al {params.end_date}
+      🏛️ Destinazione: {params.destination}
+      👥 Viaggiatori: {params.adults} adulti, {params.children} bambini
+      🎯 Stile di viaggio: {params.travel_style}
+      💰 Budget: {params.budget if params.budget else 'Non specificato'}
+      🎨 Attività preferite: {params.activities}
+      🥗 Restrizioni alimentari: {params.food_restriction if params.food_restriction else 'Nessuna'}
+      
+      Per ogni giorno descrivi mattina, pomeriggio e sera includendo:
+      - 🍽️ Suggerimenti per ristoranti (considerando le restrizioni alimentari)
+      - 🚌 Mezzi di trasporto consigliati
+      - 💵 Stime dei costi quando possibile
+      Elenca in `attractions` i nomi esatti delle attrazioni del giorno e in `tips`
+      i 💡 consigli pratici e tips locali per tutto il viaggio.
+      
+      Usa emoji per rendere l'itinerario più coinvolgente.
+      Rispondi sempre in italiano.
+      """
+      
+      prompt = ChatPromptTemplate([("human", "{input}")])
+      # Output strutturato via tool calling: niente JSON da estrarre dal testo;
+      # un piano che non rispetta lo schema viene richiesto di nuovo
+      structured_model = model.with_structured_output(
+            TravelPlanOutput, method="function_calling"
+      ).with_retry(stop_after_attempt=max(1, TRAVEL_PLAN_ATTEMPTS))
+      chain = prompt | structured_model
+      
+      print(f"🔍 Creando piano di viaggio per: {params.destination}")
+      return chain.invoke({"input": system_prompt})
+
+
+def optimize_routes(plan: TravelPlanOutput, destination: str) -> Dict[int, DayRoute]:
+      """
+      Riordina le attrazioni di ogni giorno nel percorso a piedi più breve
+      (rispettando le fasce) e restituisce i percorsi indicizzati per giorno
+      """
+      if not ROUTE_OPTIMIZATION_ENABLED:
+            return {}
+      routes: Dict[int, DayRoute] = {}
+      for day in plan.travel_plan:
+            try:
+                  route = route_optimizer.plan_day(
+                        day.attractions,
+                        [getattr(day, field) for field, _ in DAY_SLOTS],
+                        destination,
+                  )
+            except Exception as e:
+                  print(f"⚠️ Percorso del giorno {day.day} non ottimizzato: {e}")
+                  continue
+            day.attractions = route.order
+            routes[day.day] = route
+      return routes
+
+
+def _format_km(km: float) -> str:
+      return f"{km:.1f}".replace(".", ",")
+
+
+def render_route(route: DayRoute) -> str:
+      """Riga del percorso: "🚶 Percorso a piedi (2,1 km · ~28 min): Colosseo → Foro Romano (0,6 km) → …" """
+      legs = []
+      for stop in route.stops:
+            if stop.km is None:
+                  legs.append(stop.name)
+            elif stop.transit:
+                  legs.append(f"{stop.name} (🚇 {_format_km(stop.km)} km, meglio i mezzi)")
+            else:
+                  legs.append(f"{stop.name} ({_format_km(stop.km)} km)")
+      return (
+            f"🚶 **Percorso a piedi** ({_format_km(route.walking_km)} km · ~{route.walking_minutes} min): "
+            + " → ".join(legs)
+      )
+
+
+def render_travel_plan(
+      plan: TravelPlanOutput,
+      destination: str,
+      images: Optional[Dict[str, str]] = None,
+      routes: Optional[Dict[int, DayRoute]] = None,
+) -> str:
+      """
+      Markdown dell'itinerario in un solo passaggio sulla struttura.
+
+      `images` associa il nome di un'attrazione al markdown delle sue immagini,
+      inserito dopo le attività del giorno in cui l'attrazione compare;
+      `routes` aggiunge a ogni giorno il percorso a piedi tra le tappe.
+      """
+      parts: List[str] = [f"# 🗺️ Itinerario a {destination}\n"]
+      for day in plan.travel_plan:
+            parts.append(f"\n## Giorno {day.day}: {day.title}\n")
+            for field, label in DAY_SLOTS:
+                  parts.append(f"\n**{label}:** {getattr(day, field)}\n")
+            route = (routes or {}).get(day.day)
+            if route and len(route.stops) > 1:
+                  parts.append(f"\n{render_route(route)}\n")
+            for attraction in day.attractions:
+                  if images and attraction in images:
+                        parts.append(f"\n{images[attraction]}\n")
+      if plan.tips:
+            parts.append("\n## 💡 Consigli pratici\n")
+            parts.extend(f"- {tip}\n" for tip in plan.tips)
+      return "".join(parts)
+
+
+def day_blocks(
+      plan: TravelPlanOutput,
+      images: Optional[Dict[int, list]] = None,
+      routes: Optional[Dict[int, DayRoute]] = None,
+) -> List[DayBlock]:
+      """Schede dei giorni per la risposta a blocchi (`images` e `routes` indicizzati per numero del giorno)"""
+      blocks = []
+      for day in plan.travel_plan:
+            route = (routes or {}).get(day.day)
+            blocks.append(DayBlock(
+                  day=day.day,
+                  title=day.title,
+                  slots={field: getattr(day, field) for field, _ in DAY_SLOTS},
+                  attractions=day.attractions or None,
+                  images=(images or {}).get(day.day) or None,
+                  route=route.stops if route and route.stops else None,
+                  walking_km=route.walking_km if route and route.stops else None,
+                  walking_minutes=route.walking_minutes if route and route.stops else None,
+            ))
+      return blocks
+
 
 @tool(args_schema=TravelPlanInputSchema)
 def chain_travel_plan(params: TravelPlanInput) -> str:
@@ -49,44 +203,29 @@ def chain_travel_plan(params: TravelPlanInput) -> str:
             if not os.getenv("OPENAI_API_KEY"):
                   return "❌ OPENAI_API_KEY non configurata. Aggiungi la chiave API nel file .env"
             
-            model = ChatOpenAI(
-                  model_name="gpt-4o-mini",
-                  temperature=0.7,
-                  openai_api_key=os.getenv("OPENAI_API_KEY")
-            )
-            
-            system_prompt = f"""
-            🗺️ Sei un esperto travel planner specializzato nella creazione di itinerari personalizzati.
-            
-            Crea un piano di viaggio dettagliato con queste specifiche:
-            📅 Date: dal {params.start_date} al {params.end_date}
-            🏛️ Destinazione: {params.destination}
-            👥 Viaggiatori: {params.adults} adulti, {params.children} bambini
-            🎯 Stile di viaggio: {params.travel_style}
-            💰 Budget: {params.budget if params.budget else 'Non specificato'}
-            🎨 Attività preferite: {params.activities}
-            🥗 Restrizioni alimentari: {params.food_restriction if params.food_restriction else 'Nessuna'}
-            
-            Crea un itinerario giornaliero dettagliato che includa:
-            - 🌅 Attività mattutine
-            - ☀️ Attività pomeridiane  
-            - 🌙 Attività serali
-            - 🍽️ Suggerimenti per ristoranti (considerando le restrizioni alimentari)
-            - 🚌 Mezzi di trasporto consigliati
-            - 💡 Consigli pratici e tips locali
-            - 💵 Stime dei costi quando possibile
-            
-            Usa emoji per rendere l'itinerario più coinvolgente e struttura tutto in modo chiaro e leggibile.
-            Rispondi sempre in italiano.
-            """
-            
-            prompt = ChatPromptTemplate([("human", "{input}")])
-            chain = prompt | model
+            travel_plan = generate_travel_plan(params)
+            # Attrazioni di ogni giorno nell'ordine del percorso a piedi più breve
+            routes = optimize_routes(travel_plan, params.destination)
+            plan = render_travel_plan(travel_plan, params.destination, routes=routes)
+            if collecting_blocks():
+                  emit_blocks(*day_blocks(travel_plan, routes=routes))
             
-            print(f"🔍 Creando piano di viaggio per: {params.destination}")
-            result = chain.invoke({"input": system_prompt})
+            # Indicizza l'itinerario per ritrovarlo più avanti nella stessa conversazione
+            scope = current_search_scope()
+            if VECTOR_INDEX_ENABLED and scope is not None and scope.owner:
+                  try:
+                        get_vector_index().add_text(
+                              plan,
+                              source="itinerary",
+                              owner=scope.owner,
+                              destination=params.destination,
+                              start_date=params.start_date,
+                              end_date=params.end_date,
+                        )
+                  except Exception as e:
+                        print(f"⚠️ Itinerario non indicizzato: {e}")
             
-            return result.content if hasattr(result, 'content') else str(result)
+            return plan
             
       except Exception as e:
             print(f"❌ Errore nella creazione del piano di viaggio: {e}")
@@ -2,12 +2,26 @@
 Destination Guide Tool - Crea guide complete coordinando più tool
 """
 
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, List, Tuple
+
 from langchain_core.tools import tool
 from .chain_historical_expert import chain_historical_expert_tool
-from .images_finder import images_finder_tool
-from .hotels_finder import hotels_finder_tool
+from .images_finder import image_placeholders, search_images_batch
+from .hotels_finder import HotelsInput, search_hotels
+from .itinerary_with_images import render_hotels
+from ..services.admission_control import current_degradation
+from ..services.guide_store import guide_store
+from ..services.image_handles import image_handles
+from ..services.response_blocks import collect_blocks, collecting_blocks, emit_blocks, parse_blocks
 import re
 
+# Le guide non hanno date di viaggio: prezzi indicativi per un weekend tra un mese
+GUIDE_HOTEL_LEAD_DAYS = 30
+GUIDE_HOTEL_NIGHTS = 2
+
+
 @tool
 def create_destination_guide_tool(destination: str) -> str:
     """
@@ -19,30 +33,99 @@ def create_destination_guide_tool(destination: str) -> str:
     Returns:
         Guida completa con storia, immagini e informazioni pratiche
     """
+    # Guida pre-generata ancora fresca: nessuna chiamata a LLM o SerpAPI
+    guide = guide_store.fresh(destination)
+    if guide is not None:
+        print(f"📘 Guida di {destination} servita dal disco (revisione {guide['revision']})")
+        # I segnaposto della guida tornano espandibili nella risposta finale
+        image_handles.restore(guide["images"])
+        if collecting_blocks():
+            emit_blocks(*parse_blocks(guide["blocks"]))
+        return guide["markdown"]
+
     try:
-        print(f"🌟 Creando guida completa per {destination}")
+        started = time.monotonic()
+        complete_guide, blocks, problems = build_destination_guide(destination)
+        if problems:
+            # Guida mostrata così com'è ma non salvata: la prossima richiesta la rigenera
+            print(f"⚠️ Guida di {destination} non salvata: {'; '.join(problems)}")
+        else:
+            guide_store.save(
+                destination,
+                complete_guide,
+                blocks,
+                time.monotonic() - started,
+                images=image_handles.images_for(complete_guide),
+            )
+        if collecting_blocks():
+            emit_blocks(*parse_blocks(blocks))
+        return complete_guide
         
+    except Exception as e:
+        print(f"❌ Errore nella creazione guida per {destination}: {str(e)}")
+        return f"❌ Errore nella creazione della guida per {destination}: {str(e)}"
+
+
+def build_destination_guide(destination: str) -> Tuple[str, List[Dict[str, Any]], List[str]]:
+    """
+    Genera da zero la guida (markdown), le schede di immagini e hotel e
+    l'elenco delle parti non riuscite.
+
+    Solleva un'eccezione se la parte storica non è disponibile. Ricerche di
+    immagini o hotel fallite e la modalità ridotta (meno immagini) finiscono
+    nell'elenco dei problemi: la guida si può mostrare ma non va salvata.
+    """
+    print(f"🌟 Creando guida completa per {destination}")
+    problems: List[str] = []
+    degradation = current_degradation()
+    if degradation.level > 0:
+        problems.append(f"servizio in modalità ridotta (livello {degradation.level})")
+
+    # Le schede vengono raccolte sempre: la guida salvata serve anche le risposte a blocchi
+    with collect_blocks() as collector:
         # 1. Informazioni storiche e culturali
         print(f"📚 Recuperando informazioni storiche per {destination}")
-        historical_info = chain_historical_expert_tool(f"{destination} storia cultura monumenti principali attrazioni")
+        historical_info = chain_historical_expert_tool.invoke(
+            {"input_text": f"{destination} storia cultura monumenti principali attrazioni"}
+        )
+        if historical_info.startswith(("❌", "🚨")):
+            raise RuntimeError(historical_info)
         
         # 2. Estrai attrazioni specifiche dalle informazioni storiche
         attractions = extract_attractions_from_text(historical_info, destination)
         print(f"🏛️ Attrazioni identificate: {attractions}")
         
-        # 3. Cerca immagini per ogni attrazione specifica
+        # 3. Cerca in parallelo le immagini delle 4 attrazioni principali
+        queries = {attraction: f"{attraction} {destination}" for attraction in attractions[:4]}
+        print(f"🖼️ Cercando immagini per: {', '.join(queries)}")
+        found = search_images_batch(list(queries.values()), "monument tourist attraction landmark")
         images_content = ""
-        for i, attraction in enumerate(attractions[:4], 1):  # Limita a 4 attrazioni principali
-            print(f"🖼️ Cercando immagini per: {attraction}")
-            attraction_images = images_finder_tool(f"{attraction} {destination}", "monument tourist attraction landmark")
+        for attraction, query in queries.items():
+            result = found[query]
+            if isinstance(result, str):
+                problems.append(f"immagini di {attraction}: {result}")
+                attraction_images = result
+            else:
+                # Segnaposto [img:...]: gli URL restano lato server fino alla risposta finale
+                emit_blocks(*result)
+                attraction_images = " ".join(image_placeholders(query, result))
             images_content += f"\n### 📸 {attraction}\n{attraction_images}\n"
         
         # 4. Informazioni pratiche sugli alloggi
         print(f"🏨 Recuperando informazioni alloggi per {destination}")
-        hotels_info = hotels_finder_tool(destination, "", "")
-        
-        # 5. Combina tutto in una guida completa
-        complete_guide = f"""# 🌟 Guida Completa: {destination}
+        check_in = date.today() + timedelta(days=GUIDE_HOTEL_LEAD_DAYS)
+        check_out = check_in + timedelta(days=GUIDE_HOTEL_NIGHTS)
+        hotels = search_hotels(HotelsInput(
+            q=destination,
+            check_in_date=check_in.isoformat(),
+            check_out_date=check_out.isoformat(),
+        ))
+        if "error" in hotels:
+            problems.append(f"hotel: {hotels['error']}")
+        hotels_info = render_hotels(hotels)
+    
+    # 5. Combina tutto in una guida completa
+    complete_guide = f"""# 🌟 Guida Completa: {destination}
 
 ## 📖 Storia e Cultura
 {historical_info}
@@ -51,6 +134,8 @@ def create_destination_guide_tool(destination: str) -> str:
 {images_content}
 
 ## 🏨 Dove Alloggiare
+_Prezzi indicativi per {GUIDE_HOTEL_NIGHTS} notti dal {check_in.strftime('%d/%m/%Y')}_
+
 {hotels_info}
 
 ---
@@ -58,14 +143,10 @@ def create_destination_guide_tool(destination: str) -> str:
 - Usa "Pianifica itinerario {destination}" per un programma dettagliato
 - Chiedi "Voli per {destination}" per informazioni sui collegamenti aerei
 - Scopri "Cucina locale {destination}" per i piatti tipici da provare
-        """
-        
-        print(f"✅ Guida completa creata per {destination}")
-        return complete_guide
-        
-    except Exception as e:
-        print(f"❌ Errore nella creazione guida per {destination}: {str(e)}")
-        return f"❌ Errore nella creazione della guida per {destination}: {str(e)}"
+    """
+    
+    print(f"✅ Guida completa creata per {destination}")
+    return complete_guide, [block.model_dump(exclude_none=True) for block in collector.blocks], problems
 
 def extract_attractions_from_text(text: str, destination: str) -> list:
     """Estrae nomi di attrazioni da un testo storico"""
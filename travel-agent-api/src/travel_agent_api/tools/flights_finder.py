@@ -1,8 +1,11 @@
 import os
-from dotenv import load_dotenv
 from langchain_core.tools import tool
 from pydantic import BaseModel, Field
 from typing import Optional
+from ..services.airports import AirportNotFound, resolve_airports
+from ..services.resilience import serpapi_search
+from ..services.response_blocks import collecting_blocks, emit_blocks, flight_blocks
+from ..services.serialization import tool_payload
 
 try:
     from serpapi import GoogleSearch
@@ -16,12 +19,17 @@ except ImportError:
             print("❌ SerpAPI non disponibile")
             GoogleSearch = None
 
-load_dotenv()
+# Parti della risposta SerpAPI che descrivono la ricerca, non i voli
+_SERP_METADATA = ("search_metadata", "search_parameters")
 
 
 class FlightsInput(BaseModel):
-    departure_airport: str = Field(description="The departure airport code (IATA).")
-    arrival_airport: str = Field(description="The arrival airport code (IATA).")
+    departure_airport: str = Field(
+        description="The departure airport IATA code (e.g. FCO) or city name (e.g. Roma): cities are resolved to their airports."
+    )
+    arrival_airport: str = Field(
+        description="The arrival airport IATA code (e.g. JFK) or city name (e.g. New York): cities are resolved to their airports."
+    )
     outbound_date: str = Field(
         description="The outbound date (YYYY-MM-DD) e.g. 2024-12-13."
     )
@@ -39,23 +47,29 @@ class FlightsInputSchema(BaseModel):
 
 
 @tool(args_schema=FlightsInputSchema)
-def flights_finder(params: FlightsInput):
+def flights_finder(params: FlightsInput) -> str:
     """
     🛫 Cerca voli usando SerpAPI Google Flights.
     
     Questo tool utilizza l'API SerpAPI Google Flights per cercare voli disponibili.
     
     Parametri:
-        departure_airport (str): Il codice aeroporto di partenza (IATA).
-        arrival_airport (str): Il codice aeroporto di arrivo (IATA).
+        departure_airport (str): Codice IATA o città di partenza (es. "FCO" o "Roma").
+        arrival_airport (str): Codice IATA o città di arrivo (es. "JFK" o "New York").
         outbound_date (str): La data di partenza (YYYY-MM-DD) es. 2024-12-13.
         return_date (str): La data di ritorno (YYYY-MM-DD) es. 2024-12-19.
         adults (int): Il numero di adulti. Default 1.
         children (int): Il numero di bambini. Default 0.
         
     Returns:
-        dict: Un dizionario con le informazioni sui voli trovati.
+        str: JSON compatto con le informazioni sui voli trovati.
     """
+    # Serializzato una volta: l'agente non riconverte il dict a ogni iterazione
+    return tool_payload(search_flights(params))
+
+
+def search_flights(params: FlightsInput) -> dict:
+    """Voli trovati su Google Flights come dizionario (anche per chi li usa fuori dall'agente)"""
     if GoogleSearch is None:
         return {
             "error": "SERPAPI_API_KEY non configurata",
@@ -72,6 +86,17 @@ def flights_finder(params: FlightsInput):
                 "suggestion": "Aggiungi SERPAPI_API_KEY=tua_chiave_api nel file .env"
             }
         
+        # Città e codici risolti in locale: un aeroporto sbagliato non consuma una ricerca SerpAPI
+        try:
+            departure = resolve_airports(params.departure_airport)
+            arrival = resolve_airports(params.arrival_airport)
+        except AirportNotFound as e:
+            return {
+                "error": str(e),
+                "message": "Aeroporto non riconosciuto: nessuna ricerca voli eseguita",
+                "suggestions": e.suggestions,
+            }
+
         search_params = {
             "api_key": os.getenv("SERPAPI_API_KEY"),
             "engine": "google_flights",
@@ -79,17 +104,16 @@ def flights_finder(params: FlightsInput):
             "gl": "it",
             "currency": "EUR",
             "stops": "1",
-            "departure_id": params.departure_airport,
-            "arrival_id": params.arrival_airport,
+            "departure_id": departure,
+            "arrival_id": arrival,
             "outbound_date": params.outbound_date,
             "return_date": params.return_date,
             "adults": params.adults,
             "children": params.children,
         }
         
-        print(f"🔍 Cercando voli: {params.departure_airport} → {params.arrival_airport}")
-        search = GoogleSearch(search_params)
-        result = search.get_dict()
+        print(f"🔍 Cercando voli: {params.departure_airport} ({departure}) → {params.arrival_airport} ({arrival})")
+        result = serpapi_search(GoogleSearch, search_params)
         
         # Controlla se ci sono errori nell'API
         if "error" in result:
@@ -98,17 +122,22 @@ def flights_finder(params: FlightsInput):
                 "message": "Errore nella ricerca voli tramite SerpAPI"
             }
         
+        # Le opzioni migliori come schede per i client che chiedono la risposta a blocchi
+        if collecting_blocks():
+            emit_blocks(*flight_blocks(result))
+        
         # Formatta la risposta
         return {
             "success": True,
             "search_info": {
-                "from": params.departure_airport,
-                "to": params.arrival_airport,
+                "from": departure,
+                "to": arrival,
                 "departure": params.outbound_date,
                 "return": params.return_date,
                 "passengers": f"{params.adults} adulti, {params.children} bambini"
             },
-            "flights_data": result
+            # Metadati della ricerca SerpAPI (id, URL, parametri) inutili per l'agente
+            "flights_data": {key: value for key, value in result.items() if key not in _SERP_METADATA},
         }
         
     except Exception as e:
@@ -1,9 +1,12 @@
 import os
 from langchain_core.tools import tool
-from dotenv import load_dotenv
 from pydantic import BaseModel, Field
 from typing import Optional
 from enum import IntEnum
+from ..services.hotel_cursor import HOTEL_PAGE_SIZE, HotelCursorError, hotel_cursors
+from ..services.resilience import serpapi_search
+from ..services.response_blocks import emit_blocks, hotel_block
+from ..services.serialization import tool_payload
 
 try:
     from serpapi import GoogleSearch
@@ -17,8 +20,6 @@ except ImportError:
             print("❌ SerpAPI non disponibile")
             GoogleSearch = None
 
-load_dotenv()
-
 
 class HotelClassEnum(IntEnum):
     TWO = 2
@@ -42,6 +43,15 @@ class HotelsInput(BaseModel):
     hotel_class: Optional[int] = Field(
         2, description="The hotel class avaible from 2 to 5 . Defaults to 2."
     )
+    max_price: Optional[float] = Field(
+        None, description="Maximum price per night in EUR. Hotels above it are skipped."
+    )
+    min_rating: Optional[float] = Field(
+        None, description="Minimum guest rating from 1 to 5. Hotels below it are skipped."
+    )
+    page_size: Optional[int] = Field(
+        HOTEL_PAGE_SIZE, description="Number of hotels to return per page. Defaults to 5."
+    )
 
 
 class HotelsInputSchema(BaseModel):
@@ -49,7 +59,7 @@ class HotelsInputSchema(BaseModel):
 
 
 @tool(args_schema=HotelsInputSchema)
-def hotels_finder(params: HotelsInput):
+def hotels_finder(params: HotelsInput) -> str:
     """
     🏨 Cerca hotel usando SerpAPI Google Hotels.
 
@@ -62,10 +72,19 @@ def hotels_finder(params: HotelsInput):
     adults (int): Numero di adulti. Default 1.
     children (int): Numero di bambini. Default 0.
     hotel_class (int): Classe hotel da 2 a 5 stelle. Default 2.
+    max_price (float): Prezzo massimo per notte in EUR (opzionale).
+    min_rating (float): Valutazione minima degli ospiti da 1 a 5 (opzionale).
+    page_size (int): Hotel per pagina. Default 5.
 
     Returns:
-    dict: Un dizionario con le informazioni sugli hotel trovati.
+    str: JSON compatto con la prima pagina di hotel e il `cursor` da passare a hotels_next_page per averne altri.
     """
+    # Serializzato una volta: l'agente non riconverte il dict a ogni iterazione
+    return tool_payload(search_hotels(params))
+
+
+def search_hotels(params: HotelsInput) -> dict:
+    """Prima pagina di hotel come dizionario (anche per chi li usa fuori dall'agente)"""
     if GoogleSearch is None:
         return {
             "error": "SERPAPI_API_KEY non configurata",
@@ -83,7 +102,6 @@ def hotels_finder(params: HotelsInput):
             }
 
         search_params = {
-            "api_key": os.getenv("SERPAPI_API_KEY"),
             "engine": "google_hotels",
             "hl": "it",
             "gl": "it",
@@ -94,21 +112,13 @@ def hotels_finder(params: HotelsInput):
             "adults": params.adults,
             "children": params.children,
             "hotel_class": params.hotel_class,
-            "num": 5,
         }
 
         print(f"🔍 Cercando hotel a: {params.q}")
-        search = GoogleSearch(search_params)
-        result = search.get_dict()
-
-        # Controlla se ci sono errori
-        if "error" in result:
-            return {
-                "error": result["error"],
-                "message": "Errore nella ricerca hotel tramite SerpAPI",
-            }
-
-        hotels = result.get("properties", [])
+        # Le pagine successive si scaricano solo se richieste (hotels_next_page)
+        cursor = hotel_cursors.open(search_params, _fetch_hotels)
+        page = cursor.next_page(params.page_size or HOTEL_PAGE_SIZE, params.max_price, params.min_rating)
+        emit_blocks(*(hotel_block(hotel) for hotel in page["hotels"]))
 
         return {
             "success": True,
@@ -119,14 +129,65 @@ def hotels_finder(params: HotelsInput):
                 "guests": f"{params.adults} adulti, {params.children} bambini",
                 "hotel_class": f"{params.hotel_class} stelle",
             },
-            "hotels_found": len(hotels),
-            "hotels_data": hotels,
+            **page,
         }
 
+    except HotelCursorError as e:
+        return {"error": str(e), "message": "Errore nella ricerca hotel tramite SerpAPI"}
     except Exception as e:
         print(f"❌ Errore nella ricerca hotel: {e}")
         return {"error": str(e), "message": "Errore durante la ricerca degli hotel"}
 
 
+def _fetch_hotels(params: dict) -> dict:
+    """Scarica una pagina di Google Hotels (la chiave API non resta nello stato del cursore)"""
+    return serpapi_search(GoogleSearch, {**params, "api_key": os.getenv("SERPAPI_API_KEY")})
+
+
+@tool
+def hotels_next_page(
+    cursor: str,
+    max_price: Optional[float] = None,
+    min_rating: Optional[float] = None,
+    page_size: int = HOTEL_PAGE_SIZE,
+) -> str:
+    """
+    🏨 Restituisce altri hotel di una ricerca già fatta con hotels_finder.
+
+    Usalo quando l'utente vuole più opzioni o quando i filtri hanno escluso gli
+    hotel della prima pagina: gli hotel già mostrati non vengono ripetuti, quelli
+    esclusi dai filtri tornano con filtri più larghi.
+
+    Parametri:
+    cursor (str): Il valore `cursor` restituito da hotels_finder.
+    max_price (float): Prezzo massimo per notte in EUR (opzionale).
+    min_rating (float): Valutazione minima degli ospiti da 1 a 5 (opzionale).
+    page_size (int): Hotel da restituire. Default 5.
+
+    Returns:
+    str: JSON compatto con la pagina successiva di hotel e `has_more` se ce ne sono altri.
+    """
+    return tool_payload(next_hotels_page(cursor, max_price, min_rating, page_size))
+
+
+def next_hotels_page(
+    cursor: str,
+    max_price: Optional[float] = None,
+    min_rating: Optional[float] = None,
+    page_size: int = HOTEL_PAGE_SIZE,
+) -> dict:
+    """Pagina successiva di un cursore come dizionario"""
+    try:
+        page = hotel_cursors.get(cursor).next_page(page_size, max_price, min_rating)
+        emit_blocks(*(hotel_block(hotel) for hotel in page["hotels"]))
+        return {"success": True, **page}
+    except HotelCursorError as e:
+        return {"error": str(e)}
+    except Exception as e:
+        print(f"❌ Errore nella paginazione hotel: {e}")
+        return {"error": str(e), "message": "Errore durante il recupero di altri hotel"}
+
+
 # Crea un alias per mantenere compatibilità
 hotels_finder_tool = hotels_finder
+hotels_next_page_tool = hotels_next_page
@@ -1,6 +1,13 @@
 from langchain_core.tools import tool
+import contextvars
 import os
-from typing import Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Union
+from ..services.image_proxy import IMAGE_PROXY_ENABLED, get_image_proxy
+from ..services.admission_control import current_degradation
+from ..services.image_handles import image_handles, placeholder
+from ..services.resilience import serpapi_search
+from ..services.response_blocks import ImageBlock, emit_blocks
 
 # Import corretto per SerpAPI
 try:
@@ -16,81 +23,191 @@ except ImportError:
             print("❌ SerpAPI non disponibile. Installare con: poetry add google-search-results")
             GoogleSearch = None
 
+# Ricerche contemporanee di una richiesta a lotti (images_batch)
+IMAGE_BATCH_CONCURRENCY = int(os.getenv("IMAGE_BATCH_CONCURRENCY", "4"))
+# Attrazioni massime per chiamata di images_batch
+IMAGE_BATCH_MAX = 8
+
+
+class ImageSearchError(Exception):
+    """Ricerca senza immagini utilizzabili (il messaggio è già pronto per l'utente)"""
+
+
+def search_images(destination: str, image_type: str = "tourist attractions", limit: Optional[int] = None) -> List[ImageBlock]:
+    """Immagini raggiungibili per la destinazione, al massimo `limit` (e mai oltre il livello di degradazione)"""
+    if GoogleSearch is None:
+        raise ImageSearchError("❌ SerpAPI non configurato. Contatta l'amministratore del sistema.")
+
+    api_key = os.getenv("SERPAPI_API_KEY")
+    if not api_key:
+        raise ImageSearchError("❌ SERPAPI_API_KEY non configurata per la ricerca immagini")
+    
+    # Meno immagini per risposta quando il servizio è sotto carico
+    max_images = current_degradation().max_images
+    if limit is not None:
+        max_images = min(max_images, limit)
+    if max_images <= 0:
+        raise ImageSearchError(f"🖼️ Immagini di {destination} non disponibili in questo momento (servizio sotto carico)")
+    
+    print(f"🔍 Cercando immagini per: {destination} - Tipo: {image_type}")
+    
+    # Costruisci query di ricerca ottimizzata
+    search_query = f"{destination} {image_type}"
+    
+    # Parametri per Google Images via SerpAPI
+    params = {
+        "engine": "google_images",
+        "q": search_query,
+        "api_key": api_key,
+        "num": 8,
+        "safe": "active",
+        "tbs": "ic:color,itp:photo,isz:l"
+    }
+    
+    # Crea e esegui la ricerca
+    results = serpapi_search(GoogleSearch, params)
+    
+    if "error" in results:
+        raise ImageSearchError(f"❌ Errore nella ricerca immagini: {results['error']}")
+    
+    # Processa i risultati delle immagini
+    image_results = results.get("images_results", [])
+    
+    if not image_results:
+        raise ImageSearchError(f"❌ Nessuna immagine trovata per {destination}")
+    
+    # Scarta in parallelo le immagini con link non raggiungibili
+    image_results = [img for img in image_results if img.get("original") or img.get("link")]
+    if IMAGE_PROXY_ENABLED:
+        proxy = get_image_proxy()
+        candidates = image_results[:10]
+        reachable = set(proxy.filter_reachable(
+            img.get("original") or img.get("link") for img in candidates
+        ))
+        image_results = [
+            img for img in candidates
+            if (img.get("original") or img.get("link")) in reachable
+        ]
+        if not image_results:
+            raise ImageSearchError(f"❌ Nessuna immagine raggiungibile trovata per {destination}")
+    
+    blocks = []
+    for img in image_results[:max_images]:
+        # Miniatura servita dal proxy locale, link diretto all'originale
+        image_url = img.get("original") or img.get("link")
+        thumbnail_url = proxy.proxy_url(image_url) if IMAGE_PROXY_ENABLED else image_url
+        blocks.append(ImageBlock(
+            title=extract_attraction_name(img.get("title", ""), destination),
+            url=image_url,
+            thumbnail=thumbnail_url if thumbnail_url != image_url else None,
+            width=img.get("original_width"),
+            height=img.get("original_height"),
+            source=img.get("source"),
+        ))
+    return blocks
+
+
+def search_images_batch(
+    destinations: List[str],
+    image_type: str = "tourist attractions",
+    limit: Optional[int] = None,
+) -> Dict[str, Union[List[ImageBlock], str]]:
+    """
+    Più ricerche di immagini in parallelo (al massimo IMAGE_BATCH_CONCURRENCY).
+
+    Restituisce per ogni destinazione le immagini trovate o il messaggio di
+    errore; l'ordine è quello della richiesta.
+    """
+    destinations = list(dict.fromkeys(destinations))
+
+    def search(destination: str) -> Union[List[ImageBlock], str]:
+        try:
+            return search_images(destination, image_type, limit)
+        except ImageSearchError as e:
+            return str(e)
+        except Exception as e:
+            return f"❌ Errore nella ricerca immagini: {str(e)}"
+
+    if len(destinations) <= 1:
+        return {destination: search(destination) for destination in destinations}
+    # Ogni ricerca vede il contesto della richiesta (degradazione, cassetta, profilazione)
+    with ThreadPoolExecutor(
+        max_workers=min(IMAGE_BATCH_CONCURRENCY, len(destinations)),
+        thread_name_prefix="freya-images",
+    ) as pool:
+        futures = [
+            pool.submit(contextvars.copy_context().run, search, destination)
+            for destination in destinations
+        ]
+        return {destination: future.result() for destination, future in zip(destinations, futures)}
+
+
+def image_placeholders(subject: str, blocks: List[ImageBlock]) -> List[str]:
+    """Segnaposto `[img:...]` delle immagini, da passare al modello al posto degli URL"""
+    return [placeholder(handle) for handle in image_handles.register(subject, blocks)]
+
+
 @tool
 def images_finder_tool(destination: str, image_type: str = "tourist attractions") -> str:
     """
     Cerca immagini di destinazioni turistiche usando SerpAPI Google Images.
+    Restituisce un segnaposto `[img:...]` per immagine: copialo nella risposta
+    dove vuoi mostrarla.
     """
-    if GoogleSearch is None:
-        return "❌ SerpAPI non configurato. Contatta l'amministratore del sistema."
-    
     try:
-        api_key = os.getenv("SERPAPI_API_KEY")
-        if not api_key:
-            return "❌ SERPAPI_API_KEY non configurata per la ricerca immagini"
-        
-        print(f"🔍 Cercando immagini per: {destination} - Tipo: {image_type}")
-        
-        # Costruisci query di ricerca ottimizzata
-        search_query = f"{destination} {image_type}"
-        
-        # Parametri per Google Images via SerpAPI
-        params = {
-            "engine": "google_images",
-            "q": search_query,
-            "api_key": api_key,
-            "num": 8,
-            "safe": "active",
-            "tbs": "ic:color,itp:photo,isz:l"
-        }
-        
-        # Crea e esegui la ricerca
-        search = GoogleSearch(params)
-        results = search.get_dict()
-        
-        if "error" in results:
-            return f"❌ Errore nella ricerca immagini: {results['error']}"
-        
-        # Processa i risultati delle immagini
-        image_results = results.get("images_results", [])
-        
-        if not image_results:
-            return f"❌ Nessuna immagine trovata per {destination}"
-        
-        # Formatta la risposta con le immagini
-        response = f"🖼️ **Immagini di {destination}**\n\n"
-        response += f"Ho trovato {len(image_results[:6])} bellissime immagini per te:\n\n"
-        
-        for i, img in enumerate(image_results[:6], 1):
-            # Estrai il nome dell'attrazione dal titolo
-            attraction_name = extract_attraction_name(img.get("title", ""), destination)
-            
-            response += f"### {i}. {attraction_name}\n"
-            
-            # Link diretto all'immagine
-            image_url = img.get("original") or img.get("link") or ""
-            if image_url:
-                response += f"![{attraction_name}]({image_url})\n"
-                response += f"🔗 **[Visualizza a schermo intero]({image_url})**\n"
-            
-            # Informazioni aggiuntive
-            if img.get("original_width") and img.get("original_height"):
-                response += f"📐 **Dimensioni:** {img['original_width']} × {img['original_height']} px\n"
-            
-            if img.get("source"):
-                response += f"📍 **Fonte:** {img['source']}\n"
-            
-            response += "\n---\n\n"
-        
-        response += f"💡 **Suggerimento:** Clicca sui link per vedere le immagini in alta risoluzione!\n"
-        response += f"🔍 **Ricerca effettuata:** {search_query}\n"
-        response += f"🌟 **Destinazione:** {destination}"
-        
-        return response
-        
+        blocks = search_images(destination, image_type)
+    except ImageSearchError as e:
+        return str(e)
     except Exception as e:
         return f"❌ Errore nella ricerca immagini: {str(e)}"
 
+    # Le stesse immagini come schede per i client che chiedono la risposta a blocchi
+    emit_blocks(*blocks)
+
+    # Al modello solo titoli e segnaposto: URL e dimensioni restano lato server
+    lines = [f"🖼️ Immagini di {destination}:"]
+    for block, handle in zip(blocks, image_placeholders(destination, blocks)):
+        lines.append(f"{handle} {block.title}")
+    return "\n".join(lines)
+
+
+def _batch_limit(count: int) -> int:
+    """Immagini per attrazione: con molte attrazioni ne bastano meno per ciascuna"""
+    return 3 if count <= 3 else 2
+
+
+@tool
+def images_batch_tool(attractions: List[str], city: str = "", image_type: str = "tourist attractions monuments") -> str:
+    """
+    Cerca in una sola chiamata le immagini di più attrazioni (fino a 8), in parallelo.
+    Usalo al posto di più images_finder quando devi illustrare diverse tappe.
+
+    Args:
+        attractions: Nomi specifici delle attrazioni, es. ["Colosseo", "Fontana di Trevi"]
+        city: Città delle attrazioni, aggiunta a ogni ricerca (es. "Roma")
+        image_type: Tipo di immagini cercate
+
+    Returns:
+        Per ogni attrazione i segnaposto `[img:...]` da copiare nella risposta
+    """
+    attractions = [name.strip() for name in attractions if name and name.strip()][:IMAGE_BATCH_MAX]
+    if not attractions:
+        return "❌ Nessuna attrazione indicata"
+
+    queries = {attraction: f"{attraction} {city}".strip() for attraction in attractions}
+    results = search_images_batch(list(queries.values()), image_type, limit=_batch_limit(len(attractions)))
+
+    lines = []
+    for attraction, query in queries.items():
+        found = results[query]
+        if isinstance(found, str):
+            lines.append(f"{attraction}: {found}")
+            continue
+        emit_blocks(*found)
+        lines.append(f"{attraction}: {' '.join(image_placeholders(query, found))}")
+    return "\n".join(lines)
+
+
 def extract_attraction_name(title: str, destination: str) -> str:
     """Estrae il nome dell'attrazione dal titolo dell'immagine"""
     if not title:
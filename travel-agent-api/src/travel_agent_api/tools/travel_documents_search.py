@@ -0,0 +1,70 @@
+"""
+Travel Documents Search Tool - Recupera passaggi da documenti caricati e itinerari già generati
+"""
+
+from langchain_core.tools import tool
+from ..services.vector_index import VECTOR_INDEX_ENABLED, current_search_scope, get_vector_index
+
+# Punteggio minimo (similarità coseno) per considerare pertinente un passaggio
+_MIN_SCORE = 0.05
+
+
+@tool
+def travel_documents_search(query: str, source: str = "", k: int = 5) -> str:
+    """
+    🔎 Cerca nei documenti di viaggio inviati con la richiesta e negli itinerari già creati
+    nella stessa conversazione.
+
+    Restituisce solo i passaggi più pertinenti alla domanda, con la loro provenienza,
+    invece dei documenti interi.
+
+    Args:
+        query (str): Cosa cercare, es. "orario del volo di ritorno" o "ristoranti a Trastevere".
+        source (str): "document" per i soli documenti caricati, "itinerary" per i soli
+            itinerari generati, vuoto per entrambi.
+        k (int): Numero massimo di passaggi da restituire (default 5).
+
+    Returns:
+        str: Passaggi trovati in formato Markdown, con fonte e punteggio.
+    """
+    try:
+        if not VECTOR_INDEX_ENABLED:
+            return "❌ Indice dei documenti disattivato (VECTOR_INDEX_ENABLED=false)"
+
+        # Solo i documenti inviati con la richiesta e gli itinerari della sua conversazione
+        scope = current_search_scope()
+        if scope is None:
+            return "📭 Nessun documento caricato o itinerario creato in questa conversazione."
+
+        index = get_vector_index()
+        rows = []
+        if scope.document_ids and source != "itinerary":
+            from ..services.document_ingestion import get_document_ingestor
+
+            rows.extend(get_document_ingestor().vector_rows(scope.document_ids))
+        if scope.owner and source != "document":
+            rows.extend(index.owner_rows(scope.owner))
+        if not rows:
+            return "📭 Nessun documento caricato o itinerario creato in questa conversazione."
+
+        k = max(1, min(int(k or 5), 20))
+        hits = index.search(query, k=k, rows=rows, min_score=_MIN_SCORE)
+        if not hits:
+            return f"🔍 Nessun passaggio pertinente trovato per: {query}"
+
+        lines = [f"🔎 **Passaggi trovati per:** {query}\n"]
+        for number, hit in enumerate(hits, 1):
+            if hit.get("source") == "document":
+                origin = f"📄 {hit.get('filename')} (pagina {hit.get('page')})"
+            else:
+                origin = f"🗺️ Itinerario per {hit.get('destination', 'destinazione sconosciuta')}"
+            lines.append(f"**{number}. {origin}** — pertinenza {hit['score']:.2f}\n{hit['text']}\n")
+        return "\n".join(lines)
+
+    except Exception as e:
+        print(f"❌ Errore nella ricerca nei documenti: {e}")
+        return f"🚨 Errore durante la ricerca nei documenti: {str(e)}"
+
+
+# Crea un alias per mantenere compatibilità
+travel_documents_search_tool = travel_documents_search
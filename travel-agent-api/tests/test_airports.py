@@ -0,0 +1,66 @@
+"""
+Test della risoluzione di città e codici IATA sul dataset incluso nel package
+"""
+import pytest
+
+from travel_agent_api.services.airports import AirportIndex, AirportNotFound
+
+
+@pytest.fixture(scope="module")
+def index():
+    return AirportIndex()
+
+
+@pytest.mark.parametrize(
+    "query, codes",
+    [
+        ("Roma", ["FCO", "CIA"]),
+        ("Roma, Italia", ["FCO", "CIA"]),
+        ("Londra Gatwick", ["LGW"]),
+        ("New York JFK", ["JFK"]),
+        ("fco,cia", ["FCO", "CIA"]),
+        ("Kos", ["KGS"]),
+        ("Barcellonna", ["BCN"]),
+        ("Amsterdm", ["AMS"]),
+        ("Monacco di Baviera", ["MUC"]),
+    ],
+)
+def test_resolve(index, query, codes):
+    assert index.resolve(query) == codes
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        # Parole brevi dentro il nome che coincidono con codici o alias di altre città
+        "La Spezia",  # LA -> LAX
+        "La Maddalena",
+        "San Marino",  # SAN -> San Diego
+        "San Sebastian",
+        "SAN MARINO",
+        "Isola del Giglio",  # DEL -> Nuova Delhi
+        "Castel del Monte",
+        "Isle of Man",  # MAN -> Manchester
+    ],
+)
+def test_short_words_are_not_airports(index, query):
+    with pytest.raises(AirportNotFound) as error:
+        index.resolve(query)
+    assert error.value.query == query
+    assert len(error.value.suggestions) == len(set(error.value.suggestions))
+
+
+@pytest.mark.parametrize(
+    "query, suggestion",
+    [
+        # Città assenti dal dataset simili a un alias di un altro luogo: niente correzione automatica
+        ("Como", "Kos"),  # alias "Coo" -> KGS
+        ("Salerno", "Brindisi"),  # alias "Salento" -> BDS
+        # Due lettere scambiate in un nome breve: solo suggerimenti
+        ("Madird", "Madrid"),
+    ],
+)
+def test_ambiguous_typos_are_only_suggested(index, query, suggestion):
+    with pytest.raises(AirportNotFound) as error:
+        index.resolve(query)
+    assert suggestion in error.value.suggestions
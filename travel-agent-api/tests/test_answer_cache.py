@@ -0,0 +1,64 @@
+"""
+Test della cache delle risposte: varianti equivalenti, domande diverse che non devono collidere e domande escluse
+"""
+import pytest
+
+from travel_agent_api.services.answer_cache import AnswerCache, cacheable_question, normalize_question
+
+
+@pytest.mark.parametrize(
+    "first, second",
+    [
+        ("Itinerario 3 giorni a Roma", "tre giorni a Roma cosa vedere"),
+        ("Roma 3 giorni", "Organizza un viaggio di 3 giorni a Roma"),
+        ("Cose da fare a Roma con bambini", "Roma con i bambini"),
+    ],
+)
+def test_equivalent_questions_share_the_key(first, second):
+    assert normalize_question(first)[0] == normalize_question(second)[0]
+
+
+@pytest.mark.parametrize(
+    "first, second",
+    [
+        ("Voli da Roma a Milano", "Voli da Milano a Roma"),
+        ("Treno da Firenze per Venezia", "Treno da Venezia per Firenze"),
+        ("Ristoranti non costosi a Roma", "Ristoranti costosi a Roma"),
+        ("Roma con bambini", "Roma senza bambini"),
+        ("Roma prima di Firenze", "Firenze prima di Roma"),
+        ("3 giorni a Roma", "5 giorni a Roma"),
+    ],
+)
+def test_different_questions_do_not_collide(first, second):
+    assert normalize_question(first)[0] != normalize_question(second)[0]
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "Voli da Roma a Milano",
+        "Hotel economici a Napoli",
+        "Quanto è il prezzo del Colosseo?",
+        "Cosa fare a Roma domani",
+        "Meteo a Venezia oggi",
+        "Roma il 12 maggio",
+        "Firenze dal 12/05 al 15/05",
+    ],
+)
+def test_time_relative_questions_are_not_cacheable(question):
+    assert cacheable_question([{"role": "user", "content": question}]) is None
+
+
+def test_context_free_question_is_cacheable():
+    assert cacheable_question([{"role": "user", "content": "Itinerario 3 giorni a Roma"}]) == "Itinerario 3 giorni a Roma"
+    assert cacheable_question([{"role": "user", "content": "Roma"}], document_ids=["doc"]) is None
+
+
+def test_lookup_hits_only_the_same_canonical_question():
+    cache = AnswerCache(ttl=60, max_entries=10)
+    cache.store("Ristoranti costosi a Roma", "lista di ristoranti stellati", run_seconds=30)
+
+    assert cache.lookup("Roma, ristoranti costosi")["output"] == "lista di ristoranti stellati"
+    assert cache.lookup("Ristoranti non costosi a Roma") is None
+    assert cache.lookup("Ristoranti costosi a Roma", "json") is None
+    assert cache.stats()["hits"] == 1
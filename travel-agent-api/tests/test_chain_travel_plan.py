@@ -0,0 +1,131 @@
+"""
+Test dell'itinerario strutturato: generazione via tool calling e rendering
+"""
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from travel_agent_api.services.response_blocks import DayBlock, RouteStop
+from travel_agent_api.services.route_optimizer import DayRoute
+from travel_agent_api.tools import chain_travel_plan
+from travel_agent_api.tools.chain_travel_plan import (
+    TravelDayOutput,
+    TravelPlanInput,
+    TravelPlanOutput,
+    day_blocks,
+    generate_travel_plan,
+    render_travel_plan,
+)
+
+SAMPLE_PLAN = TravelPlanOutput(
+    travel_plan=[
+        TravelDayOutput(
+            day=1,
+            title="Roma antica",
+            morning="Visita al Colosseo 🏛️",
+            afternoon="Passeggiata nel Foro Romano",
+            evening="Cena a Monti 🍝",
+            attractions=["Colosseo", "Foro Romano"],
+        ),
+        TravelDayOutput(
+            day=2,
+            title="Barocco",
+            morning="Fontana di Trevi",
+            afternoon="Pantheon",
+            evening="Trastevere",
+        ),
+    ],
+    tips=["Acquista il Roma Pass"],
+)
+
+SAMPLE_ROUTE = DayRoute(
+    order=["Colosseo", "Foro Romano"],
+    stops=[
+        RouteStop(name="Colosseo", slot="morning", lat=41.8902, lon=12.4922),
+        RouteStop(name="Foro Romano", slot="afternoon", lat=41.8925, lon=12.4853, km=0.6, minutes=8),
+    ],
+    walking_km=0.6,
+    walking_minutes=8,
+)
+
+
+class _ToolCallingModel(BaseChatModel):
+    """Modello finto che risponde con le tool call indicate, una per invocazione"""
+
+    replies: List[dict]
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-tool-calling"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, **kwargs: Any) -> ChatResult:
+        args = self.replies[min(self.calls, len(self.replies) - 1)]
+        self.calls += 1
+        message = AIMessage(content="", tool_calls=[{"name": "TravelPlanOutput", "args": args, "id": f"call_{self.calls}"}])
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def _params() -> TravelPlanInput:
+    return TravelPlanInput(
+        start_date="2025-05-10",
+        end_date="2025-05-11",
+        destination="Roma",
+        travel_style="culture",
+        budget=None,
+        activities="culture",
+        food_restriction="",
+    )
+
+
+def test_generate_travel_plan_uses_structured_output(monkeypatch):
+    model = _ToolCallingModel(replies=[SAMPLE_PLAN.model_dump()])
+    monkeypatch.setattr(chain_travel_plan, "route_chat_model", lambda *args: model)
+
+    assert generate_travel_plan(_params()) == SAMPLE_PLAN
+    assert model.calls == 1
+
+
+def test_generate_travel_plan_retries_invalid_plan(monkeypatch):
+    # Primo tentativo senza i campi obbligatori dei giorni: viene richiesto di nuovo
+    model = _ToolCallingModel(replies=[{"travel_plan": [{"day": 1}]}, SAMPLE_PLAN.model_dump()])
+    monkeypatch.setattr(chain_travel_plan, "route_chat_model", lambda *args: model)
+
+    assert generate_travel_plan(_params()) == SAMPLE_PLAN
+    assert model.calls == 2
+
+
+def test_render_travel_plan():
+    images = {"Colosseo": "![Colosseo](https://example.com/colosseo.jpg)"}
+    markdown = render_travel_plan(SAMPLE_PLAN, "Roma", images=images, routes={1: SAMPLE_ROUTE})
+
+    assert markdown.startswith("# 🗺️ Itinerario a Roma\n")
+    assert "## Giorno 1: Roma antica" in markdown
+    assert "**🌅 Mattina:** Visita al Colosseo 🏛️" in markdown
+    assert "**🌙 Sera:** Trastevere" in markdown
+    assert "🚶 **Percorso a piedi** (0,6 km · ~8 min): Colosseo → Foro Romano (0,6 km)" in markdown
+    assert images["Colosseo"] in markdown
+    assert markdown.index("## Giorno 1") < markdown.index(images["Colosseo"]) < markdown.index("## Giorno 2")
+    assert markdown.endswith("## 💡 Consigli pratici\n- Acquista il Roma Pass\n")
+
+
+def test_day_blocks():
+    blocks = day_blocks(SAMPLE_PLAN, routes={1: SAMPLE_ROUTE})
+
+    assert [block.day for block in blocks] == [1, 2]
+    assert all(isinstance(block, DayBlock) for block in blocks)
+    first, second = blocks
+    assert first.slots == {
+        "morning": "Visita al Colosseo 🏛️",
+        "afternoon": "Passeggiata nel Foro Romano",
+        "evening": "Cena a Monti 🍝",
+    }
+    assert first.attractions == ["Colosseo", "Foro Romano"]
+    assert [stop.name for stop in first.route] == ["Colosseo", "Foro Romano"]
+    assert (first.walking_km, first.walking_minutes) == (0.6, 8)
+    assert second.attractions is None and second.route is None and second.walking_km is None
@@ -0,0 +1,94 @@
+"""
+Test del salvataggio delle guide: solo quelle complete finiscono nel guide store
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from travel_agent_api.services import guide_store as guide_store_module
+from travel_agent_api.services.admission_control import DEGRADATION_LEVELS, degradation_scope
+from travel_agent_api.services.guide_store import GuideNotFound, GuideStore
+from travel_agent_api.services.response_blocks import ImageBlock
+from travel_agent_api.tools import destination_guide
+
+HISTORY = "Il Colosseo è il simbolo di Roma.\nLa Fontana di Trevi è la fontana più famosa."
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = GuideStore(directory=str(tmp_path / "guides"))
+    monkeypatch.setattr(destination_guide, "guide_store", store)
+    monkeypatch.setattr(
+        destination_guide,
+        "chain_historical_expert_tool",
+        SimpleNamespace(invoke=lambda args: HISTORY),
+    )
+    monkeypatch.setattr(
+        destination_guide,
+        "search_images_batch",
+        lambda queries, image_type: {
+            query: [ImageBlock(title=query, url=f"https://example.com/{index}.jpg")]
+            for index, query in enumerate(queries)
+        },
+    )
+    monkeypatch.setattr(
+        destination_guide,
+        "search_hotels",
+        lambda params: {"success": True, "hotels": [{"name": "Hotel Roma", "rating": 4.5}]},
+    )
+    return store
+
+
+def _create(destination: str = "Roma") -> str:
+    return destination_guide.create_destination_guide_tool.invoke({"destination": destination})
+
+
+def test_complete_guide_is_saved(store):
+    markdown = _create()
+
+    assert "Hotel Roma" in markdown
+    assert store.get("Roma")["markdown"] == markdown
+
+
+def test_failed_image_search_is_not_saved(store, monkeypatch):
+    monkeypatch.setattr(
+        destination_guide,
+        "search_images_batch",
+        lambda queries, image_type: {query: "❌ Errore nella ricerca immagini: timeout" for query in queries},
+    )
+
+    assert "timeout" in _create()
+    with pytest.raises(GuideNotFound):
+        store.get("Roma")
+
+
+def test_failed_hotel_search_is_not_saved(store, monkeypatch):
+    monkeypatch.setattr(destination_guide, "search_hotels", lambda params: {"error": "quota esaurita"})
+
+    assert "Nessun hotel disponibile al momento (quota esaurita)" in _create()
+    with pytest.raises(GuideNotFound):
+        store.get("Roma")
+
+
+def test_degraded_guide_is_not_saved(store):
+    with degradation_scope(DEGRADATION_LEVELS[1]):
+        _create()
+    with pytest.raises(GuideNotFound):
+        store.get("Roma")
+
+
+def test_pipeline_reports_incomplete_guides(store, monkeypatch):
+    monkeypatch.setattr(destination_guide, "search_hotels", lambda params: {"error": "quota esaurita"})
+
+    report = guide_store_module.build_guides(["Roma"], concurrency=1, store=store)
+
+    assert report["built"] == []
+    assert "quota esaurita" in report["failed"]["Roma"]
+
+
+def test_etag_follows_freshness(store):
+    guide = store.save("Roma", "# Roma")
+    fresh_etag = store.cache_headers(guide)["ETag"]
+
+    store.max_age = 0
+    assert store.cache_headers(guide)["ETag"] != fresh_etag
@@ -0,0 +1,93 @@
+"""
+Test dell'upload dei documenti: corpo grezzo, form multipart del client web e immagini troppo grandi
+"""
+import io
+import os
+
+import docx
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from travel_agent_api import main
+from travel_agent_api.services import document_ingestion
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(document_ingestion, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    monkeypatch.setattr(document_ingestion, "PROCESSED_DIR", str(tmp_path / "processed"))
+    monkeypatch.setattr(document_ingestion, "_ingestor", None)
+    monkeypatch.setattr(document_ingestion, "OCR_WORKERS", 1)
+    yield TestClient(main.app)
+    ingestor = document_ingestion._ingestor
+    if ingestor is not None and ingestor._ocr_pool is not None:
+        ingestor._ocr_pool.shutdown(wait=True)
+
+
+def _docx(text: str) -> bytes:
+    document = docx.Document()
+    document.add_paragraph(text)
+    out = io.BytesIO()
+    document.save(out)
+    return out.getvalue()
+
+
+def _uploads() -> list:
+    return os.listdir(document_ingestion.UPLOAD_DIR)
+
+
+def test_raw_body_upload(client):
+    response = client.post("/documents?filename=volo.docx", content=_docx("Volo AZ610 per New York"))
+
+    assert response.status_code == 200
+    assert response.json()["document"]["filename"] == "volo.docx"
+    assert response.json()["document"]["pages"] == 1
+
+
+def test_multipart_upload(client):
+    response = client.post(
+        "/documents",
+        data={"title": "Prenotazione"},
+        files={"file": ("C:\\Users\\anna\\hotel.docx", _docx("Hotel Roma, check-in 14:00"), "application/octet-stream")},
+    )
+
+    assert response.status_code == 200
+    meta = response.json()["document"]
+    assert meta["filename"] == "hotel.docx"
+    pages = list(document_ingestion.get_document_ingestor().iter_document_pages(meta["document_id"]))
+    assert pages == [(1, "Hotel Roma, check-in 14:00")]
+
+
+def test_multipart_without_file(client):
+    response = client.post("/documents", data={"title": "Prenotazione"}, files={})
+
+    assert response.status_code == 400
+
+
+def test_raw_body_needs_filename(client):
+    assert client.post("/documents", content=b"data").status_code == 400
+
+
+def test_decompression_bomb_is_rejected_in_the_worker(client, monkeypatch):
+    # Il limite arriva ai worker spawn tramite l'ambiente, come in produzione
+    monkeypatch.setenv("OCR_MAX_IMAGE_PIXELS", "1000000")
+    out = io.BytesIO()
+    Image.new("1", (4000, 4000)).save(out, "PNG")
+    assert len(out.getvalue()) < 100_000
+
+    response = client.post("/documents?filename=scansione.png", content=out.getvalue())
+
+    assert response.status_code == 422
+    assert "Immagine non valida" in response.json()["detail"]
+    assert _uploads() == []
+
+
+def test_image_is_decoded_in_the_worker(client):
+    out = io.BytesIO()
+    Image.new("RGB", (200, 100), "white").save(out, "PNG")
+
+    response = client.post("/documents?filename=biglietto.png", content=out.getvalue())
+
+    assert response.status_code == 200
+    assert response.json()["document"]["pages"] == 1
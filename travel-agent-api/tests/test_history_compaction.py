@@ -0,0 +1,82 @@
+"""
+Test di strip_boilerplate: risposte di Freya in markdown e nell'HTML rimandato dal client web
+"""
+from travel_agent_api.services.history_compaction import strip_boilerplate
+
+# Vecchia risposta di images_finder, così come la scrive Freya
+MARKDOWN_ANSWER = """🖼️ **Immagini di Roma**
+
+Ho trovato 2 bellissime immagini per te:
+
+### 1. Colosseo
+![Colosseo](https://example.com/colosseo.jpg)
+🔗 **[Visualizza a schermo intero](https://example.com/colosseo.jpg)**
+📐 **Dimensioni:** 1920 × 1080 px
+📍 **Fonte:** wikipedia.org
+
+---
+
+### 2. Fontana di Trevi
+![Fontana di Trevi](https://example.com/trevi.jpg)
+📍 **Fonte:** turismoroma.it
+
+---
+
+- Il Colosseo apre alle *8:30*
+- Dettagli su https://www.coopculture.it
+💡 **Suggerimento:** prenota online per evitare la coda."""
+
+# Stessa risposta dopo Chatbot::processLinksForNewTab (web_TravelAgent/app/Livewire/Chatbot.php),
+# come torna nei messaggi della richiesta successiva
+LIVEWIRE_ANSWER = (
+    '🖼️ <strong>Immagini di Roma</strong><br />\n'
+    '<br />\n'
+    'Ho trovato 2 bellissime immagini per te:<br />\n'
+    '<br />\n'
+    '<h3>1. Colosseo</h3>\n'
+    '<img src="https://example.com/colosseo.jpg" alt="Colosseo" style="max-width: 50px; height: auto; display: inline-block; vertical-align: middle; margin: 0 5px;"><br />\n'
+    '🔗 <strong><a href="https://example.com/colosseo.jpg" target="_blank" rel="noopener noreferrer" style="color: #0066cc; text-decoration: underline;">Visualizza a schermo intero</a></strong><br />\n'
+    '📐 <strong>Dimensioni:</strong> 1920 × 1080 px<br />\n'
+    '📍 <strong>Fonte:</strong> wikipedia.org<br />\n'
+    '<br />\n'
+    '---<br />\n'
+    '<br />\n'
+    '<h3>2. Fontana di Trevi</h3>\n'
+    '<img src="https://example.com/trevi.jpg" alt="Fontana di Trevi" style="max-width: 50px; height: auto; display: inline-block; vertical-align: middle; margin: 0 5px;"><br />\n'
+    '📍 <strong>Fonte:</strong> turismoroma.it<br />\n'
+    '<br />\n'
+    '---<br />\n'
+    '<br />\n'
+    '<div style="margin: 5px 0; padding-left: 15px;">• Il Colosseo apre alle <em>8:30</em></div>\n'
+    '<div style="margin: 5px 0; padding-left: 15px;">• Dettagli su <a href="https://www.coopculture.it" target="_blank" rel="noopener noreferrer" style="color: #0066cc; text-decoration: underline;">https://www.coopculture.it</a></div>\n'
+    '💡 <strong>Suggerimento:</strong> prenota online per evitare la coda.'
+)
+
+EXPECTED = (
+    "🖼️ **Immagini di Roma**\n"
+    "\n"
+    "Ho trovato 2 bellissime immagini per te:\n"
+    "\n"
+    "### 2. Fontana di Trevi\n"
+    "\n"
+    "- Il Colosseo apre alle *8:30*\n"
+    "- Dettagli su\n"
+    "💡 **Suggerimento:** prenota online per evitare la coda."
+)
+
+
+def test_markdown_answer():
+    assert strip_boilerplate(MARKDOWN_ANSWER) == EXPECTED
+
+
+def test_livewire_html_answer():
+    stripped = strip_boilerplate(LIVEWIRE_ANSWER)
+
+    assert stripped == EXPECTED
+    assert "<" not in stripped and "example.com" not in stripped and "Fonte" not in stripped
+
+
+def test_empty_headings_are_dropped():
+    text = "# Roma\n## 📸 Colosseo\n\n### 📸 Pantheon\n![Pantheon](https://example.com/p.jpg)\n## Consigli\nPrenota prima.\n### Fine"
+
+    assert strip_boilerplate(text) == "## Consigli\nPrenota prima."
@@ -0,0 +1,80 @@
+"""
+Test dei cursori hotel: hotel scartati dai filtri e errori di SerpAPI sulle pagine successive
+"""
+import pytest
+from fastapi.testclient import TestClient
+
+from travel_agent_api import main
+from travel_agent_api.services import hotel_cursor as hotel_cursor_module
+from travel_agent_api.services.hotel_cursor import HotelCursorStore
+from travel_agent_api.services.resilience import CircuitOpenError
+
+
+class FakeSerpApi:
+    """Google Hotels finto: pagine di hotel con prezzo crescente, poi eventualmente un errore"""
+
+    def __init__(self, pages, error=None):
+        self.pages = pages
+        self.error = error
+        self.calls = 0
+
+    def __call__(self, params):
+        self.calls += 1
+        index = int(params.get("next_page_token") or 0)
+        if index >= len(self.pages):
+            raise self.error
+        result = {"properties": [{"name": name, "rate_per_night": {"extracted_lowest": price}} for name, price in self.pages[index]]}
+        if index + 1 < len(self.pages) or self.error is not None:
+            result["serpapi_pagination"] = {"next_page_token": str(index + 1)}
+        return result
+
+
+def _names(page):
+    return [hotel["name"] for hotel in page["hotels"]]
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = HotelCursorStore()
+    monkeypatch.setattr(hotel_cursor_module, "hotel_cursors", store)
+    return store
+
+
+def test_filtered_hotels_come_back_with_looser_filters(store):
+    fetch = FakeSerpApi([[("Economico", 60), ("Lusso", 400), ("Medio", 120)], [("Ostello", 30), ("Palazzo", 500)]])
+    cursor = store.open({"q": "Roma"}, fetch)
+
+    first = cursor.next_page(2, max_price=150)
+    assert _names(first) == ["Economico", "Medio"]
+    assert first["hotels_skipped"] == 1
+
+    # Senza filtri torna prima l'hotel scartato, poi i nuovi
+    second = cursor.next_page(2)
+    assert _names(second) == ["Lusso", "Ostello"]
+    assert _names(cursor.next_page(5)) == ["Palazzo"]
+    assert cursor.next_page(5)["hotels"] == []
+    assert fetch.calls == 2
+
+
+def test_upstream_failure_keeps_the_cursor_usable(store):
+    fetch = FakeSerpApi([[("Economico", 60), ("Medio", 120)]], error=CircuitOpenError("serpapi", 30.0))
+    cursor = store.open({"q": "Roma"}, fetch)
+    cursor.next_page(1)
+
+    # La pagina corta viene restituita: l'errore arriva solo quando non c'è nulla da mostrare
+    assert _names(cursor.next_page(5)) == ["Medio"]
+    with pytest.raises(hotel_cursor_module.HotelCursorError) as error:
+        cursor.next_page(5)
+    assert error.value.status_code == 502
+
+
+@pytest.mark.parametrize("error", [CircuitOpenError("serpapi", 30.0), TimeoutError("read timeout"), ValueError("bad json")])
+def test_route_maps_upstream_errors_to_502(store, error):
+    cursor = store.open({"q": "Roma"}, FakeSerpApi([[("Economico", 60)]], error=error))
+    client = TestClient(main.app)
+
+    assert client.get(f"/hotels/cursors/{cursor.handle}", params={"page_size": 1}).status_code == 200
+    response = client.get(f"/hotels/cursors/{cursor.handle}")
+    assert response.status_code == 502
+    assert "SerpAPI non disponibile" in response.json()["detail"]
+    assert client.get("/hotels/cursors/hmissing").status_code == 404
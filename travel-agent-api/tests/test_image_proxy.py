@@ -0,0 +1,104 @@
+"""
+Test del proxy immagini contro un host di immagini locale
+"""
+import io
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+from travel_agent_api.services import image_proxy as image_proxy_module
+from travel_agent_api.services.image_proxy import ImageProxy, ImageProxyError
+
+
+def _png(width: int, height: int) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 120, 40)).save(out, "PNG")
+    return out.getvalue()
+
+
+@pytest.fixture(scope="module")
+def upstream():
+    """Host di immagini: /colosseo.png esiste, /missing.png no, /page.html non è un'immagine"""
+    image = _png(1200, 800)
+    hits = Counter()
+
+    class Handler(BaseHTTPRequestHandler):
+        def _respond(self, body: bool):
+            hits[self.path] += 1
+            if self.path == "/colosseo.png":
+                status, content_type, payload = 200, "image/png", image
+            elif self.path == "/page.html":
+                status, content_type, payload = 200, "text/html", b"<html></html>"
+            else:
+                status, content_type, payload = 404, "text/plain", b"not found"
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            if body:
+                self.wfile.write(payload)
+
+        def do_GET(self):
+            self._respond(body=True)
+
+        def do_HEAD(self):
+            self._respond(body=False)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", hits
+    server.shutdown()
+
+
+@pytest.fixture
+def proxy(tmp_path):
+    return ImageProxy(cache_dir=str(tmp_path / "images"))
+
+
+def test_variant_is_resized_and_downloaded_once(proxy, upstream):
+    base, hits = upstream
+    hits.clear()
+    key = proxy.register(f"{base}/colosseo.png")
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: proxy.variant(key, 150), range(8)))
+
+    assert hits["/colosseo.png"] == 1
+    etag, data, media_type = results[0]
+    assert all(result == results[0] for result in results)
+    assert etag.endswith("-160")
+    assert media_type == image_proxy_module._VARIANT_MEDIA_TYPE
+    with Image.open(io.BytesIO(data)) as thumbnail:
+        assert thumbnail.width == 160
+    assert proxy.cache_headers(etag)["ETag"] == f'"{etag}"'
+
+
+def test_unreachable_image(proxy, upstream):
+    base, _ = upstream
+    key = proxy.register(f"{base}/missing.png")
+
+    with pytest.raises(ImageProxyError) as error:
+        proxy.variant(key, 160)
+    assert error.value.status_code == 502
+
+
+def test_filter_reachable_drops_dead_links(proxy, upstream):
+    base, _ = upstream
+    urls = [f"{base}/colosseo.png", f"{base}/missing.png", f"{base}/page.html", "http://127.0.0.1:9/closed.png"]
+
+    assert proxy.filter_reachable(urls) == [f"{base}/colosseo.png"]
+
+
+def test_locks_do_not_grow_with_urls(proxy):
+    locks = {id(proxy._lock_for(f"key-{number}")) for number in range(5000)}
+
+    assert len(locks) <= image_proxy_module._LOCK_STRIPES
+    assert proxy._lock_for("same-key") is proxy._lock_for("same-key")
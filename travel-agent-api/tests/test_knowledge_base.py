@@ -0,0 +1,31 @@
+"""
+Test della knowledge base offline: i nomi citati da soli trovano il loro testo
+"""
+import pytest
+
+from travel_agent_api.services.knowledge_base import KNOWLEDGE_MIN_SCORE, KnowledgeBase, build_index
+
+
+@pytest.fixture(scope="module")
+def knowledge_base(tmp_path_factory):
+    index_dir = str(tmp_path_factory.mktemp("knowledge") / "index")
+    build_index(index_dir=index_dir)
+    return KnowledgeBase(index_dir)
+
+
+@pytest.mark.parametrize("query, title", [("Colosseo", "Colosseo"), ("Parigi", "Parigi"), ("parigi", "Parigi")])
+def test_bare_name_lookup(knowledge_base, query, title):
+    match = knowledge_base.lookup(query)
+
+    # Punteggio sotto la soglia assoluta, ma il titolo corrisponde esattamente
+    assert match.score < KNOWLEDGE_MIN_SCORE
+    assert match.outcome == "direct"
+    assert match.documents[0]["title"] == title
+
+
+def test_monument_wins_over_its_city(knowledge_base):
+    assert knowledge_base.lookup("Colosseo Roma").documents[0]["title"] == "Colosseo"
+
+
+def test_unknown_subject_misses(knowledge_base):
+    assert knowledge_base.lookup("ricetta della carbonara").outcome == "miss"
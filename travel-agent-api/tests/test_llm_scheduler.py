@@ -0,0 +1,79 @@
+"""
+Test dello scheduler LLM con thread reali: priorità, aging delle chiamate in background e timeout
+"""
+import threading
+import time
+
+import pytest
+
+from travel_agent_api.services import llm_scheduler as scheduler_module
+from travel_agent_api.services.llm_scheduler import LLMScheduler, RateLimitWaitTimeout
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    monkeypatch.setattr(scheduler_module, "LLM_SCHEDULER_MAX_WAIT", 5.0)
+    monkeypatch.setattr(scheduler_module, "LLM_SCHEDULER_AGING", 60.0)
+    monkeypatch.setattr(scheduler_module, "LLM_INTERACTIVE_CALL_SITES", {"agent"})
+    # 600 richieste/min: uno slot ogni 0,1s, bucket vuoto in partenza
+    scheduler = LLMScheduler(rpm=600, tpm=1_000_000)
+    scheduler._requests.level = 0.0
+    return scheduler
+
+
+def _run(scheduler, calls):
+    """Avvia le chiamate (call_site, ritardo di partenza) e restituisce [(call_site, secondi)] in ordine di concessione"""
+    granted, errors = [], []
+    lock = threading.Lock()
+    started = time.monotonic()
+
+    def call(call_site, offset):
+        time.sleep(offset)
+        try:
+            scheduler.acquire(call_site, 1)
+        except RateLimitWaitTimeout as error:
+            with lock:
+                errors.append((call_site, error))
+            return
+        with lock:
+            granted.append((call_site, time.monotonic() - started))
+
+    threads = [threading.Thread(target=call, args=item) for item in calls]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    return granted, errors
+
+
+def test_interactive_calls_go_first(scheduler):
+    granted, errors = _run(scheduler, [("chain_weather", 0.0), ("agent", 0.03)])
+
+    assert errors == []
+    assert [site for site, _ in granted] == ["agent", "chain_weather"]
+
+
+def test_aged_background_call_wakes_up_by_itself(scheduler, monkeypatch):
+    monkeypatch.setattr(scheduler_module, "LLM_SCHEDULER_MAX_WAIT", 3.0)
+    monkeypatch.setattr(scheduler_module, "LLM_SCHEDULER_AGING", 0.7)
+    scheduler._requests.limit = 120  # uno slot ogni 0,5s
+
+    granted, errors = _run(scheduler, [("agent", 0.0), ("chain_weather", 0.03), ("agent", 0.06)])
+
+    assert errors == []
+    # Dopo LLM_SCHEDULER_AGING la chiamata in background passa davanti alla seconda interattiva
+    assert [site for site, _ in granted] == ["agent", "chain_weather", "agent"]
+    # ...e nessuno resta a dormire fino a LLM_SCHEDULER_MAX_WAIT
+    assert max(elapsed for _, elapsed in granted) < 2.2
+
+
+def test_wait_timeout_leaves_the_queue(scheduler, monkeypatch):
+    monkeypatch.setattr(scheduler_module, "LLM_SCHEDULER_MAX_WAIT", 0.3)
+    scheduler._paused_until = time.monotonic() + 10
+
+    granted, errors = _run(scheduler, [("agent", 0.0), ("chain_weather", 0.0)])
+
+    assert granted == []
+    assert sorted(site for site, _ in errors) == ["agent", "chain_weather"]
+    stats = scheduler.stats()
+    assert stats["queued"] == {} and stats["wait_timeouts"] == 2
@@ -0,0 +1,82 @@
+"""
+Test del profiler delle richieste: la profilazione non deve mai far fallire la richiesta
+"""
+import contextvars
+import cProfile
+import threading
+
+from travel_agent_api.services import request_profiler
+from travel_agent_api.services.request_profiler import ProfileStore, profile_request, profiled_call
+
+
+def _work():
+    return sum(number * number for number in range(20_000))
+
+
+def _in_tool_thread(fn):
+    """Come il ParallelAgentExecutor: il thread del tool riceve il contesto della richiesta"""
+    context = contextvars.copy_context()
+    thread = threading.Thread(target=context.run, args=(profiled_call, fn))
+    thread.start()
+    thread.join()
+
+
+class BusyProfile(cProfile.Profile):
+    """Come cProfile su Python 3.12+ quando un altro profiler è già attivo nel processo"""
+
+    def enable(self, *args, **kwargs):
+        raise ValueError("Another profiling tool is already active")
+
+
+def test_tool_threads_are_profiled(tmp_path):
+    store = ProfileStore(directory=str(tmp_path))
+    with profile_request("20260101-120000-abcdef", "test", store=store) as session:
+        _in_tool_thread(_work)
+
+    assert session.cpu_profiled
+    assert session.threads == (1 if request_profiler._PROCESS_WIDE_PROFILER else 2)
+    summary = store.get("20260101-120000-abcdef")
+    assert summary["cpu_profiled"] and summary["top_cumulative"]
+
+
+def test_busy_profiler_does_not_break_the_request(tmp_path, monkeypatch):
+    monkeypatch.setattr(request_profiler.cProfile, "Profile", BusyProfile)
+    store = ProfileStore(directory=str(tmp_path))
+
+    with profile_request("20260101-120000-abcdef", "test", store=store) as session:
+        assert profiled_call(_work) == _work()
+
+    assert not session.cpu_profiled and session.threads == 0
+    summary = store.get("20260101-120000-abcdef")
+    assert summary["cpu_profiled"] is False and summary["top_cumulative"] == []
+    assert summary["seconds"] >= 0
+
+
+def test_process_wide_profiler_skips_per_thread_profilers(monkeypatch):
+    monkeypatch.setattr(request_profiler, "_PROCESS_WIDE_PROFILER", True)
+
+    with profile_request("20260101-120000-abcdef", "test", store=None) as session:
+        _in_tool_thread(_work)
+
+    # Solo il profiler della richiesta, che da 3.12 vede anche i thread dei tool
+    assert session.threads == 1
+
+
+def test_concurrent_profiled_requests():
+    errors = []
+
+    def request(number):
+        try:
+            with profile_request(f"20260101-12000{number}-abcdef", "test", store=None):
+                profiled_call(_work)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=request, args=(number,)) for number in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert not request_profiler._tracemalloc_users
@@ -0,0 +1,106 @@
+"""
+Test di circuit breaker e hedging contro upstream finti (httpx.MockTransport)
+"""
+import threading
+import time
+
+import httpx
+import pytest
+
+from travel_agent_api.services import resilience
+from travel_agent_api.services.resilience import (
+    HEDGE_MIN_SAMPLES,
+    CircuitBreaker,
+    CircuitOpenError,
+    ResilientTransport,
+    Upstream,
+)
+
+
+class FakeUpstream:
+    """Upstream finto: la prima richiesta è lenta, le altre veloci; conta le richieste per metodo"""
+
+    def __init__(self, first_delay: float = 0.0, status_code: int = 200):
+        self.first_delay = first_delay
+        self.status_code = status_code
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        with self._lock:
+            self.calls.append(request.method)
+            first = len(self.calls) == 1
+        if first and self.first_delay:
+            time.sleep(self.first_delay)
+        return httpx.Response(self.status_code, json={"ok": True})
+
+
+def _warmed_upstream(name: str = "openai") -> Upstream:
+    """Upstream con hedging attivo e abbastanza campioni veloci per stimare il p95"""
+    upstream = Upstream(name, slow_call_seconds=5.0, hedge=True)
+    for _ in range(HEDGE_MIN_SAMPLES):
+        upstream.breaker.record(0.01, ok=True)
+    return upstream
+
+
+def _client(monkeypatch, fake: FakeUpstream) -> httpx.Client:
+    upstream = _warmed_upstream()
+    monkeypatch.setitem(resilience.UPSTREAMS, "openai", upstream)
+    return httpx.Client(transport=ResilientTransport(httpx.MockTransport(fake), "openai"))
+
+
+def test_completions_are_never_hedged(monkeypatch):
+    fake = FakeUpstream(first_delay=0.3)
+    client = _client(monkeypatch, fake)
+
+    response = client.post("https://api.openai.test/v1/chat/completions", json={"model": "gpt"})
+
+    assert response.status_code == 200
+    assert fake.calls == ["POST"]
+    assert resilience.UPSTREAMS["openai"].stats()["hedges"] == 0
+
+
+def test_slow_get_is_hedged(monkeypatch):
+    fake = FakeUpstream(first_delay=0.3)
+    client = _client(monkeypatch, fake)
+
+    started = time.monotonic()
+    response = client.get("https://api.openai.test/v1/models")
+
+    assert response.status_code == 200
+    assert time.monotonic() - started < 0.25
+    assert fake.calls == ["GET", "GET"]
+    stats = resilience.UPSTREAMS["openai"].stats()
+    assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+
+
+def test_breaker_opens_on_server_errors_and_closes_after_probe(monkeypatch):
+    fake = FakeUpstream(status_code=503)
+    client = _client(monkeypatch, fake)
+    breaker = CircuitBreaker("openai", slow_call_seconds=5.0, min_calls=4, open_seconds=0.1)
+    resilience.UPSTREAMS["openai"].breaker = breaker
+
+    for _ in range(4):
+        assert client.post("https://api.openai.test/v1/chat/completions").status_code == 503
+    with pytest.raises(CircuitOpenError):
+        client.post("https://api.openai.test/v1/chat/completions")
+    assert len(fake.calls) == 4
+
+    # Dopo open_seconds passa una sola chiamata di prova: se riesce il breaker si richiude
+    time.sleep(0.15)
+    fake.status_code = 200
+    assert client.post("https://api.openai.test/v1/chat/completions").status_code == 200
+    assert breaker.stats()["state"] == resilience.CLOSED
+
+
+def test_half_open_allows_a_single_probe():
+    breaker = CircuitBreaker("serpapi", slow_call_seconds=5.0, min_calls=2, open_seconds=0.05)
+    breaker.record(0.01, ok=False)
+    breaker.record(0.01, ok=False)
+    time.sleep(0.06)
+
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record(6.0, ok=True)  # prova lenta: di nuovo aperto
+    assert breaker.stats()["state"] == resilience.OPEN
@@ -0,0 +1,72 @@
+"""
+Test della readiness: un warm-up fallito non rende il processo pronto
+"""
+from travel_agent_api.services.tool_registry import LazyToolRegistry
+
+
+def _registry(monkeypatch, failing: set) -> LazyToolRegistry:
+    registry = LazyToolRegistry()
+    monkeypatch.setattr(registry, "load_tools", lambda: [])
+
+    class _Module:
+        AGENT_REQUIREMENTS = None
+
+        @staticmethod
+        def route_chat_model(*args):
+            return None
+
+        @staticmethod
+        def get_knowledge_base():
+            return None
+
+    def timed_import(module_name):
+        if module_name.rsplit(".", 1)[-1] in failing:
+            raise RuntimeError(f"{module_name} non disponibile")
+        return _Module
+
+    monkeypatch.setattr(registry, "_timed_import", timed_import)
+    return registry
+
+
+def test_failed_warm_up_is_not_ready(monkeypatch):
+    registry = _registry(monkeypatch, failing={"agent_service"})
+    registry.warm_up()
+
+    assert not registry.ready
+    assert registry.failed
+    assert "agent_service" in registry.stats()["errors"]["warm_up"]
+    assert registry.stats()["warmup_seconds"] is not None
+
+
+def test_failed_warm_up_hides_lazily_loaded_tools(monkeypatch):
+    registry = _registry(monkeypatch, failing={"knowledge_base"})
+    registry._tools = []
+    registry.warm_up()
+
+    assert not registry.ready
+
+
+def test_retry_after_failure(monkeypatch):
+    failing = {"agent_service"}
+    registry = _registry(monkeypatch, failing=failing)
+    registry.warm_up()
+    failing.clear()
+    registry.warm_up()
+
+    assert registry.ready
+    assert not registry.failed
+
+
+def test_ready_endpoint_reports_failure(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from travel_agent_api import main
+
+    registry = _registry(monkeypatch, failing={"agent_service"})
+    registry.warm_up()
+    monkeypatch.setattr(main, "tool_registry", registry)
+
+    response = TestClient(main.app).get("/ready")
+
+    assert response.status_code == 503
+    assert response.json()["status"] == "warm_up_failed"
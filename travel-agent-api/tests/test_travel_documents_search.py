@@ -0,0 +1,73 @@
+"""
+Test dell'ambito di travel_documents_search: l'indice è condiviso, i risultati no
+"""
+import docx
+import pytest
+
+from travel_agent_api.services import document_ingestion, vector_index
+from travel_agent_api.services.vector_index import HashingEmbedder, VectorIndex, search_scope
+from travel_agent_api.tools.travel_documents_search import travel_documents_search
+
+
+@pytest.fixture
+def shared_index(tmp_path, monkeypatch):
+    """Indice e pipeline di ingestione isolati in una cartella temporanea"""
+    monkeypatch.setattr(document_ingestion, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    monkeypatch.setattr(document_ingestion, "PROCESSED_DIR", str(tmp_path / "processed"))
+    monkeypatch.setattr(document_ingestion, "_ingestor", None)
+    index = VectorIndex(embedder=HashingEmbedder(dim=64), root=str(tmp_path / "index"))
+    monkeypatch.setattr(vector_index, "_vector_index", index)
+    return index
+
+
+def _upload(filename: str, text: str) -> str:
+    ingestor = document_ingestion.get_document_ingestor()
+    doc_id, kind, path = ingestor.new_document(filename)
+    document = docx.Document()
+    document.add_paragraph(text)
+    document.save(path)
+    ingestor.ingest(doc_id, kind, path, filename)
+    return doc_id
+
+
+def _search(query: str, **kwargs) -> str:
+    return travel_documents_search.invoke({"query": query, **kwargs})
+
+
+def test_owners_do_not_see_each_other(shared_index):
+    doc_a = _upload("volo_anna.docx", "Volo di ritorno AZ610 da New York, orario 18:40 del 12 maggio.")
+    doc_b = _upload("volo_bruno.docx", "Volo di ritorno LH1234 da Berlino, orario 07:15 del 3 giugno.")
+    shared_index.add_text("Giorno 1 a Roma: Colosseo e Fori Imperiali.", source="itinerary", owner="conv-a", destination="Roma")
+    shared_index.add_text("Giorno 1 a Parigi: Louvre e Tour Eiffel.", source="itinerary", owner="conv-b", destination="Parigi")
+
+    with search_scope("conv-a", [doc_a]):
+        flight = _search("orario del volo di ritorno")
+        itinerary = _search("giorno 1 itinerario", source="itinerary")
+    assert "volo_anna.docx" in flight and "AZ610" in flight
+    assert "volo_bruno.docx" not in flight and "LH1234" not in flight
+    assert "Roma" in itinerary and "Parigi" not in itinerary
+
+    with search_scope("conv-b", [doc_b]):
+        flight = _search("orario del volo di ritorno")
+    assert "LH1234" in flight and "AZ610" not in flight
+
+
+def test_no_scope_returns_nothing(shared_index):
+    _upload("volo_anna.docx", "Volo di ritorno AZ610 da New York, orario 18:40 del 12 maggio.")
+    shared_index.add_text("Giorno 1 a Roma: Colosseo.", source="itinerary", owner="conv-a", destination="Roma")
+
+    result = _search("orario del volo di ritorno")
+    assert "AZ610" not in result and "Roma" not in result
+
+    with search_scope("conv-c", []):
+        result = _search("volo di ritorno Roma")
+    assert "AZ610" not in result and "Roma" not in result
+
+
+def test_owner_rows_rebuilt_after_restart(shared_index, tmp_path):
+    shared_index.add_text("Giorno 1 a Roma: Colosseo.", source="itinerary", owner="conv-a", destination="Roma")
+    shared_index.add_text("Giorno 1 a Parigi: Louvre.", source="itinerary", owner="conv-b", destination="Parigi")
+
+    reopened = VectorIndex(embedder=HashingEmbedder(dim=64), root=str(tmp_path / "index"))
+    assert reopened.owner_rows("conv-a") == [(0, 1)]
+    assert reopened.owner_rows("conv-b") == [(1, 2)]